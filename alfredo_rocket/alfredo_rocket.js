@@ -1,5 +1,8 @@
 const { driver } = require('@rocket.chat/sdk');
-const axios = require('axios')
+const axios = require('axios');
+const http = require('http');
+const https = require('https');
+const { StringDecoder } = require('string_decoder');
 require('dotenv').config();
 
 // Environment Setup
@@ -11,6 +14,20 @@ const SSL = true;
 const ROOMS = [process.env.ROCKET_ROOM];
 const API_HOST = process.env.API_HOST;
 const API_TOKEN = process.env.API_TOKEN;
+// Messages of one room answered at the same time, the next ones wait their turn in order
+const ROOM_CONCURRENCY = parseInt(process.env.ROOM_CONCURRENCY || '1', 10);
+// Connections kept open to the API, shared by every room
+const API_MAX_SOCKETS = parseInt(process.env.API_MAX_SOCKETS || '20', 10);
+// Whose chat history a message continues: 'room_user' (each user in each room), 'room' or 'user'
+const HISTORY_SCOPE = process.env.HISTORY_SCOPE || 'room_user';
+
+// One client with keep-alive agents, so each message reuses an open connection to the API
+const api = axios.create({
+  baseURL: API_HOST,
+  headers: { 'Authorization': `Bearer ${API_TOKEN}` },
+  httpAgent: new http.Agent({ keepAlive: true, maxSockets: API_MAX_SOCKETS }),
+  httpsAgent: new https.Agent({ keepAlive: true, maxSockets: API_MAX_SOCKETS }),
+});
 
 let myUserId;
 
@@ -31,37 +48,91 @@ const runbot = async () => {
   console.log('Greeting message sent');
 }
 
+// Per room limiter: at most ROOM_CONCURRENCY answers running, the others queued in arrival order
+const rooms = new Map();
+
+const runInRoom = (roomId, task) => {
+  const room = rooms.get(roomId) || { running: 0, waiting: [] };
+  rooms.set(roomId, room);
+  return new Promise((resolve, reject) => {
+    room.waiting.push(() => task().then(resolve, reject));
+    startNext(roomId);
+  });
+}
+
+const startNext = (roomId) => {
+  const room = rooms.get(roomId);
+  while (room.running < ROOM_CONCURRENCY && room.waiting.length > 0) {
+    const next = room.waiting.shift();
+    room.running++;
+    next().finally(() => {
+      room.running--;
+      if (room.running === 0 && room.waiting.length === 0) {
+        rooms.delete(roomId);
+      } else {
+        startNext(roomId);
+      }
+    });
+  }
+}
+
+const historyId = (message) => {
+  if (HISTORY_SCOPE === 'room') return `rocket:${message.rid}`;
+  if (HISTORY_SCOPE === 'user') return `rocket:${message.u._id}`;
+  return `rocket:${message.rid}:${message.u._id}`;
+}
+
 // Process messages
 const processMessages = async(err, message, messageOptions) => {
   if (!err && messageOptions.roomParticipant) {
     if (message.u._id === myUserId) return;
-    const roomname = await driver.getRoomName(message.rid);
-    const headers = { 'Authorization': `Bearer ${API_TOKEN}` }
-    axios
-      .post(`${API_HOST}/chat`, {
-        query: message.msg,
-      }, 
-      { headers: headers })
-      .then(async res => {
-        byteLength = getByteLength(res.data);
-        if (byteLength > 4096) {
-          attachment = {
-            title: message.msg,
-            text: res.data,
-          }
-          await driver.sendToRoomId({attachments: [attachment] }, message.rid);
-        } else {
-          await driver.sendToRoomId(res.data, message.rid);
-        }
-      })
-      .catch(error => {
-        console.error(error);
-      });
+    runInRoom(message.rid, () => answer(message)).catch(error => {
+      console.error(error);
+    });
+  }
+}
+
+// Ask /chat/stream and send each part of the answer to the room as soon as it arrives
+const answer = async (message) => {
+  let response;
+  try {
+    response = await api.post('/chat/stream', {
+      query: message.msg,
+      user_id: historyId(message),
+    }, { responseType: 'stream' });
+  } catch (error) {
+    await sendError(error.response ? error.response.status : null, message.rid);
+    throw error;
+  }
+
+  // A chunk can end in the middle of a line, or of a character
+  const decoder = new StringDecoder('utf8');
+  let buffer = '';
+  for await (const chunk of response.data) {
+    buffer += decoder.write(chunk);
+    let newline;
+    while ((newline = buffer.indexOf('\n')) >= 0) {
+      const line = buffer.slice(0, newline).trim();
+      buffer = buffer.slice(newline + 1);
+      if (line) await handleLine(JSON.parse(line), message.rid);
     }
+  }
+}
+
+const handleLine = async (line, roomId) => {
+  if (line.type === 'part') {
+    await driver.sendToRoomId(line.text, roomId);
+  } else if (line.type === 'error') {
+    console.error('Chat failed', line.status, line.detail);
+    await sendError(line.status, roomId);
+  }
 }
 
-const getByteLength = (str) => {
-  return Buffer.byteLength(str, 'utf8');
+const sendError = async (status, roomId) => {
+  const text = status === 429
+    ? 'Estou recebendo muitas perguntas agora, tente novamente em instantes.'
+    : 'Perdão, não consegui responder a sua pergunta.';
+  await driver.sendToRoomId(text, roomId);
 }
 
-runbot()
\ No newline at end of file
+runbot()
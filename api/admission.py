@@ -0,0 +1,139 @@
+import os
+import asyncio
+
+CHAT_MAX_CONCURRENCY = int(os.getenv('CHAT_MAX_CONCURRENCY', 4))
+CHAT_MAX_CONCURRENCY_PER_USER = int(os.getenv('CHAT_MAX_CONCURRENCY_PER_USER', 1))
+CHAT_MAX_QUEUE = int(os.getenv('CHAT_MAX_QUEUE', 32))
+CHAT_QUEUE_TIMEOUT = float(os.getenv('CHAT_QUEUE_TIMEOUT', 30))
+
+class AdmissionRejected(Exception):
+    def __init__(self, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.detail = detail
+        self.retry_after = retry_after
+
+class AdmissionController:
+    """
+    Admission control for the chat endpoint.
+
+    Requests run with a global and a per-user concurrency limit. Requests waiting for
+    a slot are bounded by `max_queue` and `queue_timeout`, above that they are rejected
+    so the caller can back off. Identical requests (same coalescing key) that arrive
+    while one is in flight wait for its result instead of running again.
+
+    A request whose caller gives up keeps its slot until `func` is actually done, the
+    work in the thread pool can't be cancelled and still counts against the limits.
+    """
+
+    def __init__(self, max_concurrency: int = CHAT_MAX_CONCURRENCY, max_per_user: int = CHAT_MAX_CONCURRENCY_PER_USER,
+                 max_queue: int = CHAT_MAX_QUEUE, queue_timeout: float = CHAT_QUEUE_TIMEOUT):
+        self.max_per_user = max_per_user
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.global_slots = asyncio.Semaphore(max_concurrency)
+        self.user_slots = {}
+        self.user_requests = {}
+        self.in_flight = {}
+        self.waiting = 0
+        self.stats = {'admitted': 0, 'coalesced': 0, 'rejected': 0}
+
+    async def run(self, user_id: str, key, func):
+        """
+        Run the coroutine function `func` once admitted.
+
+        Args:
+            user_id (str): The user the per-user limit applies to
+            key: Coalescing key, None to never coalesce
+            func: Coroutine function producing the result
+
+        Raises:
+            AdmissionRejected: When the queue is full or the request waited too long for a slot
+        """
+        if key is not None and key in self.in_flight:
+            self.stats['coalesced'] += 1
+            return await asyncio.shield(self.in_flight[key])
+
+        if self.waiting >= self.max_queue:
+            self.stats['rejected'] += 1
+            raise AdmissionRejected("Too many requests waiting, try again later", retry_after=int(self.queue_timeout))
+
+        future = asyncio.get_running_loop().create_future()
+        if key is not None:
+            self.in_flight[key] = future
+
+        try:
+            await self.acquire(user_id)
+            self.stats['admitted'] += 1
+            task = asyncio.ensure_future(func())
+            try:
+                result = await asyncio.shield(task)
+            except asyncio.CancelledError:
+                task.add_done_callback(lambda task: self.release_done(user_id, task))
+                raise
+            except BaseException:
+                self.release(user_id)
+                raise
+            self.release(user_id)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            if not future.done():
+                # The leader is cancelled when its caller gives up, coalesced requests see that as a timeout
+                future.set_exception(asyncio.TimeoutError() if isinstance(e, asyncio.CancelledError) else e)
+                # Mark the exception as retrieved when nobody else is waiting for it
+                future.exception()
+            raise
+        finally:
+            if key is not None:
+                self.in_flight.pop(key, None)
+
+    async def acquire(self, user_id: str):
+        user_slots = self.user_slots.setdefault(user_id, asyncio.Semaphore(self.max_per_user))
+        self.user_requests[user_id] = self.user_requests.get(user_id, 0) + 1
+        if not user_slots.locked() and not self.global_slots.locked():
+            # Free slots are taken right away, only requests that have to wait count as queued
+            await self.acquire_slots(user_slots)
+            return
+
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self.acquire_slots(user_slots), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.forget_user(user_id)
+            self.stats['rejected'] += 1
+            raise AdmissionRejected("Timed out waiting for a free slot, try again later", retry_after=int(self.queue_timeout))
+        except BaseException:
+            self.forget_user(user_id)
+            raise
+        finally:
+            self.waiting -= 1
+
+    async def acquire_slots(self, user_slots: asyncio.Semaphore):
+        await user_slots.acquire()
+        try:
+            await self.global_slots.acquire()
+        except BaseException:
+            user_slots.release()
+            raise
+
+    def release_done(self, user_id: str, task: asyncio.Future):
+        if not task.cancelled():
+            # Retrieved so a failure of the abandoned work is not reported as never retrieved
+            task.exception()
+        self.release(user_id)
+
+    def release(self, user_id: str):
+        self.global_slots.release()
+        self.user_slots[user_id].release()
+        self.forget_user(user_id)
+
+    def forget_user(self, user_id: str):
+        # Per-user semaphores only live while the user has requests
+        self.user_requests[user_id] -= 1
+        if self.user_requests[user_id] == 0:
+            del self.user_requests[user_id]
+            del self.user_slots[user_id]
+
+def coalescing_key(user_id: str, vhost: str, query: str):
+    """Key of requests that can share one result: same user, vhost and query, ignoring case and spacing"""
+    return (user_id, vhost, ' '.join(query.lower().split()))
@@ -0,0 +1,98 @@
+import os
+import time
+import hmac
+import hashlib
+import secrets
+import threading
+from collections import OrderedDict
+import orjson
+from pkg.shared_state import shared_state
+
+DOWNLOAD_TTL = int(os.getenv('DOWNLOAD_TTL', 3600))
+DOWNLOAD_MAX_ENTRIES = int(os.getenv('DOWNLOAD_MAX_ENTRIES', 100))
+# Public URL of the API the download links point to, without it no download links are offered
+PUBLIC_BASE_URL = os.getenv('PUBLIC_BASE_URL', '').rstrip('/') or None
+# Key download links are signed with, the API token by default
+DOWNLOAD_SIGNING_KEY = os.getenv('DOWNLOAD_SIGNING_KEY') or os.getenv('API_TOKEN')
+
+class DownloadStore:
+    """
+    In-memory store for full results that are too big to be sent in a chat message.
+
+    Each entry keeps a factory that produces the content as an iterator of bytes,
+    so the payload is only encoded when somebody actually downloads it. Links are
+    signed with `signing_key` and expire with the entry, a chat user can open them
+    in the browser without the API token. Without a key no links are offered.
+
+    With `shared` state the link can be opened on any worker of the API, so the
+    content is encoded up front and written there instead of on download.
+    """
+
+    def __init__(self, ttl: int = DOWNLOAD_TTL, max_entries: int = DOWNLOAD_MAX_ENTRIES, shared=shared_state,
+                 signing_key: str = DOWNLOAD_SIGNING_KEY):
+        self.ttl = ttl
+        self.signing_key = signing_key
+        self.max_entries = max_entries
+        self.shared = shared
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def put(self, content_factory, media_type: str, filename: str) -> str:
+        download_id = secrets.token_urlsafe(16)
+        if self.shared is not None:
+            content = b''.join(chunk.encode() if isinstance(chunk, str) else chunk for chunk in content_factory())
+            self.shared.set('download', download_id, content, self.ttl)
+            self.shared.set('download_meta', download_id, orjson.dumps({'media_type': media_type, 'filename': filename}), self.ttl)
+            return download_id
+
+        with self.lock:
+            self.evict()
+            self.entries[download_id] = {
+                'content_factory': content_factory,
+                'media_type': media_type,
+                'filename': filename,
+                'expires_at': time.monotonic() + self.ttl,
+            }
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return download_id
+
+    def can_link(self) -> bool:
+        return bool(self.signing_key)
+
+    def url(self, base_url: str, download_id: str) -> str:
+        """Signed link to an entry, valid for `ttl` seconds"""
+        expires = int(time.time()) + self.ttl
+        return f"{base_url}/downloads/{download_id}?expires={expires}&signature={self.sign(download_id, expires)}"
+
+    def sign(self, download_id: str, expires: int) -> str:
+        message = f"{download_id}:{expires}".encode()
+        return hmac.new(self.signing_key.encode(), message, hashlib.sha256).hexdigest()
+
+    def verify(self, download_id: str, expires: int, signature: str) -> bool:
+        """Whether a link is signed by this store and not yet expired"""
+        if not self.signing_key or expires < time.time():
+            return False
+        return hmac.compare_digest(self.sign(download_id, expires), signature)
+
+    def get(self, download_id: str):
+        if self.shared is not None:
+            return self.get_shared(download_id)
+        with self.lock:
+            self.evict()
+            return self.entries.get(download_id)
+
+    def get_shared(self, download_id: str):
+        meta = self.shared.get('download_meta', download_id)
+        content = self.shared.get('download', download_id)
+        if meta is None or content is None:
+            return None
+        return {**orjson.loads(meta), 'content_factory': lambda: iter([content])}
+
+    def evict(self):
+        now = time.monotonic()
+        expired = [key for key, entry in self.entries.items() if entry['expires_at'] <= now]
+        for key in expired:
+            del self.entries[key]
+
+download_store = DownloadStore()
@@ -1,6 +1,29 @@
+import os
 import re
-import json
+import orjson
 import pandas as pd
+from pkg.digest import MESSAGE_GROUP_KEYS, COUNT_COLUMNS, count_message_groups
+
+DATAFRAME_MAX_ROWS = int(os.getenv('DATAFRAME_MAX_ROWS', 50))
+JSON_MAX_ITEMS = int(os.getenv('JSON_MAX_ITEMS', 20))
+JSON_MAX_GROUPS = int(os.getenv('JSON_MAX_GROUPS', 20))
+JSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+# Bytes of each message when a long answer is sent as several, see split_message
+MESSAGE_MAX_BYTES = int(os.getenv('MESSAGE_MAX_BYTES', 4000))
+
+FENCE_PATTERN = re.compile(r'^\s*(```|~~~)')
+TABLE_ROW_PATTERN = re.compile(r'^\s*\|.*\|\s*$')
+HEADING_PATTERN = re.compile(r'^(#{1,6})\s+(.+)$')
+HEADING_EMPHASIS_PATTERN = re.compile(r'\*\*')
+BULLET_PATTERN = re.compile(r'^(\s*)[-*+]\s+(.*)$')
+INLINE_MARKERS_PATTERN = re.compile(r'[*~\[`]')
+# Inline code comes first so its content is never translated
+INLINE_PATTERN = re.compile(
+    r'(?P<code>`[^`\n]+`)'
+    r'|(?P<link>\[(?P<link_text>[^\]\n]+)\]\((?P<link_url>[^)\s]+)\))'
+    r'|\*\*(?P<bold>[^*\n]+)\*\*'
+    r'|~~(?P<strike>[^~\n]+)~~'
+)
 
 def format_text_to_google_chat(text):
     """
@@ -28,94 +51,298 @@ def format_inline_markdown(text):
     """
     Format inline markdown elements to Google Chat's supported formatting
     
+    The text is translated line by line in a single pass: fenced code blocks are
+    kept verbatim, tables are wrapped in a monospace block and every other line
+    goes through one precompiled inline pattern.
+    
     Args:
         text (str): The text with markdown formatting
         
     Returns:
         str: Text with Google Chat formatting
     """
-    # Convert markdown headings (# Heading) to bold + italic
-    lines = text.split('\n')
-    for i, line in enumerate(lines):
-        heading_match = re.match(r'^(#{1,6})\s+(.+)$', line)
-        if heading_match:
-            # Extract the heading level and content
-            heading_content = heading_match.group(2).strip()
-            # Convert heading to bold + italic (Google Chat: *_text_*)
-            lines[i] = f"*_{heading_content}_*"
-    
-    # Rejoin lines after heading processing
-    text = '\n'.join(lines)
-    
-    # Replace bold (**text** or *text*) with *text* (Google Chat bold)
-    formatted = re.sub(r'\*\*([^*]+)\*\*|\*([^*]+)\*', r'*\1\2*', text)
-    
-    # Replace italics (_text_) with _text_ (Google Chat italic)
-    formatted = re.sub(r'_([^_]+)_', r'_\1_', formatted)
-    
-    # Replace strikethrough (~~text~~) with ~text~ (Google Chat strikethrough)
-    formatted = re.sub(r'~~([^~]+)~~', r'~\1~', formatted)
-    
-    # Replace inline code (`text`) with `text` (Google Chat monospace)
-    formatted = re.sub(r'`([^`]+)`', r'`\1`', formatted)
-    
-    # Format bullet points to use asterisks for Google Chat
-    lines = formatted.split('\n')
-    for i, line in enumerate(lines):
-        if line.strip().startswith(('- ', '* ')):
-            lines[i] = '* ' + line[2:].strip()
-    
-    # Rejoin the lines
-    formatted = '\n'.join(lines)
+    formatted_lines = []
+    in_code_block = False
+    in_table = False
+
+    for line in text.split('\n'):
+        # The first character decides which block patterns can match the line
+        first = line.lstrip()[:1]
+
+        if first in ('`', '~') and FENCE_PATTERN.match(line):
+            if in_table:
+                formatted_lines.append('```')
+                in_table = False
+            # Google Chat doesn't support the language hint after the fence
+            formatted_lines.append('```')
+            in_code_block = not in_code_block
+            continue
+
+        if in_code_block:
+            formatted_lines.append(line)
+            continue
+
+        if first == '|' and TABLE_ROW_PATTERN.match(line):
+            # Google Chat has no tables, a monospace block keeps the columns aligned
+            if not in_table:
+                formatted_lines.append('```')
+                in_table = True
+            formatted_lines.append(line.strip())
+            continue
+
+        if in_table:
+            formatted_lines.append('```')
+            in_table = False
+
+        if first == '#':
+            heading_match = HEADING_PATTERN.match(line)
+            if heading_match:
+                # Convert heading to bold + italic (Google Chat: *_text_*)
+                heading_content = HEADING_EMPHASIS_PATTERN.sub('', heading_match.group(2).strip())
+                formatted_lines.append(f"*_{translate_inline(heading_content)}_*")
+                continue
+
+        if first in ('-', '*', '+'):
+            bullet_match = BULLET_PATTERN.match(line)
+            if bullet_match:
+                # Format bullet points to use asterisks for Google Chat
+                formatted_lines.append(f"{bullet_match.group(1)}* {translate_inline(bullet_match.group(2).strip())}")
+                continue
+
+        formatted_lines.append(translate_inline(line))
+
+    if in_table or in_code_block:
+        formatted_lines.append('```')
+
+    return '\n'.join(formatted_lines)
+
+def translate_inline(text):
+    """
+    Translate inline markdown (bold, strikethrough, links) to Google Chat, leaving inline code untouched
     
-    return formatted
+    Args:
+        text (str): A single line of markdown
+        
+    Returns:
+        str: The line with Google Chat formatting
+    """
+    if not INLINE_MARKERS_PATTERN.search(text):
+        return text
+    return INLINE_PATTERN.sub(replace_inline, text)
+
+def replace_inline(match):
+    kind = match.lastgroup
+    if kind == 'bold':
+        return f"*{match.group('bold')}*"
+    if kind == 'strike':
+        return f"~{match.group('strike')}~"
+    if kind == 'link':
+        return f"<{match.group('link_url')}|{match.group('link_text')}>"
+    return match.group(0)
 
-def format_json_to_google_chat(json_data):
+def format_json_to_google_chat(json_data, max_items=JSON_MAX_ITEMS, download_url=None):
     """
     Format JSON data as a Google Chat message
     
+    Lists bigger than `max_items` are rendered as a digest: the total, the counts
+    grouped by config gpa_code/model/action and the first `max_items` items.
+    
     Args:
         json_data (list/dict): The JSON data to format
+        max_items (int): Maximum number of list items in the message, None for all
+        download_url (str): Optional link to the full result
         
     Returns:
         dict: A Google Chat formatted message with text and formattedText
     """
-    # Create plain text representation
-    text = json.dumps(json_data, indent=2)
-    
-    # Format as monospace block (triple backticks) for Google Chat
-    formatted_text = f"```\n{text}\n```"
+    if isinstance(json_data, list) and max_items is not None and len(json_data) > max_items:
+        sample = dump_json(json_data[:max_items])
+        header = f"{len(json_data)} itens, exibindo os primeiros {max_items}."
+
+        groups = count_message_groups(json_data, top=JSON_MAX_GROUPS)
+        if groups:
+            header += f"\nQuantidade por {'/'.join(MESSAGE_GROUP_KEYS)}:\n" + "\n".join(
+                "- " + ", ".join(f"{key}: {group[key]}" for key in MESSAGE_GROUP_KEYS) + f" -> {group['qtd']}"
+                for group in groups
+            )
+
+        text = f"{header}\n\n{sample}"
+        formatted_text = f"{header}\n\n```\n{sample}\n```"
+    else:
+        # Create plain text representation
+        text = dump_json(json_data)
+        
+        # Format as monospace block (triple backticks) for Google Chat
+        formatted_text = f"```\n{text}\n```"
+
+    if download_url:
+        text += f"\nResultado completo: {download_url}"
+        formatted_text += f"\n<{download_url}|Baixar resultado completo (NDJSON)>"
     
     return {
         "text": text,
         "formattedText": formatted_text
     }
 
-def dataframe_to_google_chat(df):
+def dump_json(json_data):
     """
-    Format a pandas DataFrame as a Google Chat message
+    Serialize data as indented JSON, values that are not JSON types are converted with str
     
     Args:
-        df (pandas.DataFrame): The DataFrame to format
+        json_data: The data to serialize
         
     Returns:
-        dict: A Google Chat formatted message with text and formattedText
+        str: The JSON text
+    """
+    return orjson.dumps(json_data, default=str, option=JSON_OPTIONS | orjson.OPT_INDENT_2).decode('utf-8')
+
+def iter_ndjson(items):
     """
-    # Create plain text representation
-    text_lines = []
-    for _, row in df.iterrows():
-        text_lines.append("- " + ", ".join([f"{col}: {row[col]}" for col in df.columns]))
+    Serialize a list as NDJSON, one encoded line per item
     
-    text = "\n".join(text_lines)
+    Args:
+        items (list): The items to serialize
+        
+    Returns:
+        generator: The encoded lines
+    """
+    for item in items:
+        yield orjson.dumps(item, default=str, option=JSON_OPTIONS | orjson.OPT_APPEND_NEWLINE)
+
+def dataframe_to_google_chat(df, max_rows=DATAFRAME_MAX_ROWS, download_url=None):
+    """
+    Format a pandas DataFrame as a Google Chat message
     
-    # Create formatted text with bullet points
-    formatted_lines = []
-    for _, row in df.iterrows():
-        formatted_lines.append("* " + ", ".join([f"{col}: {row[col]}" for col in df.columns]))
+    Rows are rendered column-wise, and only the top `max_rows` rows (by the
+    count column, when there is one) are included, followed by the totals.
     
-    formatted_text = "\n".join(formatted_lines)
+    Args:
+        df (pandas.DataFrame): The DataFrame to format
+        max_rows (int): Maximum number of rows in the message, None for all
+        download_url (str): Optional link to the full result
+        
+    Returns:
+        dict: A Google Chat formatted message with text and formattedText
+    """
+    total_rows = len(df)
+    count_columns = [col for col in COUNT_COLUMNS if col in df.columns]
+
+    visible = df
+    if max_rows is not None and total_rows > max_rows:
+        if count_columns:
+            visible = df.sort_values(count_columns[0], ascending=False, kind='stable')
+        visible = visible.head(max_rows)
+
+    rows = render_dataframe_rows(visible)
+    text = "- " + "\n- ".join(rows) if rows else ""
+    formatted_text = "* " + "\n* ".join(rows) if rows else ""
+
+    if len(visible) < total_rows:
+        totals = ", ".join(
+            f"{col}: {pd.to_numeric(df[col], errors='coerce').sum()}" for col in count_columns
+        )
+        summary = f"Exibindo {len(visible)} de {total_rows} linhas"
+        if totals:
+            summary += f" (total {totals})"
+        text += f"\n\n{summary}"
+        formatted_text += f"\n\n_{summary}_"
+
+    if download_url:
+        text += f"\nResultado completo: {download_url}"
+        formatted_text += f"\n<{download_url}|Baixar resultado completo (CSV)>"
     
     return {
         "text": text,
         "formattedText": formatted_text
-    } 
\ No newline at end of file
+    }
+
+def render_dataframe_rows(df):
+    """
+    Render each DataFrame row as "col: value, col: value" using column-wise string operations
+    
+    Args:
+        df (pandas.DataFrame): The DataFrame to render
+        
+    Returns:
+        list: One string per row
+    """
+    if df.empty or len(df.columns) == 0:
+        return []
+
+    columns = list(df.columns)
+    rendered = f"{columns[0]}: " + df[columns[0]].astype(str)
+    for col in columns[1:]:
+        rendered = rendered + f", {col}: " + df[col].astype(str)
+
+    return rendered.tolist()
+
+def split_message(text, max_bytes=MESSAGE_MAX_BYTES):
+    """
+    Split a formatted message into parts of at most `max_bytes` UTF-8 bytes, to be sent in order
+    
+    Parts end at line breaks. A code block cut between two parts is closed at the end of
+    the first and opened again at the start of the next, so every part renders on its
+    own. Lines longer than a part are cut between characters, without adding line breaks.
+    
+    Args:
+        text (str): The formatted message
+        max_bytes (int): Maximum size of a part
+        
+    Returns:
+        list: The parts, only one when the text fits
+    """
+    if len(text.encode('utf-8')) <= max_bytes:
+        return [text]
+
+    # Room for the fence lines added around a cut code block
+    piece_bytes = max(max_bytes - 64, max_bytes // 2, 1)
+    parts = []
+    current = None
+    size = 0
+    fresh = True  # The part has nothing but the reopened fence yet
+    fence = None
+    for piece, continued in iter_line_pieces(text.split('\n'), piece_bytes):
+        separator = '' if current is None or (continued and not fresh) else '\n'
+        piece_size = len((separator + piece).encode('utf-8'))
+        if not fresh and size + piece_size + 4 > max_bytes:
+            parts.append(f"{current}\n{fence[1]}" if fence else current)
+            current = fence[0] if fence else None
+            size = len(current.encode('utf-8')) if current is not None else 0
+            separator = '' if current is None else '\n'
+            piece_size = len((separator + piece).encode('utf-8'))
+        current = (current or '') + separator + piece
+        size += piece_size
+        fresh = False
+
+        match = None if continued else FENCE_PATTERN.match(piece)
+        if match:
+            fence = None if fence else (piece, match.group(1))
+
+    if current is not None:
+        parts.append(current)
+    return parts
+
+def iter_line_pieces(lines, max_bytes):
+    """
+    Yield (piece, continued) for the lines, cutting the ones longer than `max_bytes` bytes
+    
+    A line is cut between characters and every piece holds at least one character, so a
+    character bigger than `max_bytes` still makes progress. `continued` is True for the
+    pieces after the first of a cut line.
+    """
+    for line in lines:
+        encoded = line.encode('utf-8')
+        continued = False
+        while len(encoded) > max_bytes:
+            cut = max_bytes
+            # Back to the first byte of the character being cut, 0b10xxxxxx are continuation bytes
+            while cut > 0 and encoded[cut] & 0xC0 == 0x80:
+                cut -= 1
+            if cut == 0:
+                cut = 1
+                while cut < len(encoded) and encoded[cut] & 0xC0 == 0x80:
+                    cut += 1
+            yield encoded[:cut].decode('utf-8'), continued
+            encoded = encoded[cut:]
+            continued = True
+        yield encoded.decode('utf-8'), continued
@@ -1,16 +1,23 @@
 import pandas as pd
 from .google_chat import (
+    DATAFRAME_MAX_ROWS,
+    JSON_MAX_ITEMS,
     format_text_to_google_chat,
     format_json_to_google_chat,
-    dataframe_to_google_chat
+    dataframe_to_google_chat,
+    iter_ndjson
 )
+from api.downloads import download_store
 
-def translate_response(response):
+def translate_response(response, download_base_url=None):
     """
     Translate various response types to properly formatted Google Chat messages
     
     Args:
         response: The response to translate (can be list, DataFrame, or string)
+        download_base_url (str): Public base URL of the API, when given results that
+            don't fit in the message are stored and a signed download link is added,
+            unless the download store has no signing key
         
     Returns:
         dict: A Google Chat message with text and formattedText
@@ -22,10 +29,26 @@ def translate_response(response):
         }
     
     if isinstance(response, list):
-        return format_json_to_google_chat(response)
+        download_url = None
+        if download_base_url and download_store.can_link() and len(response) > JSON_MAX_ITEMS:
+            download_id = download_store.put(
+                lambda: iter_ndjson(response),
+                'application/x-ndjson',
+                'resultado.ndjson'
+            )
+            download_url = download_store.url(download_base_url, download_id)
+        return format_json_to_google_chat(response, download_url=download_url)
     
     if isinstance(response, pd.DataFrame):
-        return dataframe_to_google_chat(response)
+        download_url = None
+        if download_base_url and download_store.can_link() and len(response) > DATAFRAME_MAX_ROWS:
+            download_id = download_store.put(
+                lambda: iter([response.to_csv(index=False).encode('utf-8')]),
+                'text/csv',
+                'resultado.csv'
+            )
+            download_url = download_store.url(download_base_url, download_id)
+        return dataframe_to_google_chat(response, download_url=download_url)
 
     # For text responses
     return format_text_to_google_chat(response) 
\ No newline at end of file
@@ -1,4 +1,5 @@
 import base64
+import asyncio
 from fastapi import (
     FastAPI,
     Body,
@@ -13,7 +14,8 @@ from fastapi import (
 
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
-import logging
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from typing import Optional
 
 import sys
@@ -26,19 +28,35 @@ load_dotenv()
 
 from pydantic import BaseModel
 from pkg.chatbot import Chatbot
+from pkg.request_context import RequestContext
 
 import json
-import traceback
 # Import the response translator
 from api.formatters.response_translator import translate_response
+from api.formatters.google_chat import split_message
+from api.downloads import download_store, PUBLIC_BASE_URL
+from api.admission import AdmissionController, AdmissionRejected, coalescing_key
+from pkg.queue_metrics import QueueMetricsSampler, QUEUE_METRICS_VHOSTS
+from pkg.telemetry import metrics, span
+from pkg.logger import get_logger, DroppingQueueHandler
 
-log = logging.getLogger(__name__)
+log = get_logger('api')
 
 app = FastAPI()
 
 SIMPLE_TOKEN = os.getenv('API_TOKEN')
+# Open the backend connections when the worker starts instead of on its first request
+WARMUP = os.getenv('WARMUP', 'true').lower() == 'true'
+WARMUP_TIMEOUT = float(os.getenv('WARMUP_TIMEOUT', 15))
+# Seconds a chat request has for every backend call, the response waits a little longer
+# so the turn can still answer with what it got before the deadline
+CHAT_DEADLINE = float(os.getenv('CHAT_DEADLINE', 60))
+CHAT_DEADLINE_GRACE = float(os.getenv('CHAT_DEADLINE_GRACE', 5))
+# Seconds between the lines /chat/stream sends while the answer is not ready, for proxies and clients with idle timeouts
+CHAT_STREAM_HEARTBEAT = float(os.getenv('CHAT_STREAM_HEARTBEAT', 10))
 
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
 
 def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
   token = credentials.credentials
@@ -60,6 +78,29 @@ app.add_middleware(
 )
 
 app.state.chatbot = Chatbot()
+app.state.admission = AdmissionController()
+app.state.queue_metrics_sampler = None
+
+@app.on_event('startup')
+async def warmup():
+  if not WARMUP:
+    return
+  try:
+    await asyncio.wait_for(run_in_threadpool(app.state.chatbot.warmup), WARMUP_TIMEOUT)
+  except asyncio.TimeoutError:
+    # An unreachable backend must not keep the worker from serving
+    log.warning('Warmup timed out', timeout=WARMUP_TIMEOUT)
+
+@app.on_event('startup')
+async def start_queue_metrics_sampler():
+  if QUEUE_METRICS_VHOSTS:
+    app.state.queue_metrics_sampler = QueueMetricsSampler(app.state.chatbot.queue_metrics, QUEUE_METRICS_VHOSTS)
+    app.state.queue_metrics_sampler.start()
+
+@app.on_event('shutdown')
+async def stop_queue_metrics_sampler():
+  if app.state.queue_metrics_sampler is not None:
+    await app.state.queue_metrics_sampler.stop()
 
 @app.get('/')
 async def get_status():
@@ -71,94 +112,205 @@ async def get_status():
 class ChatRequest(BaseModel):
   query: str
 
-@app.post('/chat', dependencies=[Depends(verify_token)])
-async def chat(request: Request):
-  try:
-    # Check content type
-    content_type = request.headers.get('content-type', '')
-    
-    # Handle different content types
-    if 'multipart/form-data' in content_type:
-      form_data = await request.form()
-      query = form_data.get('query')
-      user_id = form_data.get('user_id', 'default')
-      file = form_data.get('file')
-      
+async def read_chat_request(request: Request) -> tuple:
+  """Query, user ID and files of a chat request, sent as JSON, multipart or a raw body"""
+  # Check content type
+  content_type = request.headers.get('content-type', '')
+
+  # Handle different content types
+  if 'multipart/form-data' in content_type:
+    form_data = await request.form()
+    query = form_data.get('query')
+    user_id = form_data.get('user_id', 'default')
+    file = form_data.get('file')
+
+    file_content = None
+    file_name = None
+
+    if file:
+      file_content = await file.read()
+      file_name = file.filename
+  else:
+    try:
+      # Try to parse JSON first
+      data = await request.json()
+      query = data.get('query')
+      user_id = data.get('user_id', 'default')
+
       file_content = None
       file_name = None
-      
-      if file:
-        file_content = await file.read()
-        file_name = file.filename
-    else:
-      try:
-        # Try to parse JSON first
-        data = await request.json()
-        query = data.get('query')
-        user_id = data.get('user_id', 'default')
-        
-        file_content = None
-        file_name = None
-        
-        if 'file' in data:
-          file_data = data.get('file')
-          if file_data:
-            if 'content' in file_data and file_data['content']:
-              try:
-                file_content = base64.b64decode(file_data['content']) if isinstance(file_data['content'], str) else file_data['content']
-              except Exception as e:
-                log.error(f"Error decoding base64 content: {e}")
-                file_content = file_data['content']
-            file_name = file_data.get('name', 'uploaded_file')
-      except json.JSONDecodeError:
-        # If JSON parsing fails, try to get raw body
-        try:
-          body = await request.body()
-          if body:
-            # Try to decode with different encodings
+
+      if 'file' in data:
+        file_data = data.get('file')
+        if file_data:
+          if 'content' in file_data and file_data['content']:
             try:
-              body_str = body.decode('utf-8')
-            except UnicodeDecodeError:
-              try:
-                body_str = body.decode('latin-1')
-              except:
-                body_str = body.decode('utf-8', errors='replace')
-            
-            # Try to parse as JSON again
+              file_content = base64.b64decode(file_data['content']) if isinstance(file_data['content'], str) else file_data['content']
+            except Exception as e:
+              log.error('Decoding base64 file content failed', error=str(e))
+              file_content = file_data['content']
+          file_name = file_data.get('name', 'uploaded_file')
+    except json.JSONDecodeError:
+      # If JSON parsing fails, try to get raw body
+      try:
+        body = await request.body()
+        if body:
+          # Try to decode with different encodings
+          try:
+            body_str = body.decode('utf-8')
+          except UnicodeDecodeError:
             try:
-              data = json.loads(body_str)
-              query = data.get('query')
-              user_id = data.get('user_id', 'default')
+              body_str = body.decode('latin-1')
             except:
-              # If still not JSON, treat as raw query
-              query = body_str
-              user_id = 'default'
-        except Exception as e:
-          log.error(f"Error processing request body: {e}")
-          raise HTTPException(status_code=400, detail="Invalid request format")
-    
-    if not query:
-      raise HTTPException(status_code=400, detail="Query parameter is required")
-    
-    chatbot = app.state.chatbot
-    files = None
-
-    if file_content and file_name:
-      files = [{'content': file_content, 'name': file_name}]
-    response = chatbot.chat(
-      query=query,
-      vhost='aqila',
-      user_id=user_id,
-      files=files
-    )
+              body_str = body.decode('utf-8', errors='replace')
+
+          # Try to parse as JSON again
+          try:
+            data = json.loads(body_str)
+            query = data.get('query')
+            user_id = data.get('user_id', 'default')
+          except:
+            # If still not JSON, treat as raw query
+            query = body_str
+            user_id = 'default'
+      except Exception as e:
+        log.error('Processing request body failed', error=str(e))
+        raise HTTPException(status_code=400, detail="Invalid request format")
+
+  if not query:
+    raise HTTPException(status_code=400, detail="Query parameter is required")
+
+  files = None
+  if file_content and file_name:
+    files = [{'content': file_content, 'name': file_name}]
+  return query, user_id, files
+
+async def answer(query: str, user_id: str, files: list) -> dict:
+  """Run the chat turn once admitted, within the request deadline, and format its answer"""
+  chatbot = app.state.chatbot
+  vhost = 'aqila'
+
+  # Requests with files are never coalesced, the same question can be about different files
+  key = None if files else coalescing_key(user_id, vhost, query)
+  with span('http.chat', user_id=user_id, vhost=vhost):
+    ctx = RequestContext(vhost, user_id, timeout=CHAT_DEADLINE)
+
+    async def run_turn():
+      # The context goes along with the response, coalesced requests get its notes too
+      return await run_in_threadpool(chatbot.chat, query=query, ctx=ctx, files=files), ctx
 
-    return translate_response(response)
+    try:
+      response, ctx = await asyncio.wait_for(
+        app.state.admission.run(user_id, key, run_turn),
+        ctx.remaining() + CHAT_DEADLINE_GRACE
+      )
+    except asyncio.TimeoutError:
+      # The thread stops at its next backend call, its slot is released then
+      metrics.inc('alfredo_deadline_exceeded_total', source='api')
+      log.warning('Chat request deadline exceeded', user_id=user_id, deadline=CHAT_DEADLINE)
+      response = '⏱️ Não consegui responder a tempo. Tente novamente em instantes.'
+    except AdmissionRejected as e:
+      raise HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail=e.detail,
+        headers={'Retry-After': str(e.retry_after)}
+      )
+
+    with span('format.response'):
+      message = translate_response(response, download_base_url=PUBLIC_BASE_URL)
+    if ctx.timed_out:
+      note = f"\n\n⚠️ Resultado parcial: {', '.join(ctx.timed_out)} não respondeu dentro do prazo."
+      message['text'] += note
+      message['formattedText'] += note
+    for note in ctx.notes:
+      message['text'] += f"\n\n{note}"
+      message['formattedText'] += f"\n\n{note}"
+    return message
+
+@app.post('/chat', dependencies=[Depends(verify_token)])
+async def chat(request: Request):
+  try:
+    query, user_id, files = await read_chat_request(request)
+    return await answer(query, user_id, files)
+  except HTTPException:
+    raise
   except Exception as e:
-    print(e)
-    print(traceback.format_exc())
-    log.error(f"Error in chat: {str(e)}")
+    log.exception('Chat request failed')
     raise HTTPException(status_code=500, detail=f"Error processing request: {str(e)}")
 
+@app.post('/chat/stream', dependencies=[Depends(verify_token)])
+async def chat_stream(request: Request):
+  """
+  The answer of /chat as NDJSON, for clients that post long answers as several messages.
+
+  A heartbeat line is sent every CHAT_STREAM_HEARTBEAT seconds while the turn runs, then
+  the formatted answer in parts of at most MESSAGE_MAX_BYTES, each sent as soon as it is
+  ready, and an end line. Errors after the response started come as an error line.
+  """
+  query, user_id, files = await read_chat_request(request)
+  return StreamingResponse(stream_answer(request, query, user_id, files), media_type='application/x-ndjson')
+
+async def stream_answer(request: Request, query: str, user_id: str, files: list):
+  turn = asyncio.ensure_future(answer(query, user_id, files))
+  try:
+    while not turn.done():
+      await asyncio.wait({turn}, timeout=CHAT_STREAM_HEARTBEAT)
+      if not turn.done():
+        yield ndjson_line({'type': 'heartbeat'})
+
+    try:
+      message = turn.result()
+    except HTTPException as e:
+      yield ndjson_line({'type': 'error', 'status': e.status_code, 'detail': e.detail})
+      return
+    except Exception as e:
+      log.exception('Chat stream failed')
+      yield ndjson_line({'type': 'error', 'status': 500, 'detail': f"Error processing request: {str(e)}"})
+      return
+
+    parts = split_message(message['formattedText'])
+    for index, part in enumerate(parts):
+      yield ndjson_line({'type': 'part', 'index': index, 'count': len(parts), 'text': part})
+    yield ndjson_line({'type': 'end', 'parts': len(parts)})
+  finally:
+    # The client went away, the admission slot is released
+    if not turn.done():
+      turn.cancel()
+
+def ndjson_line(data: dict) -> bytes:
+  return json.dumps(data, ensure_ascii=False).encode() + b'\n'
+
+@app.get('/usage', dependencies=[Depends(verify_token)])
+async def get_usage():
+  return app.state.chatbot.get_usage()
+
+@app.get('/metrics', dependencies=[Depends(verify_token)])
+async def get_metrics():
+  dropped_logs = f"# TYPE alfredo_log_dropped_total counter\nalfredo_log_dropped_total {DroppingQueueHandler.dropped}\n"
+  return PlainTextResponse(metrics.render() + dropped_logs, media_type='text/plain; version=0.0.4')
+
+@app.get('/downloads/{download_id}')
+async def download(download_id: str, expires: int = 0, signature: str = '',
+                   credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)):
+  # Links sent in chat messages are signed, API clients can use their token instead
+  has_token = credentials is not None and SIMPLE_TOKEN is not None and credentials.credentials == SIMPLE_TOKEN
+  if not has_token and not download_store.verify(download_id, expires, signature):
+    raise HTTPException(
+      status_code=status.HTTP_401_UNAUTHORIZED,
+      detail="Invalid or expired download link",
+      headers={"WWW-Authenticate": "Bearer"},
+    )
+
+  entry = download_store.get(download_id)
+  if entry is None:
+    raise HTTPException(status_code=404, detail="Download not found or expired")
+
+  return StreamingResponse(
+    entry['content_factory'](),
+    media_type=entry['media_type'],
+    headers={'Content-Disposition': f"attachment; filename={entry['filename']}"}
+  )
+
 @app.post("/task_manager_analyst")
 async def task_manager_analyst(request: Request):
   data = await request.json()
@@ -0,0 +1,49 @@
+"""
+Benchmark format_inline_markdown with long LLM-like answers.
+
+Usage:
+  python -m benchmarks.bench_markdown [--repeat 200]
+"""
+import argparse
+import time
+
+from api.formatters.google_chat import format_inline_markdown
+
+SECTION = """## Fila `sync_mongo_to_postgres`
+
+A fila possui **1532 mensagens** pendentes, a maioria do cliente *8504*.
+Veja a [documentação](https://docs.example.com/filas/sync) para mais detalhes e ~~não~~ reprocesse manualmente.
+
+- Modelo `pedidos`: **812** mensagens
+- Modelo `clientes`: **420** mensagens
+  - 300 com erro de validação
+  - 120 aguardando reprocessamento
+* Modelo `produtos`: **300** mensagens
+
+| gpa_code | model | qtd |
+|----------|-------|-----|
+| 8504 | pedidos | 812 |
+| 8504 | clientes | 420 |
+
+```python
+rabbit.resend_to_queue('sync_mongo_to_postgres-dlq', limit=100, vhost='aqila')
+```
+"""
+
+def build_answer(sections: int) -> str:
+  return '\n'.join(SECTION for _ in range(sections))
+
+def run(repeat: int):
+  for sections in (1, 10, 100):
+    text = build_answer(sections)
+    start = time.perf_counter()
+    for _ in range(repeat):
+      format_inline_markdown(text)
+    elapsed = time.perf_counter() - start
+    print(f"{len(text):>8} chars | {elapsed / repeat * 1000:8.3f} ms/op | {len(text) * repeat / elapsed / 1e6:6.2f} MB/s")
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Benchmark format_inline_markdown')
+  parser.add_argument('--repeat', type=int, default=200)
+  args = parser.parse_args()
+  run(args.repeat)
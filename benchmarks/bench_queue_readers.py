@@ -0,0 +1,35 @@
+"""
+Compare the HTTP (management API /get) and AMQP readers of Rabbit on a real queue.
+
+Both readers only peek, messages are returned to the queue. Uses the RABBITMQ_* settings of .env.
+
+Usage:
+  python -m benchmarks.bench_queue_readers <queue_name> [--vhost aqila-hml] [--limit 1000] [--repeat 3]
+"""
+import argparse
+import time
+
+from pkg.message_decoder import DecodeStats
+from pkg.rabbit import Rabbit
+
+def run(queue_name: str, vhost: str, limit: int, repeat: int):
+  rabbit = Rabbit()
+  for reader in ('http', 'amqp'):
+    timings = []
+    for _ in range(repeat):
+      stats = DecodeStats()
+      start = time.perf_counter()
+      messages = rabbit.get_queue_messages(queue_name, limit=limit, vhost=vhost, decode_stats=stats, reader=reader)
+      timings.append(time.perf_counter() - start)
+    best = min(timings)
+    count = len(messages or [])
+    print(f"{reader:>5} | {count:>7} messages | best {best:8.3f} s | {count / best if best else 0:10.1f} msg/s")
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Benchmark the queue readers')
+  parser.add_argument('queue_name')
+  parser.add_argument('--vhost', default='aqila-hml')
+  parser.add_argument('--limit', type=int, default=1000)
+  parser.add_argument('--repeat', type=int, default=3)
+  args = parser.parse_args()
+  run(args.queue_name, args.vhost, args.limit, args.repeat)
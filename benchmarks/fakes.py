@@ -0,0 +1,326 @@
+"""
+Deterministic local stand-ins for the services Alfredo talks to, used by the benchmarks.
+
+- FakeManagementAPI: the RabbitMQ management /api/queues endpoints (list with paging, queue, /get)
+- FakeOpenAI: Azure OpenAI chat completions and embeddings
+- fake_mongo_client: a mongomock client with collections in sync error and pictures, when mongomock is installed
+- FakeVectorSearch: the MongoDB Atlas vector search of the commands of command_helper
+- FakeTrelloClient: the card search of py-trello used by task_helper
+- make_pdf: a text PDF with the given number of pages
+
+Every server listens on 127.0.0.1 on a free port and answers after a configurable latency.
+"""
+import re
+import json
+import time
+import base64
+import hashlib
+import threading
+from types import SimpleNamespace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+MODELS = ('pedido', 'cliente', 'produto', 'estoque', 'preco')
+ACTIONS = ('create', 'update', 'delete')
+
+def make_message(index: int) -> dict:
+  return {
+    'config': {
+      'gpa_code': 1000 + index % 50,
+      'tenant': f"tenant_{index % 5}",
+      'model': MODELS[index % len(MODELS)],
+      'action': ACTIONS[index % len(ACTIONS)],
+      'origin': 'firebird',
+    },
+    'data': {'id': index, 'description': f"registro {index}", 'values': list(range(index % 10))},
+  }
+
+def encode_message(index: int) -> str:
+  """Even messages are base64 envelopes, odd ones plain JSON, like the real queues"""
+  body = json.dumps(make_message(index))
+  if index % 2 == 0:
+    return json.dumps({'payload': base64.b64encode(body.encode()).decode()})
+  return body
+
+class StubServer:
+  """ThreadingHTTPServer running in a daemon thread, `handle(method, path, query, body)` returns (status, payload)"""
+
+  def __init__(self, latency: float = 0.0):
+    self.latency = latency
+    self.requests = 0
+    stub = self
+
+    class Handler(BaseHTTPRequestHandler):
+      def do_GET(self):
+        self.respond('GET')
+
+      def do_POST(self):
+        self.respond('POST')
+
+      def respond(self, method: str):
+        url = urlparse(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length) or b'null')
+        stub.requests += 1
+        if stub.latency:
+          time.sleep(stub.latency)
+        status, payload = stub.handle(method, unquote(url.path), parse_qs(url.query), body)
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+      def log_message(self, format, *args):
+        pass
+
+    self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    self.server.daemon_threads = True
+    self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+  @property
+  def address(self) -> str:
+    host, port = self.server.server_address
+    return f"{host}:{port}"
+
+  def start(self) -> 'StubServer':
+    self.thread.start()
+    return self
+
+  def stop(self):
+    self.server.shutdown()
+    self.server.server_close()
+
+  def handle(self, method: str, path: str, query: dict, body):
+    raise NotImplementedError
+
+class FakeManagementAPI(StubServer):
+  """
+  Management API of one broker, `queues` maps a queue name to its depth. Every queue
+  returns the same deterministic messages, see make_message.
+  """
+
+  def __init__(self, queues: dict, latency: float = 0.005):
+    super().__init__(latency)
+    self.queues = queues
+    self.payloads = []
+
+  def get_payloads(self, count: int) -> list:
+    while len(self.payloads) < count:
+      self.payloads.append(encode_message(len(self.payloads)))
+    return self.payloads[:count]
+
+  def queue_info(self, vhost: str, name: str) -> dict:
+    return {'name': name, 'vhost': vhost, 'messages': self.queues[name], 'consumers': 1, 'state': 'running', 'type': 'classic'}
+
+  def handle(self, method: str, path: str, query: dict, body):
+    parts = path.strip('/').split('/')
+    if parts[:2] != ['api', 'queues'] or len(parts) < 3:
+      return 404, {'error': 'not_found'}
+    vhost = parts[2]
+
+    if len(parts) == 3:
+      return 200, self.list_queues(vhost, query)
+
+    name = parts[3]
+    if name not in self.queues:
+      return 404, {'error': 'Object Not Found', 'reason': 'Not Found'}
+    if len(parts) == 4:
+      return 200, self.queue_info(vhost, name)
+    if len(parts) == 5 and parts[4] == 'get' and method == 'POST':
+      count = min(int(body.get('count', 1)), self.queues[name])
+      return 200, [
+        {'payload': payload, 'payload_encoding': 'string', 'redelivered': True, 'exchange': 'aqila_exg',
+         'routing_key': name, 'message_count': self.queues[name] - index - 1, 'properties': {}}
+        for index, payload in enumerate(self.get_payloads(count))
+      ]
+    return 404, {'error': 'not_found'}
+
+  def list_queues(self, vhost: str, query: dict) -> dict:
+    names = list(self.queues)
+    if 'name' in query:
+      pattern = re.compile(query['name'][0])
+      names = [name for name in names if pattern.search(name)]
+    reverse = query.get('sort_reverse', ['false'])[0] == 'true'
+    names.sort(key=lambda name: self.queues[name], reverse=reverse)
+
+    page_size = int(query.get('page_size', [100])[0])
+    page = int(query.get('page', [1])[0])
+    items = [self.queue_info(vhost, name) for name in names[(page - 1) * page_size:page * page_size]]
+    return {
+      'items': items,
+      'page': page,
+      'page_size': page_size,
+      'page_count': max((len(names) + page_size - 1) // page_size, 1),
+      'filtered_count': len(names),
+      'total_count': len(self.queues),
+      'item_count': len(items),
+    }
+
+class FakeOpenAI(StubServer):
+  """
+  Azure OpenAI chat completions and embeddings.
+
+  With tools in the request it calls task_helper for questions about "tarefa <name>",
+  get_queue_status for questions about "fila <name>" and answers with text otherwise. Usage reports the tools and the system message as
+  cached after the first request with the same prefix, like the provider prompt cache.
+  """
+
+  def __init__(self, latency: float = 0.05, dimensions: int = 256):
+    super().__init__(latency)
+    self.dimensions = dimensions
+    self.prefixes = set()
+    self.lock = threading.Lock()
+
+  def handle(self, method: str, path: str, query: dict, body):
+    if path.endswith('/chat/completions'):
+      return 200, self.chat_completion(body)
+    if path.endswith('/embeddings'):
+      return 200, self.embeddings(body)
+    return 404, {'error': {'message': 'not found'}}
+
+  def chat_completion(self, body: dict) -> dict:
+    messages = body.get('messages', [])
+    tools = body.get('tools')
+    prompt_tokens = len(json.dumps(messages)) // 4 + len(json.dumps(tools or [])) // 4
+    prefix = json.dumps([tools, messages[:1]])
+    with self.lock:
+      cached = prefix in self.prefixes
+      self.prefixes.add(prefix)
+
+    question = messages[-1].get('content') if messages else ''
+    task = re.search(r'tarefa\s+([\w.\-]+)', question or '')
+    queue = re.search(r'fila\s+([\w.\-]+)', question or '')
+    if tools and task:
+      message = self.tool_call('task_helper', {'task_query': task.group(1)})
+      finish_reason = 'tool_calls'
+    elif tools and queue:
+      message = self.tool_call('get_queue_status', {'queue_name': queue.group(1)})
+      finish_reason = 'tool_calls'
+    else:
+      message = {'role': 'assistant', 'content': 'Resumo gerado pelo servidor de testes.'}
+      finish_reason = 'stop'
+
+    return {
+      'id': 'chatcmpl-bench',
+      'object': 'chat.completion',
+      'created': int(time.time()),
+      'model': body.get('model', 'gpt-4o'),
+      'choices': [{'index': 0, 'finish_reason': finish_reason, 'message': message}],
+      'usage': {
+        'prompt_tokens': prompt_tokens,
+        'completion_tokens': 20,
+        'total_tokens': prompt_tokens + 20,
+        'prompt_tokens_details': {'cached_tokens': len(prefix) // 4 if cached else 0},
+      },
+    }
+
+  def tool_call(self, name: str, arguments: dict) -> dict:
+    return {
+      'role': 'assistant',
+      'content': None,
+      'tool_calls': [{'id': 'call_1', 'type': 'function', 'function': {'name': name, 'arguments': json.dumps(arguments)}}],
+    }
+
+  def embeddings(self, body: dict) -> dict:
+    inputs = body.get('input')
+    inputs = inputs if isinstance(inputs, list) else [inputs]
+    return {
+      'object': 'list',
+      'model': body.get('model', 'text-embedding'),
+      'data': [{'object': 'embedding', 'index': index, 'embedding': self.embed(text)} for index, text in enumerate(inputs)],
+      'usage': {'prompt_tokens': sum(len(str(text).split()) for text in inputs), 'total_tokens': 0},
+    }
+
+  def embed(self, text: str) -> list:
+    """Bag of words hashed into `dimensions` buckets, equal texts get equal vectors"""
+    vector = [0.0] * self.dimensions
+    for word in str(text).lower().split():
+      vector[int(hashlib.md5(word.encode()).hexdigest(), 16) % self.dimensions] += 1.0
+    return vector
+
+def fake_mongo_client(collections: int = 40, documents: int = 500):
+  """mongomock client with the `aqila` database filled, None when mongomock is not installed"""
+  try:
+    import mongomock
+  except ImportError:
+    return None
+
+  client = mongomock.MongoClient()
+  db = client['aqila']
+  for collection in range(collections):
+    db[f"colecao_{collection}"].insert_many([
+      {'_gpa_code': 1000 + index % 50, 'has_sync_error': index % 3 == 0, 'pending_sync': index % 2 == 0}
+      for index in range(documents)
+    ])
+  db['fotos'].insert_many([
+    {'_gpa_code': 1000 + index % 50, 'status': ('pending', 'done', 'error')[index % 3]}
+    for index in range(documents * 10)
+  ])
+  return client
+
+class FakeVectorSearch:
+  """MongoDBAtlasVectorSearch with the same command documents for every query, patched over pkg.mongo.MongoDBAtlasVectorSearch"""
+
+  @classmethod
+  def from_connection_string(cls, *args, **kwargs) -> 'FakeVectorSearch':
+    return cls()
+
+  def similarity_search_with_score(self, query: str, k: int = 4) -> list:
+    return [
+      (SimpleNamespace(page_content=f"Reiniciar o consumidor {index}", metadata={'comandos': f"supervisorctl restart consumer_{index}"}), 1 - index / 10)
+      for index in range(k)
+    ]
+
+class FakeTrelloClient:
+  """TrelloClient whose search returns `cards_limit` cards with comments and a checklist, patched over pkg.trello.TrelloClient"""
+
+  def __init__(self, *args, **kwargs):
+    pass
+
+  def search(self, query: str, partial_match: bool = False, models: list = None, cards_limit: int = 10) -> list:
+    return [
+      SimpleNamespace(
+        name=f"{query} parte {index + 1}",
+        id=f"card_{index}",
+        url=f"https://trello.invalid/c/card_{index}",
+        desc=f"Descrição da tarefa {query}, parte {index + 1}.",
+        due=None,
+        comments=[{'data': {'text': f"Comentário {comment + 1}", 'id': f"comment_{comment}", 'name': 'bench'}} for comment in range(3)],
+        checklists=[SimpleNamespace(name='Checklist', id=f"checklist_{index}", items=[{'name': f"Item {item + 1}"} for item in range(4)])],
+      )
+      for index in range(cards_limit)
+    ]
+
+def make_pdf(pages: int, lines_per_page: int = 40) -> bytes:
+  """A PDF with `pages` pages of plain text, enough for PyPDF2 to extract"""
+  objects = [
+    b"<< /Type /Catalog /Pages 2 0 R >>",
+    None,
+    b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+  ]
+  kids = []
+  for page in range(pages):
+    text = b''.join(
+      f"BT /F1 10 Tf 40 {760 - line * 18} Td (Pagina {page + 1} linha {line + 1}: fila sync_{line % 7} com {page * line} mensagens) Tj ET\n".encode()
+      for line in range(lines_per_page)
+    )
+    content_number = len(objects) + 2
+    objects.append(
+      f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> /Contents {content_number} 0 R >>".encode()
+    )
+    kids.append(f"{len(objects)} 0 R")
+    objects.append(b"<< /Length " + str(len(text)).encode() + b" >>\nstream\n" + text + b"endstream")
+  objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {pages} >>".encode()
+
+  pdf = bytearray(b"%PDF-1.4\n")
+  offsets = []
+  for number, body in enumerate(objects, start=1):
+    offsets.append(len(pdf))
+    pdf += f"{number} 0 obj\n".encode() + body + b"\nendobj\n"
+  xref = len(pdf)
+  pdf += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+  pdf += b''.join(f"{offset:010d} 00000 n \n".encode() for offset in offsets)
+  pdf += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+  return bytes(pdf)
@@ -0,0 +1,208 @@
+"""
+Load test of the /chat endpoint of api.main:app with a mix of the questions of streamlit_app.py and file uploads.
+
+The app runs in this process behind httpx's ASGI transport, with the backends replaced by
+the stand-ins of benchmarks/fakes.py (RabbitMQ, Azure OpenAI, MongoDB, the command vector
+search and Trello), so the numbers are those of one container without network. Each stage
+keeps `concurrency` virtual users sending requests back to back for `duration` seconds;
+user IDs follow a Zipf distribution (a few users send most of the messages) and every
+stage reports throughput, p50/p95/p99 latency and errors by status.
+Memory is sampled during the run: users and messages in user_chat_histories, their size
+serialized, and the RSS of the process.
+
+Usage:
+  python -m benchmarks.loadtest [--concurrency 1,4,8,16] [--duration 30] [--users 50] [--json report.json]
+"""
+import os
+import json
+import time
+import base64
+import random
+import asyncio
+import argparse
+import statistics
+from unittest import mock
+
+import orjson
+
+from benchmarks.fakes import FakeTrelloClient, FakeVectorSearch, fake_mongo_client, make_pdf
+from benchmarks.scenarios import StandIns
+
+API_TOKEN = 'loadtest'
+QUEUES = [f"sync_{index:04d}" for index in range(1, 100)]
+
+CSV_CONTENT = '\n'.join(['gpa_code,model,qtd'] + [f"{1000 + index},pedido,{index}" for index in range(200)]).encode()
+
+def question(template: str):
+  def build(rng: random.Random) -> dict:
+    return {'json': {'query': template.format(
+      queue=rng.choice(QUEUES),
+      limit=rng.choice((10, 50, 100)),
+      gpa_code=1000 + rng.randrange(50),
+      task=rng.randrange(100, 999),
+    )}}
+  return build
+
+def upload(name: str, content: bytes, query: str):
+  encoded = base64.b64encode(content).decode()
+  def build(rng: random.Random) -> dict:
+    return {'json': {'query': query, 'file': {'name': name, 'content': encoded}}}
+  return build
+
+# (name, weight, needs Mongo, request builder), the questions are the examples of streamlit_app.py
+TRAFFIC_MIX = [
+  ('collections_with_error', 8, True, question('Quais são as coleções com erro?')),
+  ('queues_status', 15, False, question('Quantas mensagens existem nas filas?')),
+  ('queue_messages', 15, False, question('Quais são as mensagens da fila {queue}?')),
+  ('pictures_by_status', 5, True, question('Quais clientes possuem fotos com erro?')),
+  ('read_messages', 15, False, question('Leia {limit} mensagens da fila {queue}')),
+  ('read_messages_gpa', 10, False, question('Leia {limit} mensagens da fila {queue} filtrando pelo cliente {gpa_code}')),
+  ('summarize_messages', 5, False, question('Resuma {limit} mensagens da fila {queue}')),
+  ('queue_status_llm', 10, False, question('Como está a fila {queue} hoje?')),
+  ('command_helper', 5, False, question('Qual comando usar para reiniciar o consumidor da fila {queue}?')),
+  ('task_question', 4, False, question('Sobre a tarefa {task}, quais os principais detalhes?')),
+  ('upload_pdf', 2, False, upload('relatorio.pdf', make_pdf(5), 'Resuma este relatório')),
+  ('upload_csv', 2, False, upload('pedidos.csv', CSV_CONTENT, 'Analise esta planilha')),
+]
+
+def zipf_weights(users: int, exponent: float) -> list:
+  return [1 / rank ** exponent for rank in range(1, users + 1)]
+
+def percentile(values: list, p: float) -> float:
+  if not values:
+    return 0.0
+  values = sorted(values)
+  return values[min(int(len(values) * p), len(values) - 1)]
+
+def rss_mb() -> float:
+  try:
+    with open('/proc/self/statm') as f:
+      return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+  except (OSError, ValueError):
+    import resource
+    # Peak instead of current outside Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def history_sample(chatbot, started: float, requests: int) -> dict:
+  histories = list(chatbot.user_chat_histories.items())
+  return {
+    'elapsed': round(time.monotonic() - started, 1),
+    'requests': requests,
+    'users': len(histories),
+    'messages': sum(len(history) for _, history in histories),
+    'history_kb': round(sum(len(orjson.dumps(history, default=str)) for _, history in histories) / 1024, 1),
+    'rss_mb': round(rss_mb(), 1),
+  }
+
+async def virtual_user(client, mix: list, user_weights: list, deadline: float, seed: int, results: list):
+  rng = random.Random(seed)
+  names = [f"user_{index}" for index in range(len(user_weights))]
+  weights = [weight for _, weight, _, _ in mix]
+  while time.monotonic() < deadline:
+    name, _, _, build = rng.choices(mix, weights)[0]
+    user_id = rng.choices(names, user_weights)[0]
+    request = build(rng)
+    request['json']['user_id'] = user_id
+    start = time.perf_counter()
+    try:
+      response = await client.post('/chat', headers={'Authorization': f"Bearer {API_TOKEN}"}, **request)
+      status = response.status_code
+    except Exception as e:
+      status = type(e).__name__
+    results.append({'name': name, 'status': status, 'latency': time.perf_counter() - start})
+
+async def sample_memory(chatbot, started: float, done: int, results: list, samples: list, interval: float):
+  while True:
+    await asyncio.sleep(interval)
+    samples.append(history_sample(chatbot, started, done + len(results)))
+
+def stage_report(concurrency: int, duration: float, results: list) -> dict:
+  latencies = [result['latency'] for result in results if result['status'] == 200]
+  errors = {}
+  for result in results:
+    if result['status'] != 200:
+      errors[str(result['status'])] = errors.get(str(result['status']), 0) + 1
+  return {
+    'concurrency': concurrency,
+    'requests': len(results),
+    'throughput': round(len(latencies) / duration, 2),
+    'p50': round(percentile(latencies, 0.50), 4),
+    'p95': round(percentile(latencies, 0.95), 4),
+    'p99': round(percentile(latencies, 0.99), 4),
+    'mean': round(statistics.fmean(latencies), 4) if latencies else 0.0,
+    'error_rate': round(1 - len(latencies) / len(results), 4) if results else 0.0,
+    'errors': errors,
+  }
+
+async def run(stages: list, duration: float, users: int, zipf: float, seed: int, sample_interval: float) -> dict:
+  import httpx
+  from api.main import app
+
+  chatbot = app.state.chatbot
+  mix = TRAFFIC_MIX
+  mongo_client = fake_mongo_client()
+  if mongo_client is None:
+    print('mongomock not installed, leaving the Mongo questions out of the mix')
+    mix = [entry for entry in mix if not entry[2]]
+
+  user_weights = zipf_weights(users, zipf)
+  report = {'stages': [], 'memory': []}
+  started = time.monotonic()
+  done = 0
+  with mock.patch('pkg.mongo.MongoClient', lambda *args, **kwargs: mongo_client), \
+      mock.patch('pkg.mongo.MongoDBAtlasVectorSearch', FakeVectorSearch), \
+      mock.patch('pkg.trello.TrelloClient', FakeTrelloClient):
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://loadtest', timeout=None) as client:
+      for concurrency in stages:
+        results = []
+        sampler = asyncio.create_task(sample_memory(chatbot, started, done, results, report['memory'], sample_interval))
+        deadline = time.monotonic() + duration
+        stage_started = time.monotonic()
+        await asyncio.gather(*(
+          virtual_user(client, mix, user_weights, deadline, seed * 1000 + concurrency * 100 + index, results)
+          for index in range(concurrency)
+        ))
+        sampler.cancel()
+        stage = stage_report(concurrency, time.monotonic() - stage_started, results)
+        report['stages'].append(stage)
+        done += len(results)
+        report['memory'].append(history_sample(chatbot, started, done))
+        print(
+          f"{concurrency:>4} users | {stage['requests']:>6} req | {stage['throughput']:8.2f} req/s | "
+          f"p50 {stage['p50']:7.3f} s | p95 {stage['p95']:7.3f} s | p99 {stage['p99']:7.3f} s | "
+          f"errors {stage['error_rate']:6.1%} {stage['errors'] or ''}"
+        )
+
+  print('\nuser_chat_histories over time')
+  for sample in report['memory']:
+    print(
+      f"{sample['elapsed']:>7.1f} s | {sample['requests']:>6} req | {sample['users']:>4} users | "
+      f"{sample['messages']:>7} messages | {sample['history_kb']:>9.1f} KB | RSS {sample['rss_mb']:8.1f} MB"
+    )
+  return report
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Load test of /chat against local stand-ins')
+  parser.add_argument('--concurrency', default='1,4,8,16', help='Comma separated virtual users of each stage')
+  parser.add_argument('--duration', type=float, default=30, help='Seconds of each stage')
+  parser.add_argument('--users', type=int, default=50, help='Distinct user IDs')
+  parser.add_argument('--zipf', type=float, default=1.1, help='Exponent of the user ID distribution')
+  parser.add_argument('--seed', type=int, default=42)
+  parser.add_argument('--sample-interval', type=float, default=5, help='Seconds between memory samples')
+  parser.add_argument('--rabbit-latency', type=float, default=0.005, help='Seconds per management API request')
+  parser.add_argument('--llm-latency', type=float, default=0.3, help='Seconds per chat completion')
+  parser.add_argument('--json', help='Also write the report to this file')
+  args = parser.parse_args()
+
+  stand_ins = StandIns(args.rabbit_latency, args.llm_latency)
+  os.environ['API_TOKEN'] = API_TOKEN
+  try:
+    report = asyncio.run(run(
+      [int(value) for value in args.concurrency.split(',')],
+      args.duration, args.users, args.zipf, args.seed, args.sample_interval
+    ))
+  finally:
+    stand_ins.stop()
+  if args.json:
+    with open(args.json, 'w') as f:
+      json.dump(report, f, indent=2)
@@ -0,0 +1,198 @@
+"""
+Scenario benchmarks against the local stand-ins of benchmarks/fakes.py, compared with benchmarks/baselines.json.
+
+A scenario is slower than its baseline when its median goes over the baseline median
+by more than the tolerance, the run then exits with status 1. Baselines depend on the
+machine, record them again with --update-baselines after changing it.
+The Mongo scenario needs mongomock (benchmarks/requirements.txt), without it it is skipped.
+
+Usage:
+  python -m benchmarks.scenarios [--repeat 5] [--only peek_10k,pdf_300] [--tolerance 0.2] [--update-baselines]
+"""
+import os
+import json
+import time
+import base64
+import argparse
+import statistics
+from unittest import mock
+
+from benchmarks.fakes import FakeManagementAPI, FakeOpenAI, fake_mongo_client, make_pdf
+
+BASELINES_PATH = os.path.join(os.path.dirname(__file__), 'baselines.json')
+VHOST = 'aqila-hml'
+BENCH_QUEUE = 'sync_bench'
+
+SCENARIOS = {}
+
+def scenario(name: str):
+  """Register a scenario, the function does the setup and returns the callable that is timed"""
+  def decorator(func):
+    SCENARIOS[name] = func
+    return func
+  return decorator
+
+class StandIns:
+  """Starts the fakes and points the settings of pkg at them, before pkg is imported"""
+
+  def __init__(self, rabbit_latency: float, llm_latency: float):
+    queues = {BENCH_QUEUE: 10000}
+    queues.update({f"sync_{index:04d}": (index * 37) % 500 for index in range(2000)})
+    self.rabbit = FakeManagementAPI(queues, latency=rabbit_latency).start()
+    self.openai = FakeOpenAI(latency=llm_latency).start()
+    os.environ.update({
+      'RABBITMQ_URL': self.rabbit.address,
+      'RABBITMQ_API_SCHEME': 'http',
+      'RABBITMQ_USERNAME': 'guest',
+      'RABBITMQ_PASSWORD': 'guest',
+      'AZURE_OPENAI_ENDPOINT': f"http://{self.openai.address}",
+      'AZURE_OPENAI_API_KEY': 'bench',
+      'AZURE_AP_VERSION': '2024-02-01',
+      'AZURE_DEPLOYMENT_ID': 'gpt-4o',
+      # OpenAI of langchain, used by the command search of pkg.mongo
+      'OPENAI_API_BASE': f"http://{self.openai.address}/v1",
+      'OPENAI_API_KEY': 'bench',
+      'DOWNLOAD_SIGNING_KEY': 'bench',
+      'LOG_LEVEL': os.getenv('LOG_LEVEL', 'WARNING'),
+    })
+
+  def stop(self):
+    self.rabbit.stop()
+    self.openai.stop()
+
+@scenario('peek_10k')
+def peek_10k(stand_ins: StandIns):
+  from pkg.rabbit import Rabbit
+  rabbit = Rabbit()
+
+  def run():
+    messages = rabbit.get_queue_messages(BENCH_QUEUE, limit=10000, vhost=VHOST, reader='http')
+    assert len(messages) == 10000, len(messages)
+  return run
+
+@scenario('summarize_10k')
+def summarize_10k(stand_ins: StandIns):
+  from pkg.rabbit import Rabbit
+  rabbit = Rabbit()
+  return lambda: rabbit.summarize_queue_messages(BENCH_QUEUE, limit=10000, vhost=VHOST, reader='http')
+
+@scenario('snapshot_2k_queues')
+def snapshot_2k_queues(stand_ins: StandIns):
+  from pkg.rabbit import Rabbit
+  rabbit = Rabbit()
+  return lambda: rabbit.get_queues_snapshot(vhost=VHOST)
+
+@scenario('pdf_300')
+def pdf_300(stand_ins: StandIns):
+  from pkg.file_processor import FileProcessor
+  processor = FileProcessor()
+  files = [{'name': 'relatorio.pdf', 'content': base64.b64encode(make_pdf(300)).decode()}]
+  return lambda: processor.process_files(files)
+
+@scenario('dataframe_1k')
+def dataframe_1k(stand_ins: StandIns):
+  import pandas as pd
+  from benchmarks.fakes import make_message
+  from api.formatters.response_translator import translate_response
+  df = pd.json_normalize([make_message(index)['config'] for index in range(1000)])
+  df['qtd'] = range(1000)
+  return lambda: translate_response(df, download_base_url='http://localhost:8000')
+
+@scenario('markdown_100')
+def markdown_100(stand_ins: StandIns):
+  from benchmarks.bench_markdown import build_answer
+  from api.formatters.response_translator import translate_response
+  text = build_answer(100)
+  return lambda: translate_response(text)
+
+@scenario('mongo_errors')
+def mongo_errors(stand_ins: StandIns):
+  client = fake_mongo_client()
+  if client is None:
+    return None
+  from pkg import mongo
+  with mock.patch.object(mongo, 'MongoClient', lambda *args, **kwargs: client):
+    service = mongo.Mongo('aqila')
+  return service.summarize_collections_with_error
+
+@scenario('chat_llm_turn')
+def chat_llm_turn(stand_ins: StandIns):
+  from pkg.chatbot import Chatbot
+  from pkg.request_context import RequestContext
+  chatbot = Chatbot()
+  return lambda: chatbot.chat(f"como está a fila {BENCH_QUEUE} agora?", RequestContext(VHOST, 'bench_llm'))
+
+@scenario('chat_routed_turn')
+def chat_routed_turn(stand_ins: StandIns):
+  from pkg.chatbot import Chatbot
+  from pkg.request_context import RequestContext
+  chatbot = Chatbot()
+  return lambda: chatbot.chat(f"quantas mensagens tem na fila {BENCH_QUEUE}", RequestContext(VHOST, 'bench_rules'))
+
+def measure(func, repeat: int) -> dict:
+  func()  # warmup: connections, tokenizer, caches
+  timings = []
+  for _ in range(repeat):
+    start = time.perf_counter()
+    func()
+    timings.append(time.perf_counter() - start)
+  return {'median': statistics.median(timings), 'min': min(timings), 'max': max(timings)}
+
+def load_baselines() -> dict:
+  if not os.path.exists(BASELINES_PATH):
+    return {}
+  with open(BASELINES_PATH) as f:
+    return json.load(f)
+
+def run(names: list, repeat: int, tolerance: float, update_baselines: bool, rabbit_latency: float, llm_latency: float) -> int:
+  stand_ins = StandIns(rabbit_latency, llm_latency)
+  baselines = load_baselines()
+  regressions = []
+  try:
+    for name in names:
+      try:
+        func = SCENARIOS[name](stand_ins)
+        if func is None:
+          print(f"{name:<20} | skipped, dependency not installed")
+          continue
+        result = measure(func, repeat)
+      except Exception as e:
+        print(f"{name:<20} | failed: {type(e).__name__}: {e}")
+        regressions.append(name)
+        continue
+
+      baseline = baselines.get(name, {}).get('median')
+      if baseline:
+        change = result['median'] / baseline - 1
+        status = 'REGRESSION' if change > tolerance else 'ok'
+        if change > tolerance:
+          regressions.append(name)
+        comparison = f"baseline {baseline:8.3f} s | {change:+7.1%} {status}"
+      else:
+        comparison = 'no baseline'
+      print(f"{name:<20} | median {result['median']:8.3f} s | min {result['min']:8.3f} s | {comparison}")
+
+      if update_baselines:
+        baselines[name] = {'median': round(result['median'], 4), 'repeat': repeat}
+  finally:
+    stand_ins.stop()
+
+  if update_baselines:
+    with open(BASELINES_PATH, 'w') as f:
+      json.dump(baselines, f, indent=2, sort_keys=True)
+      f.write('\n')
+    print(f"Baselines written to {BASELINES_PATH}")
+    return 0
+  return 1 if regressions else 0
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Scenario benchmarks against local stand-ins')
+  parser.add_argument('--repeat', type=int, default=5)
+  parser.add_argument('--only', help='Comma separated scenarios, all by default: ' + ', '.join(SCENARIOS))
+  parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed slowdown over the baseline median')
+  parser.add_argument('--update-baselines', action='store_true')
+  parser.add_argument('--rabbit-latency', type=float, default=0.005, help='Seconds per management API request')
+  parser.add_argument('--llm-latency', type=float, default=0.05, help='Seconds per chat completion')
+  args = parser.parse_args()
+  names = args.only.split(',') if args.only else list(SCENARIOS)
+  raise SystemExit(run(names, args.repeat, args.tolerance, args.update_baselines, args.rabbit_latency, args.llm_latency))
@@ -1,6 +1,6 @@
 from dotenv import load_dotenv
 import os
-from openai import AzureOpenAI
+from openai import AzureOpenAI, APITimeoutError
 import tiktoken
 import json
 import pandas as pd
@@ -10,32 +10,89 @@ import pkg.github as github_service
 import pkg.pulpo as pulpo_service
 import pkg.trello as trello_service
 import inspect
+import time
 from pkg.file_processor import FileProcessor
-from pkg.constants import TOOLS
+from pkg.summarizer import Summarizer
+from pkg.message_decoder import DecodeStats
+from pkg.queue_metrics import QueueMetricsStore, QUEUE_METRICS_VHOSTS
+from pkg.reprocess_jobs import ReprocessJobEngine
+from pkg.usage import UsageTracker
+from pkg.logger import get_logger
+from pkg.telemetry import metrics, span, traced, set_attribute
+from pkg.digest import digest_result
+from pkg.result_store import ResultStore
+from pkg.shared_state import ChatHistories, shared_state
+from pkg.request_context import RequestContext, DeadlineExceeded, current_context, llm_client
+from pkg.resilience import CircuitOpen, hedged, breakers_snapshot
+from pkg.intent_router import IntentRouter, INTENT_ROUTER_ENABLED
+from pkg.semantic_cache import SemanticCache, SEMANTIC_CACHE_EMBEDDING_DEPLOYMENT
+from pkg.constants import TOOLS, QUEUE_METRICS_TOOLS, SYSTEM_MESSAGE, TASK_HELPER_PROMPT
+
+log = get_logger('chatbot')
+
+# Conservative token limit for GPT-4o, for the system message, the tools and the history together
+CONTEXT_TOKEN_LIMIT = 8000
+
+def azure_client(deployment: str) -> AzureOpenAI:
+    """Azure OpenAI client of one deployment, which becomes part of its base URL"""
+    return AzureOpenAI(
+        api_version=os.getenv('AZURE_AP_VERSION'),
+        api_key=os.getenv('AZURE_OPENAI_API_KEY'),
+        azure_deployment=deployment
+    )
 
 class Chatbot:
     def __init__(self):
         load_dotenv()
-        self.client = AzureOpenAI(
-            api_version=os.getenv('AZURE_AP_VERSION'),
-            api_key=os.getenv('AZURE_OPENAI_API_KEY'),
-            azure_deployment=os.getenv('AZURE_DEPLOYMENT_ID')
-        )
+        self.client = azure_client(os.getenv('AZURE_DEPLOYMENT_ID'))
+        # With the deployment in the base URL the model of a request is ignored, so the
+        # embeddings can't go through the chat client
+        self.embedding_client = azure_client(SEMANTIC_CACHE_EMBEDDING_DEPLOYMENT) if SEMANTIC_CACHE_EMBEDDING_DEPLOYMENT else None
         self.MODEL = 'gpt-4o-2024-11-20'
         self.VISION_MODEL = 'gpt-4o-vision-2024-05'
         self.rabbit = rabbit_service.Rabbit()
-        self.vhost = None
-        self.user_chat_histories = {}  # Dictionary to store chat histories by user ID
+        self.user_chat_histories = ChatHistories()  # By user ID, in the shared state with several workers
         self.file_processor = FileProcessor()  # Initialize FileProcessor
-
-    def chat(self, query: str, vhost: str, user_id: str = "default", files=None) -> list:
+        self.usage = UsageTracker()
+        self.summarizer = Summarizer(self.client, self.MODEL, usage=self.usage)
+        # The queue history tools only have data when the API samples the queues
+        self.tools = [
+            tool for tool in TOOLS
+            if QUEUE_METRICS_VHOSTS or tool['function']['name'] not in QUEUE_METRICS_TOOLS
+        ]
+        # Tokens of the cacheable prefix, cached_tokens of the chat calls should get close to it
+        self.prompt_prefix_tokens = self.summarizer.count_tokens(
+            SYSTEM_MESSAGE['content'] + json.dumps(self.tools, ensure_ascii=False, separators=(',', ':'))
+        )
+        # The prefix is sent on top of the history
+        self.history_token_limit = CONTEXT_TOKEN_LIMIT - self.prompt_prefix_tokens
+        self.intent_router = IntentRouter() if INTENT_ROUTER_ENABLED else None
+        # Routing decisions of near-duplicate questions, only with an embedding deployment configured
+        self.semantic_cache = SemanticCache(self.embed_query) if SEMANTIC_CACHE_EMBEDDING_DEPLOYMENT else None
+        self.results = ResultStore(shared=shared_state)  # Full tool results, the history only keeps their digest
+        self.queue_metrics = QueueMetricsStore()  # Filled by the QueueMetricsSampler of the API
+        self.reprocess_jobs = ReprocessJobEngine()
+
+    def llm(self) -> AzureOpenAI:
+        """The OpenAI client with the timeout of the request deadline"""
+        return llm_client(self.client)
+
+    def warmup(self):
+        """Open the backend connections before the first request of the worker, the tokenizer is loaded above"""
+        for name, step in (('rabbit', self.rabbit.warmup), ('mongo', mongo_service.warmup)):
+            try:
+                with span(f'warmup.{name}'):
+                    step()
+            except Exception as e:
+                log.warning('Warmup step failed', step=name, error=str(e))
+
+    @traced('chat.turn')
+    def chat(self, query: str, ctx: RequestContext, files=None) -> list:
+        user_id = ctx.user_id
+        # Outbound calls read the deadline of the request from the context variable
+        token = current_context.set(ctx)
         try:
-            self.vhost = vhost
-
-            if user_id not in self.user_chat_histories:
-                self.user_chat_histories[user_id] = []
-
-            chat_history = self.user_chat_histories[user_id]
+            chat_history = self.user_chat_histories.load(user_id)
 
             history_limit_warning = None
             if len(chat_history) >= 10:
@@ -51,51 +108,105 @@ class Chatbot:
                 file_content = self.file_processor.process_files(files)
 
                 if file_content and isinstance(file_content, str):
+                    # Oversized files are summarized first so the query fits in the context
+                    if self.summarizer.count_tokens(file_content) > self.summarizer.chunk_tokens:
+                        file_content = self.summarizer.summarize(file_content, 'file')
                     query = f"{query}\n\nContent from file(s):\n{file_content}"
 
-            if files and not isinstance(file_content, str):
-                initial_response = self.make_vision_request(query, file_content, user_id)
+            # Routine commands are resolved by the rules, then near-duplicates by the cache, the rest by the LLM
+            routed, query_vector = None, None
+            if self.intent_router is not None and not files:
+                routed = self.intent_router.route(query)
+            if routed is None and self.semantic_cache is not None and not files:
+                routed, query_vector = self.semantic_cache.lookup(query, ctx.vhost)
+
+            routed_by = 'llm' if not routed else 'cache' if query_vector is not None else 'rules'
+            set_attribute('routed_by', routed_by)
+            metrics.inc('alfredo_chat_routing_total', routed_by=routed_by)
+            if routed:
+                function_name, arguments = routed
+                chat_history.append({'role': 'user', 'content': query})
+                log.info('Routed without LLM', user_id=user_id, routed_by=routed_by, function_name=function_name, arguments=arguments)
             else:
-                initial_response = self.make_openai_request(query, user_id)
+                if files and not isinstance(file_content, str):
+                    initial_response = self.make_vision_request(query, file_content, user_id)
+                else:
+                    initial_response = self.make_openai_request(query, user_id)
 
-            message = initial_response.choices[0].message
+                message = initial_response.choices[0].message
 
-            print(f"user_id: {user_id} || chat_history: {chat_history}")
-            print('--------------------------------')
-            print(f"Initial response: {message}")
+                log.debug('Routing response', user_id=user_id, history_size=len(chat_history), content=message.content)
+
+                if not (hasattr(message, 'tool_calls') and message.tool_calls):
+                    chat_history.append({'role': 'assistant', 'content': message.content})
+
+                    if history_limit_warning:
+                        return history_limit_warning + "\n\n" + message.content
+
+                    self.user_chat_histories[user_id] = chat_history
+
+                    return message.content
 
-            if hasattr(message, 'tool_calls') and message.tool_calls:
                 tool_call = message.tool_calls[0]
                 function_name = tool_call.function.name
                 arguments = json.loads(tool_call.function.arguments)
-                print(f"function_name: {function_name}, arguments: {arguments}")
-
-                # Check if method accepts user_id parameter
-                method = getattr(self, function_name)
-                signature = inspect.signature(method)
-                if 'user_id' in signature.parameters:
-                    arguments['user_id'] = user_id
+                log.info('Routed by LLM', user_id=user_id, function_name=function_name, arguments=arguments)
 
-                function_response = method(**arguments)
+            function_response = self.run_tool(function_name, arguments, ctx)
+            if query_vector is not None and not routed and function_response is not None:
+                # Only routing decisions whose tool ran without errors are cached, None is how tools report a failure
+                self.semantic_cache.store(query, query_vector, ctx.vhost, function_name, arguments)
+            with span('history.digest'):
                 chat_history.append({
                     'role': 'assistant',
-                    'content': self.format_function_response(function_response)
+                    'content': self.digest_function_response(function_response)
                 })
 
-                return function_response
-
-            chat_history.append({'role': 'assistant', 'content': message.content})
-
-            if history_limit_warning:
-                return history_limit_warning + "\n\n" + message.content
-
-            self.user_chat_histories[user_id] = chat_history
-
-            return message.content
+            return function_response
+        except CircuitOpen as e:
+            log.warning('Chat turn failed fast', user_id=user_id, dependency=e.dependency)
+            return f'⚠️ {e.dependency} está indisponível no momento, tente novamente em {max(int(e.retry_after), 1)} segundos.'
+        except (DeadlineExceeded, APITimeoutError) as e:
+            source = e.source if isinstance(e, DeadlineExceeded) else 'Azure OpenAI'
+            metrics.inc('alfredo_deadline_exceeded_total', source=source)
+            log.warning('Chat turn deadline exceeded', user_id=user_id, source=source)
+            return f'⏱️ Não consegui responder a tempo: {source} não respondeu dentro do prazo. Tente novamente em instantes.'
         except Exception as e:
-            print(f"Error: {e}")
+            log.exception('Chat turn failed', user_id=user_id)
             return f'Perdão, mas não consegui responder a sua pergunta. Erro: {str(e)}'
+        finally:
+            self.user_chat_histories.save(user_id)
+            current_context.reset(token)
     
+    def run_tool(self, function_name: str, arguments: dict, ctx: RequestContext):
+        arguments = dict(arguments)
+
+        # The request context and the user are injected, they are never arguments of the LLM
+        method = getattr(self, function_name)
+        signature = inspect.signature(method)
+        if 'ctx' in signature.parameters:
+            arguments['ctx'] = ctx
+        if 'user_id' in signature.parameters:
+            arguments['user_id'] = ctx.user_id
+
+        with span(f'tool.{function_name}'):
+            return method(**arguments)
+
+    @traced('llm.embedding')
+    def embed_query(self, query: str) -> list:
+        response = llm_client(self.embedding_client).embeddings.create(model=SEMANTIC_CACHE_EMBEDDING_DEPLOYMENT, input=query)
+        self.usage.record('embedding', response)
+        return response.data[0].embedding
+
+    def get_usage(self) -> dict:
+        return {
+            **self.usage.snapshot(),
+            'prompt_prefix_tokens': self.prompt_prefix_tokens,
+            'intent_router': self.intent_router.stats if self.intent_router is not None else None,
+            'semantic_cache': self.semantic_cache.stats if self.semantic_cache is not None else None,
+            'circuit_breakers': breakers_snapshot(),
+        }
+
     def ensure_context_size(self, messages, token_limit):
         tokenizer = tiktoken.get_encoding("cl100k_base")  # Use a known supported encoding
 
@@ -111,21 +222,24 @@ class Chatbot:
 
         return messages
 
+    @traced('llm.routing')
     def make_openai_request(self, query: str, user_id: str = "default") -> dict:
         messages = self.user_chat_histories.get(user_id, [])
         messages.append({'role': 'user', 'content': query})
         
-        token_limit = 8000  # Conservative token limit for GPT-4o
-        messages = self.ensure_context_size(messages, token_limit)
+        messages = self.ensure_context_size(messages, self.history_token_limit)
         
-        response = self.client.chat.completions.create(
+        # System prompt and tools first and always the same, the history only follows them
+        response = self.llm().chat.completions.create(
             model=self.MODEL,
-            messages=messages,
-            tools=TOOLS,
+            messages=[SYSTEM_MESSAGE, *messages],
+            tools=self.tools,
             tool_choice='auto'
         )
+        self.usage.record('chat', response)
         return response
     
+    @traced('llm.vision')
     def make_vision_request(self, query: str, image_contents, user_id: str = "default") -> dict:
         """Make a request to the vision model with image content"""
         
@@ -134,13 +248,15 @@ class Chatbot:
         for img in image_contents:
             content.append(img)
         
-        response = self.client.chat.completions.create(
+        response = self.llm().chat.completions.create(
             model=self.VISION_MODEL,
             messages=[{"role": "user", "content": content}],
             max_tokens=1000
         )
+        self.usage.record('vision', response)
         return response
 
+    @traced('llm.follow_up')
     def make_follow_up_request(self, query:str, initial_message:str, function_name:str, function_response, user_id:str = "default") -> dict:
         chat_history = self.user_chat_histories.get(user_id, [])
         
@@ -159,76 +275,141 @@ class Chatbot:
                 'content': function_response,
             })
         
-        token_limit = 8000  # Conservative token limit for GPT-4o
-        messages = self.ensure_context_size(messages, token_limit)
+        messages = self.ensure_context_size(messages, self.history_token_limit)
         
-        response = self.client.chat.completions.create(
+        response = self.llm().chat.completions.create(
             model=self.MODEL,
-            messages=messages,
-            functions=TOOLS
+            messages=[SYSTEM_MESSAGE, *messages],
+            functions=self.tools
         )
+        self.usage.record('follow_up', response)
         return response
     
     def analyze_file(self, file_content: str, file_type: str) -> str:
         """Analyze file content and return a summary"""
-        prompt = f"""
-        Please analyze the following {file_type} content and provide a concise summary:
-        
-        {file_content}
-        
-        Focus on:
-        1. Key information and main topics
-        2. Important statistics or data points
-        3. Overall insights
-        4. Potential issues or anomalies
-        
-        Please format your response as a clear, structured summary.
-        """
-        
-        response = self.client.chat.completions.create(
-            model=self.MODEL,
-            messages=[{'role': 'user', 'content': prompt}],
-            temperature=0.3,
-            max_tokens=800
-        )
-        
-        return response.choices[0].message.content
+        return self.summarizer.summarize(file_content, file_type)
     
     def summarize_file(self, file_content: str, file_type: str) -> str:
         """Analyze and summarize file content"""
         return self.analyze_file(file_content, file_type)
     
-    def get_queue_messages(self, queue_name:str=None, gpa_code:int=None, collection:str=None, limit:int=None) -> list:
-        print(f"queue_name: {queue_name}, gpa_code: {gpa_code}, collection: {collection}, limit: {limit}")
+    def get_queue_messages(self, ctx: RequestContext, queue_name:str=None, gpa_code:int=None, collection:str=None, limit:int=None, reader:str=None) -> list:
+        log.debug('Reading queue messages', queue_name=queue_name, gpa_code=gpa_code, collection=collection, limit=limit)
         if queue_name is None and gpa_code is not None:
             queue_name = str(gpa_code)
-        return self.rabbit.get_queue_messages(queue_name, gpa_code, collection, limit, vhost=self.vhost)
+        decode_stats = DecodeStats()
+        try:
+            messages = self.rabbit.get_queue_messages(queue_name, gpa_code, collection, limit, vhost=ctx.vhost, decode_stats=decode_stats, reader=reader)
+        except rabbit_service.QueueNotFoundError as e:
+            return str(e)
+        if decode_stats.failed:
+            log.warning('Failed to decode messages', queue_name=queue_name, failed=decode_stats.failed, errors=decode_stats.errors[:5])
+        return messages
 
-    def get_queue_status(self, queue_name:str=None, without_messages:bool=False) -> pd.DataFrame:
-        return self.rabbit.get_queue_status(queue_name, without_messages, vhost=self.vhost)
+    def get_queue_status(self, ctx: RequestContext, queue_name:str=None, without_messages:bool=False) -> pd.DataFrame:
+        if queue_name is None:
+            return self.rabbit.get_queue_status(None, without_messages, vhost=ctx.vhost)
+        # One GET of one queue, idempotent, so a slow answer can be hedged
+        return hedged('get_queue_status', self.rabbit.get_queue_status, queue_name, without_messages, vhost=ctx.vhost)
     
-    def summarize_queue_messages(self, queue_name:str, limit:int=None) -> pd.DataFrame:
-        return self.rabbit.summarize_queue_messages(queue_name, limit, vhost=self.vhost)
+    def get_queues_snapshot(self, ctx: RequestContext, name_filter:str=None, with_rates:bool=True) -> pd.DataFrame:
+        return self.rabbit.get_queues_snapshot(vhost=ctx.vhost, name_filter=name_filter, with_rates=with_rates)
+
+    def get_queue_trend(self, ctx: RequestContext, queue_name:str, minutes:int=60) -> str:
+        """Answer from the sampled queue metrics whether a queue is growing"""
+        trend = self.queue_metrics.trend(ctx.vhost, queue_name, minutes * 60)
+        if trend is None:
+            return f"Ainda não há amostras suficientes da fila {queue_name} em {ctx.vhost} para os últimos {minutes} minutos."
+
+        if trend['delta'] > 0:
+            direction = 'crescendo'
+        elif trend['delta'] < 0:
+            direction = 'diminuindo'
+        else:
+            direction = 'estável'
+
+        return (
+            f"A fila {queue_name} está {direction}: passou de {trend['first_depth']:.0f} para {trend['last_depth']:.0f} mensagens "
+            f"em {trend['minutes']:.0f} minutos ({trend['rate_per_minute']:+.1f} msg/min, máximo de {trend['max_depth']:.0f}). "
+            f"Consumidores: {trend['consumers']:.0f}."
+        )
+
+    def get_queue_depth_at(self, ctx: RequestContext, queue_name:str, minutes_ago:int) -> str:
+        """Answer from the sampled queue metrics what the depth of a queue was some minutes ago"""
+        point = self.queue_metrics.depth_at(ctx.vhost, queue_name, time.time() - minutes_ago * 60)
+        if point is None:
+            return f"Não há amostras da fila {queue_name} em {ctx.vhost} de {minutes_ago} minutos atrás."
+
+        sampled_at = time.strftime('%d/%m %H:%M', time.localtime(point[0]))
+        return f"Às {sampled_at} a fila {queue_name} tinha {point[1]:.0f} mensagens e {point[2]:.0f} consumidores."
+
+    def summarize_queue_messages(self, ctx: RequestContext, queue_name:str, limit:int=None, reader:str=None) -> pd.DataFrame:
+        try:
+            return self.rabbit.summarize_queue_messages(queue_name, limit, vhost=ctx.vhost, reader=reader)
+        except rabbit_service.QueueNotFoundError as e:
+            return str(e)
     
-    def summarize_collections_with_error(self) -> pd.DataFrame:
-        mongo = mongo_service.Mongo(database=self.vhost)
+    def reprocess_queue(self, ctx: RequestContext, queue_name:str, limit:int=None) -> str:
+        """Start a background job moving the messages of a dead-letter queue back to its destination"""
+        job = self.reprocess_jobs.submit(ctx.vhost, queue_name, limit)
+        if job is None:
+            return f"Não encontrei a fila {queue_name} em {ctx.vhost}."
+        return (
+            f"Reprocessamento {job.id} iniciado: até {job.limit} mensagens da fila {job.source_queue} "
+            f"para a fila {job.destination_queue}. Pergunte pelo status do job {job.id} para acompanhar."
+        )
+
+    def get_reprocess_job_status(self, job_id:str) -> str:
+        job = self.reprocess_jobs.get(job_id)
+        if job is None:
+            return f"Não encontrei o job de reprocessamento {job_id}."
+
+        status = (
+            f"Job {job.id} ({job.source_queue} -> {job.destination_queue}): {job.status}, "
+            f"{job.processed} de {job.limit} mensagens reprocessadas, {job.failed} com falha."
+        )
+        if job.error:
+            status += f" Erro: {job.error}"
+        if job.status == 'interrupted':
+            status += " O job foi interrompido e pode ser retomado."
+        return status
+
+    def resume_reprocess_job(self, job_id:str) -> str:
+        job = self.reprocess_jobs.resume(job_id)
+        if job is None:
+            return f"Não encontrei o job de reprocessamento {job_id}."
+        return self.get_reprocess_job_status(job_id)
+
+    def query_result(self, handle:str, offset:int=0, limit:int=50, filter_column:str=None, filter_value:str=None, group_by:str=None):
+        try:
+            result = self.results.query(handle, offset, limit, filter_column, filter_value, group_by)
+        except KeyError as e:
+            return str(e.args[0])
+        if result is None:
+            return f"O resultado {handle} não foi encontrado ou já expirou, faça a consulta novamente."
+        if result.empty:
+            return f"Nenhuma linha encontrada no resultado {handle}."
+        return result
+
+    def summarize_collections_with_error(self, ctx: RequestContext) -> pd.DataFrame:
+        mongo = mongo_service.Mongo(database=ctx.vhost)
         return mongo.summarize_collections_with_error()
     
-    def summarize_pictures_by_status(self, status: str) -> pd.DataFrame:
-        mongo = mongo_service.Mongo(database=self.vhost)
+    def summarize_pictures_by_status(self, ctx: RequestContext, status: str) -> pd.DataFrame:
+        mongo = mongo_service.Mongo(database=ctx.vhost)
         return mongo.summarize_pictures_by_status(status=status)
     
     def search_pull_requests(self, repo_name:str='', label:str='', status:str='closed') -> list:
         github = github_service.Github()
         return github.search_pull_requests(repo_name, status, label)
     
-    def command_helper(self, question: str) -> str:
-        mongo = mongo_service.Mongo(database=self.vhost)
+    def command_helper(self, ctx: RequestContext, question: str) -> str:
+        mongo = mongo_service.Mongo(database=ctx.vhost)
         return mongo.command_helper(question)
     
     def search_documents(self, search_term: str) -> str:
         pulpo = pulpo_service.Pulpo()
-        search_result = pulpo.search_documents(search_term)
+        search_result = hedged('search_documents', pulpo.search_documents, search_term)
 
         documents = [
             f"[{self.strip_content(doc.get('content', ''))}]({doc.get('url')})\n\n"
@@ -255,30 +436,17 @@ class Chatbot:
             'role': 'user',
             'content': f"### Context:\n{cards}"
         })
-        prompt = f"""
-          You are an experienced tech leader assisting a development team to search and get information about tasks in Trello.  
-          Your goal is to provide **clear, objective, and well-founded answers** based strictly on the provided context.  
-
-          ### Instructions:  
-          You will receive a JSON with multiple tasks. 
-          If the context has only one task then you will summarize the task and provide the answer.
-          Else, create a list of tasks with the id (the number in the card), name and a link to the task.
-          Then, ask which task you would like to discuss. If I send a number or description, respond based on that information.
-          ---  
-          ### Context:  
-          {cards}
-          ---  
-          ### Instructions:  
-          - **Always provide the answer in Portuguese.**  
-
-          Now, provide your response.
-        """
-
-        response = self.client.chat.completions.create(
-            model=self.MODEL,
-            messages=[{'role': 'user', 'content': prompt}],
-            max_tokens=8000
-        )
+        # The instructions are a fixed system message, only the cards change between requests
+        with span('llm.task_helper'):
+            response = self.llm().chat.completions.create(
+                model=self.MODEL,
+                messages=[
+                    {'role': 'system', 'content': TASK_HELPER_PROMPT},
+                    {'role': 'user', 'content': f"### Context:\n{cards}\n---\nNow, provide your response."}
+                ],
+                max_tokens=8000
+            )
+            self.usage.record('task_helper', response)
 
         self.user_chat_histories[user_id] = chat_history
       
@@ -288,11 +456,7 @@ class Chatbot:
         content_index = content.find('\n', 0)
         return content[:content_index].strip()
 
-    def format_function_response(self, function_response):
-        """Format the function response for better readability."""
-        if isinstance(function_response, dict):
-            return json.dumps(function_response, indent=4, ensure_ascii=False)
-        elif isinstance(function_response, list):
-            return '\n'.join(map(str, function_response))
-        else:
-            return str(function_response)
\ No newline at end of file
+    def digest_function_response(self, function_response) -> str:
+        """Token-budgeted digest of a tool result for the chat history, the full result is kept in `self.results`"""
+        handle = self.results.put(function_response)
+        return digest_result(function_response, self.summarizer.count_tokens, handle=handle)
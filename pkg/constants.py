@@ -5,6 +5,21 @@ class RoutingKey:
   AQILA_FIREBIRD_TO_API = 'aqila.firebird_to_api'
   AQILA_API_TO_FIREBIRD = 'aqila'
 
+SYSTEM_PROMPT = """You are Alfredo, an assistant of the development and support teams of Aqila.
+You monitor the RabbitMQ queues, the MongoDB synchronization, the GitHub pull requests,
+the Pulpo knowledge base and the Trello tasks using the available tools.
+Prefer calling a tool over guessing, and always answer in Portuguese."""
+
+TASK_HELPER_PROMPT = """You are an experienced tech leader assisting a development team to search and get information about tasks in Trello.
+Your goal is to provide **clear, objective, and well-founded answers** based strictly on the provided context.
+
+### Instructions:
+You will receive a JSON with multiple tasks.
+If the context has only one task then you will summarize the task and provide the answer.
+Else, create a list of tasks with the id (the number in the card), name and a link to the task.
+Then, ask which task you would like to discuss. If I send a number or description, respond based on that information.
+- **Always provide the answer in Portuguese.**"""
+
 TOOLS = [
     {
         'type': 'function',
@@ -59,6 +74,71 @@ TOOLS = [
             },
         }
     },
+    {
+        'type': 'function',
+        'function': {
+            'name': 'get_queues_snapshot',
+            'description': 'Get a snapshot of the queues with depth, message rates (publish/deliver per second) and consumer utilisation, optionally filtered by name',
+            'parameters': {
+                'type': 'object',
+                'properties': {
+                    'name_filter': {
+                        'type': 'string',
+                        'description': 'A regular expression to filter the queue names, e.g. "sync_" or "-dlq$"',
+                        'default': None,
+                    },
+                    'with_rates': {
+                        'type': 'boolean',
+                        'description': 'Whether to include the message rates and consumer utilisation',
+                        'default': True,
+                    },
+                }
+            }
+        }
+    },
+    {
+        'type': 'function',
+        'function': {
+            'name': 'get_queue_trend',
+            'description': 'Tell whether a queue is growing or shrinking, based on the depth sampled over the last minutes',
+            'parameters': {
+                'type': 'object',
+                'properties': {
+                    'queue_name': {
+                        'type': 'string',
+                        'description': 'The name of the queue, e.g. "sync_mongo_to_postgres"',
+                    },
+                    'minutes': {
+                        'type': 'integer',
+                        'description': 'The time window in minutes to analyze',
+                        'default': 60,
+                    },
+                },
+                'required': ['queue_name'],
+            }
+        }
+    },
+    {
+        'type': 'function',
+        'function': {
+            'name': 'get_queue_depth_at',
+            'description': 'Get how many messages a queue had some minutes ago, e.g. "quantas mensagens a fila X tinha uma hora atrás?"',
+            'parameters': {
+                'type': 'object',
+                'properties': {
+                    'queue_name': {
+                        'type': 'string',
+                        'description': 'The name of the queue, e.g. "sync_mongo_to_postgres"',
+                    },
+                    'minutes_ago': {
+                        'type': 'integer',
+                        'description': 'How many minutes ago, e.g. 60 for one hour ago',
+                    },
+                },
+                'required': ['queue_name', 'minutes_ago'],
+            }
+        }
+    },
     {
         'type': 'function',
         'function': {
@@ -81,6 +161,104 @@ TOOLS = [
             }
         }
     },
+    {
+        'type': 'function',
+        'function': {
+            'name': 'reprocess_queue',
+            'description': 'Reprocess (resend) the messages of a dead-letter queue to its destination queue in a background job, e.g. "reprocesse as mensagens da fila sync_to_mongo-dlq"',
+            'parameters': {
+                'type': 'object',
+                'properties': {
+                    'queue_name': {
+                        'type': 'string',
+                        'description': 'The name of the dead-letter queue, e.g. "sync_to_mongo-dlq"',
+                    },
+                    'limit': {
+                        'type': 'integer',
+                        'description': 'The maximum number of messages to reprocess, if not provided will reprocess all messages',
+                        'default': None,
+                    },
+                },
+                'required': ['queue_name'],
+            }
+        }
+    },
+    {
+        'type': 'function',
+        'function': {
+            'name': 'get_reprocess_job_status',
+            'description': 'Get the status and progress of a reprocess job by its id',
+            'parameters': {
+                'type': 'object',
+                'properties': {
+                    'job_id': {
+                        'type': 'string',
+                        'description': 'The id of the reprocess job, e.g. "3f9a1c2b"',
+                    },
+                },
+                'required': ['job_id'],
+            }
+        }
+    },
+    {
+        'type': 'function',
+        'function': {
+            'name': 'resume_reprocess_job',
+            'description': 'Resume an interrupted or failed reprocess job by its id',
+            'parameters': {
+                'type': 'object',
+                'properties': {
+                    'job_id': {
+                        'type': 'string',
+                        'description': 'The id of the reprocess job, e.g. "3f9a1c2b"',
+                    },
+                },
+                'required': ['job_id'],
+            }
+        }
+    },
+    {
+        'type': 'function',
+        'function': {
+            'name': 'query_result',
+            'description': 'Page, filter or group a previous tool result by its handle, shown as "[result <handle>]" in the conversation, without fetching the data again. Use it for follow-ups like "os próximos 50" or "filtre esses pelo model X"',
+            'parameters': {
+                'type': 'object',
+                'properties': {
+                    'handle': {
+                        'type': 'string',
+                        'description': 'The handle of the result, e.g. "3fa2c91b"'
+                    },
+                    'offset': {
+                        'type': 'integer',
+                        'description': 'The first row to return, e.g. 50 for the next 50 rows after the first 50',
+                        'default': 0
+                    },
+                    'limit': {
+                        'type': 'integer',
+                        'description': 'The number of rows to return',
+                        'default': 50
+                    },
+                    'filter_column': {
+                        'type': 'string',
+                        'description': 'The column to filter by, e.g. "config.model" or "collection"',
+                        'default': None
+                    },
+                    'filter_value': {
+                        'type': 'string',
+                        'description': 'The value the rows must have in filter_column',
+                        'default': None
+                    },
+                    'group_by': {
+                        'type': 'string',
+                        'description': 'The column to count the rows by, e.g. "config.gpa_code"',
+                        'default': None
+                    }
+                },
+                'required': ['handle']
+            }
+        }
+    },
     {
         'type': 'function',
         'function': {
@@ -189,3 +367,10 @@ TOOLS = [
         }
     }
 ]
+
+# Answered from the samples of the QueueMetricsSampler, only offered when QUEUE_METRICS_VHOSTS is set
+QUEUE_METRICS_TOOLS = ('get_queue_trend', 'get_queue_depth_at')
+
+# The static prefix of every chat request, with TOOLS, it must stay byte-identical between
+# requests so the provider can serve it from its prompt cache. Nothing per request goes in here.
+SYSTEM_MESSAGE = {'role': 'system', 'content': SYSTEM_PROMPT}
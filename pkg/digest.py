@@ -0,0 +1,100 @@
+import os
+from collections import Counter
+import orjson
+import pandas as pd
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MESSAGE_GROUP_KEYS = ('gpa_code', 'model', 'action')
+# Columns holding a count per row, results are ranked by the first one found
+COUNT_COLUMNS = ('qtd', 'qtde', 'messages_count', 'count')
+# Tokens a tool result may take in the chat history
+TOOL_DIGEST_TOKENS = int(os.getenv('TOOL_DIGEST_TOKENS', 600))
+DIGEST_TOP_GROUPS = 5
+DIGEST_SAMPLE_ROWS = 50
+DIGEST_VALUE_SIZE = 300
+
+def count_message_groups(messages, keys: tuple = MESSAGE_GROUP_KEYS, top: int = None) -> list:
+  """Count queue messages grouped by the given `config` fields, most common groups first.
+
+  `messages` can be any iterable, so the counting never needs all messages in memory,
+  only one counter entry per distinct group.
+  """
+  counter = Counter()
+  for message in messages:
+    config = message.get('config') if isinstance(message, dict) else None
+    if not isinstance(config, dict):
+      continue
+    counter[tuple(str(config.get(key)) for key in keys)] += 1
+
+  return [
+    {**dict(zip(keys, group)), 'qtd': count}
+    for group, count in counter.most_common(top)
+  ]
+
+def compact_value(value) -> str:
+  text = value if isinstance(value, str) else orjson.dumps(value, default=str).decode()
+  return text if len(text) <= DIGEST_VALUE_SIZE else text[:DIGEST_VALUE_SIZE] + '...'
+
+def describe_dataframe(df: pd.DataFrame) -> tuple:
+  header = f"DataFrame with {len(df)} rows, columns: {', '.join(map(str, df.columns))}"
+  lines = []
+  count_columns = [col for col in COUNT_COLUMNS if col in df.columns]
+  if count_columns:
+    count_column = count_columns[0]
+    # Counts may come as text, e.g. from JSON, values that are not numbers count as missing
+    counts = pd.to_numeric(df[count_column], errors='coerce')
+    lines.append(f"total {count_column}: {counts.sum()}")
+    # The rows with the biggest counts are the ones worth keeping
+    df = df.loc[counts.sort_values(ascending=False, na_position='last').index[:DIGEST_SAMPLE_ROWS]]
+  rows = df.head(DIGEST_SAMPLE_ROWS).to_csv(index=False).splitlines()
+  return header, lines + rows
+
+def describe_list(items: list) -> tuple:
+  groups = count_message_groups(items, top=DIGEST_TOP_GROUPS)
+  if groups:
+    header = f"{len(items)} queue messages"
+    lines = ['top groups (' + ', '.join(MESSAGE_GROUP_KEYS) + ', qtd):']
+    lines += [', '.join(str(value) for value in group.values()) for group in groups]
+    lines.append('sample messages:')
+  else:
+    header = f"list with {len(items)} items"
+    lines = []
+  return header, lines + [compact_value(item) for item in items[:DIGEST_SAMPLE_ROWS]]
+
+def describe_result(result) -> tuple:
+  if result is None:
+    return 'no result', []
+  if isinstance(result, pd.DataFrame):
+    return describe_dataframe(result)
+  if isinstance(result, list):
+    return describe_list(result)
+  if isinstance(result, dict):
+    return f"object with keys: {', '.join(map(str, result))}", [f"{key}: {compact_value(value)}" for key, value in result.items()]
+  return 'text', str(result).splitlines()
+
+def digest_result(result, count_tokens, token_budget: int = TOOL_DIGEST_TOKENS, handle: str = None) -> str:
+  """Compact description of a tool result to be kept in the chat history.
+
+  Header (type, size, columns), totals, top groups and sample rows are added while
+  they fit in `token_budget`. Texts that already fit are returned as they are. When
+  the full result is kept server-side its `handle` is part of the header.
+  """
+  if isinstance(result, str) and count_tokens(result) <= token_budget:
+    return result
+
+  header, lines = describe_result(result)
+  if handle is not None:
+    header = f"[result {handle}] {header}"
+
+  digest = [header]
+  used = count_tokens(header)
+  for line in lines:
+    tokens = count_tokens(line) + 1
+    if used + tokens > token_budget:
+      digest.append(f"... {len(lines) - len(digest) + 1} more lines not shown")
+      break
+    digest.append(line)
+    used += tokens
+  return '\n'.join(digest)
@@ -6,6 +6,9 @@ import tempfile
 from PIL import Image
 import pandas as pd
 import os
+from pkg.logger import get_logger
+
+log = get_logger('file_processor')
 
 class FileProcessor:
     def process_files(self, files):
@@ -17,7 +20,7 @@ class FileProcessor:
         image_contents = []
 
         for file in files:
-            print(f"file: {file.get('name')}")
+            log.debug('Processing file', filename=file.get('name'))
             filename = file.get('name')
             content = file.get('content')
 
@@ -103,7 +106,7 @@ class FileProcessor:
                             # Clean up the processed image
                             os.unlink(processed_path)
                     except Exception as e:
-                        print(f"Error processing image {filename}: {str(e)}")
+                        log.exception('Processing image failed', filename=filename)
                         results.append(f"Error processing image {filename}: {str(e)}")
 
                 elif content_type == 'text/csv':
@@ -161,5 +164,5 @@ class FileProcessor:
             with open(file_path, 'rb') as image_file:
                 return base64.b64encode(image_file.read()).decode('utf-8')
         except Exception as e:
-            print(f"Error preparing image: {str(e)}")
+            log.exception('Preparing image failed')
             return None
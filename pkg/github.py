@@ -1,16 +1,23 @@
 import requests
 import os
 from dotenv import load_dotenv
+from pkg.telemetry import traced
+from pkg.logger import get_logger
+from pkg.request_context import DeadlineExceeded, mark_partial
+from pkg.resilience import http_request
 
 load_dotenv()
 
 GITHUB_TOKEN = os.getenv('GITHUB_TOKEN')
 REPO_OWNER = os.getenv('REPO_OWNER')
 
+log = get_logger('github')
+
 class Github:
 
+  @traced('github.search_pull_requests')
   def search_pull_requests(self, repo_name:str, status:str, label:str='') -> list:
-    print(f"Searching for pull requests with status: {status} and label: {label}")
+    log.info('Searching pull requests', repo_name=repo_name, status=status, label=label)
     repo_name = f"{REPO_OWNER}/{repo_name}"
     access_token = GITHUB_TOKEN
     query = f"is:pr is:{status} {label}"
@@ -19,14 +26,14 @@ class Github:
     url = f"https://api.github.com/search/issues?q={encoded_query}+repo:{repo_name}"
     git_url = f"https://api.github.com/repos/{repo_name}/pulls"
 
-    print(f"Fetching data from: {url}")
+    log.debug('Fetching pull requests', url=url)
 
     headers = {
       'Authorization': f"token {access_token}",
       'Accept': "application/vnd.github.v3+json"
     }
 
-    response = requests.get(url, headers=headers)
+    response = http_request('GET', url, 'GitHub', headers=headers)
 
     commits_sha = []
 
@@ -40,7 +47,12 @@ class Github:
         pr_number = pr['number']
 
         commits_url = f"{git_url}/{pr_number}/commits"
-        commits_response = requests.get(commits_url, headers=headers)
+        try:
+          commits_response = http_request('GET', commits_url, 'GitHub', headers=headers)
+        except DeadlineExceeded:
+          # The pull requests whose commits were read until the deadline are returned
+          mark_partial('GitHub')
+          break
 
         if commits_response.status_code == 200:
           commits_data = commits_response.json()
@@ -64,5 +76,5 @@ class Github:
 
       return pull_requests_with_commits
     else:
-      print(f"Failed to fetch data. Status code: {response.status_code}")
+      log.error('Fetching pull requests failed', repo_name=repo_name, status_code=response.status_code)
       return []
\ No newline at end of file
@@ -0,0 +1,122 @@
+import os
+import re
+import threading
+import unicodedata
+from collections import Counter
+from dotenv import load_dotenv
+
+load_dotenv()
+
+INTENT_ROUTER_ENABLED = os.getenv('INTENT_ROUTER_ENABLED', 'true').lower() == 'true'
+
+QUEUE = r'(?P<queue_name>[\w.\-]+)'
+LIMIT = r'(?P<limit>\d+)'
+
+def normalize_text(text: str) -> str:
+  """Strip accents, repeated spaces and the final punctuation, the case is kept for the queue names"""
+  text = unicodedata.normalize('NFKD', text)
+  text = ''.join(char for char in text if not unicodedata.combining(char))
+  return ' '.join(text.split()).rstrip('?!. ')
+
+def picture_status(value: str) -> str:
+  return 'error' if value.lower().startswith('erro') else 'pending'
+
+class IntentRule:
+  def __init__(self, name: str, pattern: str, function_name: str, arguments=None):
+    self.name = name
+    self.pattern = re.compile(pattern, re.IGNORECASE)
+    self.function_name = function_name
+    # Builds the tool arguments from the named groups of the match
+    self.arguments = arguments or (lambda groups: {})
+
+  def match(self, text: str):
+    match = self.pattern.fullmatch(text)
+    if match is None:
+      return None
+    return self.function_name, self.arguments(match.groupdict())
+
+INTENT_RULES = [
+  IntentRule(
+    'read_messages',
+    rf'(?:leia|ler|liste|mostre)\s+(?:as\s+)?{LIMIT}\s+(?:primeiras\s+)?mensagens\s+da\s+fila\s+{QUEUE}'
+    r'(?:\s+filtrando\s+(?:pelo|por)\s+(?:cliente|gpa)\s+(?P<gpa_code>\d+))?',
+    'get_queue_messages',
+    lambda groups: {
+      'queue_name': groups['queue_name'],
+      'limit': int(groups['limit']),
+      **({'gpa_code': int(groups['gpa_code'])} if groups['gpa_code'] else {}),
+    }
+  ),
+  IntentRule(
+    'queue_messages',
+    rf'(?:quais\s+(?:sao|as)\s+)?(?:as\s+)?mensagens\s+da\s+fila\s+{QUEUE}',
+    'get_queue_messages',
+    lambda groups: {'queue_name': groups['queue_name']}
+  ),
+  IntentRule(
+    'summarize_messages',
+    rf'(?:resuma|resumir|sumarize)\s+(?:as\s+)?{LIMIT}\s+(?:primeiras\s+)?mensagens\s+da\s+fila\s+{QUEUE}',
+    'summarize_queue_messages',
+    lambda groups: {'queue_name': groups['queue_name'], 'limit': int(groups['limit'])}
+  ),
+  IntentRule(
+    'collections_with_error',
+    r'(?:quais\s+(?:sao\s+)?)?(?:as\s+)?colecoes\s+com\s+erros?',
+    'summarize_collections_with_error'
+  ),
+  IntentRule(
+    'queues_status',
+    r'quantas\s+mensagens\s+(?:existem|tem|ha)\s+nas\s+filas',
+    'get_queue_status'
+  ),
+  IntentRule(
+    'queue_status',
+    rf'quantas\s+mensagens\s+(?:existem|tem|ha)\s+na\s+fila\s+{QUEUE}',
+    'get_queue_status',
+    lambda groups: {'queue_name': groups['queue_name']}
+  ),
+  IntentRule(
+    'pictures_by_status',
+    r'(?:quais\s+(?:os\s+)?clientes\s+(?:possuem|tem)\s+)?fotos\s+(?:com\s+)?(?P<status>erros?|pendentes?)',
+    'summarize_pictures_by_status',
+    lambda groups: {'status': picture_status(groups['status'])}
+  ),
+]
+
+class IntentRouter:
+  """Resolves unambiguous monitoring commands to a tool call without the LLM.
+
+  A rule has to match the whole question, anything longer or different (e.g. "leia
+  20 mensagens da fila X e compare com ontem") is a miss and goes to the LLM.
+  """
+
+  def __init__(self, rules: list = INTENT_RULES):
+    self.rules = rules
+    self.hits = Counter()
+    self.misses = 0
+    self.lock = threading.Lock()
+
+  def route(self, query: str):
+    """(function_name, arguments) of the first matching rule, None when no rule matches"""
+    text = normalize_text(query)
+    for rule in self.rules:
+      routed = rule.match(text)
+      if routed is not None:
+        with self.lock:
+          self.hits[rule.name] += 1
+        return routed
+
+    with self.lock:
+      self.misses += 1
+    return None
+
+  @property
+  def stats(self) -> dict:
+    with self.lock:
+      total_hits = sum(self.hits.values())
+      total = total_hits + self.misses
+      return {
+        'hits': dict(self.hits),
+        'misses': self.misses,
+        'hit_rate': round(total_hits / total, 4) if total else 0.0,
+      }
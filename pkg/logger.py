@@ -0,0 +1,119 @@
+import os
+import sys
+import time
+import queue
+import atexit
+import random
+import logging
+import threading
+import logging.handlers
+import orjson
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+# json for the log collector, text to read it in a terminal
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+# Fields longer than this (message bodies, DataFrames, histories) are cut
+LOG_FIELD_MAX_SIZE = int(os.getenv('LOG_FIELD_MAX_SIZE', 1000))
+# Share of the per-item logs (one per message, chunk, ...) that is written
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', 0.01))
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+
+RESERVED_FIELDS = ('ts', 'level', 'logger', 'message', 'exception')
+
+def truncate(value):
+  if value is None or isinstance(value, (bool, int, float)):
+    return value
+  if isinstance(value, str):
+    text = value
+  elif isinstance(value, (dict, list, tuple)):
+    text = orjson.dumps(value, default=str).decode()
+  else:
+    text = str(value)
+  if len(text) > LOG_FIELD_MAX_SIZE:
+    return f"{text[:LOG_FIELD_MAX_SIZE]}... ({len(text) - LOG_FIELD_MAX_SIZE} more chars)"
+  return text
+
+class JsonFormatter(logging.Formatter):
+  def format(self, record: logging.LogRecord) -> str:
+    entry = {
+      'ts': round(record.created, 3),
+      'level': record.levelname,
+      'logger': record.name,
+      'message': record.getMessage(),
+    }
+    for key, value in getattr(record, 'fields', {}).items():
+      entry[f"field_{key}" if key in RESERVED_FIELDS else key] = truncate(value)
+    if record.exc_info:
+      entry['exception'] = self.formatException(record.exc_info)
+    return orjson.dumps(entry).decode()
+
+class TextFormatter(logging.Formatter):
+  def format(self, record: logging.LogRecord) -> str:
+    fields = ' '.join(f"{key}={truncate(value)}" for key, value in getattr(record, 'fields', {}).items())
+    line = f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(record.created))} {record.levelname} {record.name} {record.getMessage()}"
+    if fields:
+      line = f"{line} {fields}"
+    if record.exc_info:
+      line = f"{line}\n{self.formatException(record.exc_info)}"
+    return line
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+  """Never blocks the caller: records are dropped (and counted) when the queue is full"""
+
+  dropped = 0
+
+  def enqueue(self, record: logging.LogRecord):
+    try:
+      self.queue.put_nowait(record)
+    except queue.Full:
+      DroppingQueueHandler.dropped += 1
+
+  def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+    # Formatting happens in the listener thread, not in the thread that logs
+    return record
+
+class StructuredLogger(logging.LoggerAdapter):
+  """Logger taking the structured fields as keyword arguments.
+
+  log.info('Read messages', queue_name=queue_name, count=10)
+  log.debug('Message', sample_rate=LOG_SAMPLE_RATE, body=body)
+
+  Disabled levels and records left out by `sample_rate` cost one check, nothing
+  is formatted for them.
+  """
+
+  def log(self, level: int, msg, *args, exc_info=None, stack_info=False, sample_rate: float = None, **fields):
+    if not self.isEnabledFor(level):
+      return
+    if sample_rate is not None and random.random() >= sample_rate:
+      return
+    self.logger.log(level, msg, *args, exc_info=exc_info, stack_info=stack_info, extra={'fields': fields})
+
+listener = None
+setup_lock = threading.Lock()
+
+def setup_logging():
+  """Route the `alfredo` loggers through a queue to a listener thread writing to stdout"""
+  global listener
+  with setup_lock:
+    if listener is not None:
+      return
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(TextFormatter() if LOG_FORMAT == 'text' else JsonFormatter())
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    root = logging.getLogger('alfredo')
+    root.setLevel(LOG_LEVEL)
+    root.addHandler(DroppingQueueHandler(log_queue))
+    root.propagate = False
+
+def get_logger(name: str) -> StructuredLogger:
+  setup_logging()
+  return StructuredLogger(logging.getLogger(f"alfredo.{name}"), {})
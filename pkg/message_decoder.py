@@ -0,0 +1,127 @@
+import os
+import base64
+import binascii
+import multiprocessing
+from collections import Counter
+from concurrent.futures import Future, ProcessPoolExecutor
+import orjson
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DECODE_WORKERS = int(os.getenv('RABBIT_DECODE_WORKERS', min(4, os.cpu_count() or 1)))
+DECODE_BATCH_SIZE = int(os.getenv('RABBIT_DECODE_BATCH_SIZE', 250))
+DECODE_PARALLEL_THRESHOLD = int(os.getenv('RABBIT_DECODE_PARALLEL_THRESHOLD', 500))
+DECODE_MAX_ERRORS = int(os.getenv('RABBIT_DECODE_MAX_ERRORS', 100))
+ERROR_PREVIEW_SIZE = 200
+
+def decode_payload(raw):
+  """Decode a message body (str from the management API, bytes from AMQP), either plain
+  JSON or a JSON envelope with a base64 `payload`.
+
+  Returns (message, status, error): status is a counter name and error is None
+  when the message was decoded. Failed messages are returned as received.
+  """
+  try:
+    envelope = orjson.loads(raw)
+  except orjson.JSONDecodeError as e:
+    return raw if isinstance(raw, str) else raw.decode('utf-8', errors='replace'), 'json_error', str(e)
+
+  payload = envelope.get('payload') if isinstance(envelope, dict) else None
+  if not isinstance(payload, str):
+    return envelope, 'plain', None
+
+  try:
+    body = base64.b64decode(payload, validate=True).decode('utf-8')
+  except (binascii.Error, UnicodeDecodeError):
+    # Not an envelope, just a message with a `payload` field
+    return envelope, 'plain', None
+
+  try:
+    return orjson.loads(body), 'envelope', None
+  except orjson.JSONDecodeError as e:
+    return body, 'payload_json_error', str(e)
+
+def decode_batch(raws: list) -> tuple:
+  """Decode a list of message bodies, returning (messages, counters, errors)"""
+  messages = []
+  counters = Counter()
+  errors = []
+  for index, raw in enumerate(raws):
+    message, status, error = decode_payload(raw)
+    messages.append(message)
+    counters[status] += 1
+    if error is not None:
+      preview = raw if isinstance(raw, str) else raw.decode('utf-8', errors='replace')
+      errors.append({'index': index, 'stage': status, 'error': error, 'preview': preview[:ERROR_PREVIEW_SIZE]})
+  return messages, counters, errors
+
+class DecodeStats:
+  """Counters and the first `max_errors` error records of a queue read"""
+
+  def __init__(self, max_errors: int = DECODE_MAX_ERRORS):
+    self.max_errors = max_errors
+    self.counters = Counter()
+    self.errors = []
+    self.decoded = 0
+
+  def add(self, messages: list, counters: Counter, errors: list):
+    self.counters.update(counters)
+    for error in errors[:max(self.max_errors - len(self.errors), 0)]:
+      self.errors.append({**error, 'index': self.decoded + error['index']})
+    self.decoded += len(messages)
+
+  @property
+  def failed(self) -> int:
+    return self.counters['json_error'] + self.counters['payload_json_error']
+
+  def to_dict(self) -> dict:
+    return {'decoded': self.decoded, 'counters': dict(self.counters), 'errors': self.errors}
+
+class MessageDecoder:
+  """Decode message bodies in batches, in a process pool when there are enough of them.
+
+  `submit` starts decoding and `collect` waits for the result, so the caller can
+  fetch the next chunk from the broker while the previous one is decoded.
+  """
+
+  def __init__(self, workers: int = DECODE_WORKERS, batch_size: int = DECODE_BATCH_SIZE,
+               parallel_threshold: int = DECODE_PARALLEL_THRESHOLD):
+    self.workers = workers
+    self.batch_size = batch_size
+    self.parallel_threshold = parallel_threshold
+    self.pool = None
+
+  def get_pool(self) -> ProcessPoolExecutor:
+    if self.pool is None:
+      # spawn keeps the workers free of the connections and threads of the API process
+      self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+    return self.pool
+
+  def submit(self, raws: list) -> list:
+    if self.workers > 1 and len(raws) >= self.parallel_threshold:
+      pool = self.get_pool()
+      return [
+        pool.submit(decode_batch, raws[start:start + self.batch_size])
+        for start in range(0, len(raws), self.batch_size)
+      ]
+
+    future = Future()
+    future.set_result(decode_batch(raws))
+    return [future]
+
+  def collect(self, futures: list, stats: DecodeStats) -> list:
+    messages = []
+    for future in futures:
+      batch_messages, counters, errors = future.result()
+      stats.add(batch_messages, counters, errors)
+      messages.extend(batch_messages)
+    return messages
+
+  def decode(self, raws: list, stats: DecodeStats) -> list:
+    return self.collect(self.submit(raws), stats)
+
+  def shutdown(self):
+    if self.pool is not None:
+      self.pool.shutdown(wait=False, cancel_futures=True)
+      self.pool = None
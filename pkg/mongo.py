@@ -1,7 +1,15 @@
 import os
+import threading
+from contextlib import contextmanager
+import pymongo
 from pymongo import MongoClient
+from pymongo.errors import PyMongoError
 from dotenv import load_dotenv
 import pandas as pd
+from pkg.telemetry import traced
+from pkg.logger import get_logger
+from pkg.request_context import DeadlineExceeded, call_timeout, mark_partial
+from pkg.resilience import circuit
 
 from langchain_openai import OpenAIEmbeddings
 from langchain.vectorstores import MongoDBAtlasVectorSearch
@@ -20,22 +28,61 @@ MONGO_AQILA_URL_PRD = os.getenv('MONGO_AQILA_URL_PRD')
 MONGO_AQILA_URL_HML = os.getenv('MONGO_AQILA_URL_HML')
 MONGO_DB_ALFREDO = os.getenv('MONGO_DB_ALFREDO') 
 
+log = get_logger('mongo')
+
+clients = {}
+clients_lock = threading.Lock()
+
+def get_client(url: str) -> MongoClient:
+  """One MongoClient, with its connection pool, per URL for the whole process"""
+  with clients_lock:
+    if url not in clients:
+      clients[url] = MongoClient(url)
+    return clients[url]
+
+@contextmanager
+def deadline(timeout: float = None):
+  """Bound the operations of the block by the request deadline, or by `timeout` when given.
+
+  pymongo applies it to server selection, the sockets and as maxTimeMS on the server.
+  """
+  try:
+    with pymongo.timeout(timeout if timeout is not None else call_timeout('MongoDB')):
+      yield
+  except PyMongoError as e:
+    if e.timeout:
+      raise DeadlineExceeded('MongoDB')
+    raise
+
+@contextmanager
+def guarded(database: str):
+  """deadline() through the breaker of the database, one per vhost"""
+  timeout = call_timeout('MongoDB')
+  with circuit(f"MongoDB {database}", timeout=timeout), deadline(timeout):
+    yield
+
+def warmup():
+  """Open the connection pools before the first request"""
+  for url in (MONGO_AQILA_URL_PRD, MONGO_AQILA_URL_HML):
+    if url:
+      with deadline():
+        get_client(url).admin.command('ping')
+
 class Mongo:
   def __init__(self, database: str = None):
     self.database = database
     if self.database=='aqila-hml':
        self.database = 'aqila-homologacao'
     
-    self.client = MongoClient(MONGO_AQILA_URL_HML)
-
-    if database == 'aqila':
-      self.client = MongoClient(MONGO_AQILA_URL_PRD)    
+    self.client = get_client(MONGO_AQILA_URL_PRD if database == 'aqila' else MONGO_AQILA_URL_HML)
 
 
+  @traced('mongo.summarize_collections_with_error')
   def summarize_collections_with_error(self) -> pd.DataFrame:
     db = self.client[self.database]
 
-    collection_names = db.list_collection_names()
+    with guarded(self.database):
+      collection_names = db.list_collection_names()
     result = []
     
     for collection_name in collection_names:
@@ -44,7 +91,13 @@ class Mongo:
         {'$group': {'_id': {'_gpa_code': '$_gpa_code'}, 'count': {'$sum': 1}}}
       ]
 
-      data = db[collection_name].aggregate(pipeline)
+      try:
+        with guarded(self.database):
+          data = list(db[collection_name].aggregate(pipeline))
+      except DeadlineExceeded as e:
+        # The collections counted until the deadline are returned
+        mark_partial(e.source)
+        break
 
       for doc in data:
         result.append(
@@ -56,9 +109,10 @@ class Mongo:
         )
     
     df = pd.DataFrame.from_dict(result)
-    print(f"summarize_collections_with_error: {df}")
+    log.debug('summarize_collections_with_error', database=self.database, rows=len(df))
     return df
 
+  @traced('mongo.summarize_pictures_by_status')
   def summarize_pictures_by_status(self, status: str) -> pd.DataFrame:
     db = self.client[self.database]
 
@@ -69,7 +123,8 @@ class Mongo:
       {'$group': {'_id': {'_gpa_code': '$_gpa_code'}, 'count': {'$sum': 1}}}
     ]
 
-    data = db[collection_name].aggregate(pipeline)
+    with guarded(self.database):
+      data = list(db[collection_name].aggregate(pipeline))
 
     for doc in data:
       result.append(
@@ -82,11 +137,12 @@ class Mongo:
       )
     
     df = pd.DataFrame.from_dict(result)
-    print(f"summarize_pictures_by_status: {df}")
+    log.debug('summarize_pictures_by_status', database=self.database, status=status, rows=len(df))
     return df
   
+  @traced('mongo.command_helper')
   def command_helper(self, query: str) -> str:
-    print(f"command_helper: {query}")
+    log.debug('command_helper', query=query)
     documents = self.create_vector_search().similarity_search_with_score(
       query=query,
       k=5,
@@ -95,13 +151,12 @@ class Mongo:
     list_documents = []
     for document in documents:
       list_documents.append(f"{document[0].page_content} - {document[0].metadata['comandos']}")
-    print(f"command_helper - list: {list_documents}")
+    log.debug('command_helper documents', documents=list_documents)
     awnser = self.answer_question(list_documents, query)
 
     return awnser.content
 
   def create_vector_search(self):
-    print(f"create_vector_search: {MONGO_DB_ALFREDO}")
     return MongoDBAtlasVectorSearch.from_connection_string(
       MONGO_DB_ALFREDO,
       'alfredo.comandos',
@@ -1,9 +1,11 @@
-import requests
 import os
 import json
 import base64
 from collections import defaultdict
 from dotenv import load_dotenv
+from pkg.telemetry import traced
+from pkg.logger import get_logger
+from pkg.resilience import http_request
 
 load_dotenv()
 
@@ -12,10 +14,13 @@ PASSWORD_PULPO = os.getenv('PASSWORD_PULPO')
 PULPO_SEARCH_URL = os.getenv('PULPO_SEARCH_URL')
 PULPO_URL = os.getenv('PULPO_URL')
 
+log = get_logger('pulpo')
+
 class Pulpo:
 
+  @traced('pulpo.search_documents')
   def search_documents(self, search_term: str) -> list:
-    print(f"Searching for documents in knowledge base with term: {search_term}")
+    log.info('Searching documents in the knowledge base', search_term=search_term)
     token = base64.b64encode(f"{USER_PULPO}:{PASSWORD_PULPO}".encode()).decode()
     headers = {
       'authorization': f"Basic {token}",
@@ -25,14 +30,12 @@ class Pulpo:
 
     search_params = self.search_params(search_term)
 
-    response = requests.post(PULPO_SEARCH_URL, data=search_params, headers=headers)
-
-    print(f"response {response}")
+    response = http_request('POST', PULPO_SEARCH_URL, 'Pulpo', data=search_params, headers=headers)
 
     if response.status_code == 200:
       data = response.json()
       search_result = data[0]['data']['findAnswer']
-      print('search_result', search_result)
+      log.debug('Knowledge base search result', search_result=search_result)
       unique_documents = defaultdict(list)
 
       for doc in search_result.get('documents', []):
@@ -50,7 +53,7 @@ class Pulpo:
         'related_questions': related_questions
       }
     else:
-      print(f"Error: {response}")
+      log.error('Knowledge base search failed', status_code=response.status_code, response=response.text)
       return {
         'answer': 'Não encontrei nada na base de conhecimento',
         'title': 'Nada encontrado',
@@ -0,0 +1,234 @@
+import os
+import time
+import asyncio
+import threading
+from array import array
+import orjson
+from dotenv import load_dotenv
+import pkg.rabbit as rabbit_service
+from pkg.shared_state import shared_state
+from pkg.logger import get_logger
+
+load_dotenv()
+
+QUEUE_METRICS_VHOSTS = [vhost for vhost in os.getenv('QUEUE_METRICS_VHOSTS', '').split(',') if vhost]
+QUEUE_METRICS_INTERVAL = int(os.getenv('QUEUE_METRICS_INTERVAL', 60))
+# Raw samples kept per queue, 3 hours with the default interval
+QUEUE_METRICS_RAW_POINTS = int(os.getenv('QUEUE_METRICS_RAW_POINTS', 180))
+# Raw samples averaged into one downsampled point, 10 minutes with the default interval
+QUEUE_METRICS_DOWNSAMPLE = int(os.getenv('QUEUE_METRICS_DOWNSAMPLE', 10))
+# Downsampled points kept per queue, 48 hours with the defaults
+QUEUE_METRICS_DOWNSAMPLED_POINTS = int(os.getenv('QUEUE_METRICS_DOWNSAMPLED_POINTS', 288))
+
+log = get_logger('queue_metrics')
+
+class RingSeries:
+  """Fixed size time series backed by arrays, the oldest point is overwritten when full"""
+
+  def __init__(self, capacity: int):
+    self.capacity = capacity
+    self.timestamps = array('d', [0.0]) * capacity
+    self.depths = array('d', [0.0]) * capacity
+    self.consumers = array('d', [0.0]) * capacity
+    self.start = 0
+    self.size = 0
+
+  def append(self, timestamp: float, depth: float, consumers: float):
+    index = (self.start + self.size) % self.capacity
+    if self.size < self.capacity:
+      self.size += 1
+    else:
+      self.start = (self.start + 1) % self.capacity
+    self.timestamps[index] = timestamp
+    self.depths[index] = depth
+    self.consumers[index] = consumers
+
+  def points(self, since: float = 0) -> list:
+    """(timestamp, depth, consumers) tuples, oldest first"""
+    points = []
+    for offset in range(self.size):
+      index = (self.start + offset) % self.capacity
+      if self.timestamps[index] >= since:
+        points.append((self.timestamps[index], self.depths[index], self.consumers[index]))
+    return points
+
+class QueueSeries:
+  """Raw samples of a queue plus a downsampled series with the averages of every `downsample` samples"""
+
+  def __init__(self, raw_points: int, downsample: int, downsampled_points: int):
+    self.raw = RingSeries(raw_points)
+    self.downsampled = RingSeries(downsampled_points)
+    self.downsample = downsample
+    self.pending = []
+
+  def append(self, timestamp: float, depth: float, consumers: float):
+    self.raw.append(timestamp, depth, consumers)
+    self.pending.append((timestamp, depth, consumers))
+    if len(self.pending) >= self.downsample:
+      count = len(self.pending)
+      self.downsampled.append(
+        self.pending[0][0],
+        sum(point[1] for point in self.pending) / count,
+        sum(point[2] for point in self.pending) / count
+      )
+      self.pending = []
+
+  def points(self, since: float = 0) -> list:
+    raw = self.raw.points(since)
+    # Older points only exist in the downsampled series
+    oldest_raw = raw[0][0] if raw else float('inf')
+    older = [point for point in self.downsampled.points(since) if point[0] < oldest_raw]
+    return older + raw
+
+  def to_dict(self) -> dict:
+    return {'raw': self.raw.points(), 'downsampled': self.downsampled.points(), 'pending': self.pending}
+
+  def load(self, data: dict):
+    for point in data['raw']:
+      self.raw.append(*point)
+    for point in data['downsampled']:
+      self.downsampled.append(*point)
+    self.pending = [tuple(point) for point in data['pending']]
+
+class QueueMetricsStore:
+  """Depth/consumer series for every sampled (vhost, queue).
+
+  With `shared` state a single worker samples: it keeps the series in memory and
+  writes the ones it recorded to the shared state on `flush`, the other workers read
+  them from there, so every worker answers with the same series.
+  """
+
+  def __init__(self, raw_points: int = QUEUE_METRICS_RAW_POINTS, downsample: int = QUEUE_METRICS_DOWNSAMPLE,
+               downsampled_points: int = QUEUE_METRICS_DOWNSAMPLED_POINTS, shared=shared_state,
+               ttl: float = QUEUE_METRICS_DOWNSAMPLED_POINTS * QUEUE_METRICS_DOWNSAMPLE * QUEUE_METRICS_INTERVAL):
+    self.raw_points = raw_points
+    self.downsample = downsample
+    self.downsampled_points = downsampled_points
+    self.shared = shared
+    self.ttl = ttl
+    self.series = {}
+    self.dirty = set()
+    self.lock = threading.Lock()
+
+  def record(self, vhost: str, queue_name: str, timestamp: float, depth: float, consumers: float):
+    with self.lock:
+      key = (vhost, queue_name)
+      if key not in self.series:
+        # A worker taking over the sampling continues the series of the previous one
+        self.series[key] = self.load(vhost, queue_name) or self.new_series()
+      self.series[key].append(timestamp, depth or 0, consumers or 0)
+      self.dirty.add(key)
+
+  def flush(self):
+    """Write the series recorded since the last flush to the shared state"""
+    if self.shared is None:
+      return
+    with self.lock:
+      values = {series_key(*key): orjson.dumps(self.series[key].to_dict()) for key in self.dirty}
+      self.dirty.clear()
+    if values:
+      self.shared.set_many('queue_metrics', values, self.ttl)
+
+  def new_series(self) -> QueueSeries:
+    return QueueSeries(self.raw_points, self.downsample, self.downsampled_points)
+
+  def load(self, vhost: str, queue_name: str) -> QueueSeries:
+    value = self.shared.get('queue_metrics', series_key(vhost, queue_name)) if self.shared is not None else None
+    if value is None:
+      return None
+    series = self.new_series()
+    series.load(orjson.loads(value))
+    return series
+
+  def history(self, vhost: str, queue_name: str, since: float = 0) -> list:
+    with self.lock:
+      series = self.series.get((vhost, queue_name))
+      if series is not None:
+        return series.points(since)
+    # Sampled by another worker
+    series = self.load(vhost, queue_name)
+    return series.points(since) if series else []
+
+  def depth_at(self, vhost: str, queue_name: str, timestamp: float):
+    """The last sample taken at or before `timestamp`, None when there is none"""
+    points = [point for point in self.history(vhost, queue_name) if point[0] <= timestamp]
+    return points[-1] if points else None
+
+  def trend(self, vhost: str, queue_name: str, window: float) -> dict:
+    points = self.history(vhost, queue_name, since=time.time() - window)
+    if len(points) < 2:
+      return None
+    first, last = points[0], points[-1]
+    minutes = max((last[0] - first[0]) / 60, 1 / 60)
+    return {
+      'samples': len(points),
+      'first_depth': first[1],
+      'last_depth': last[1],
+      'delta': last[1] - first[1],
+      'rate_per_minute': (last[1] - first[1]) / minutes,
+      'max_depth': max(point[1] for point in points),
+      'consumers': last[2],
+      'minutes': minutes,
+    }
+
+def series_key(vhost: str, queue_name: str) -> str:
+  return f"{vhost}/{queue_name}"
+
+class QueueMetricsSampler:
+  """Polls the queue status of each vhost on an interval and records it in the store.
+
+  Runs as an asyncio task, the HTTP call itself runs in a thread. It uses its own
+  Rabbit instance so it never shares state with the chat requests. When the store has
+  shared state, only the worker holding its 'queue_metrics' lock samples, the others
+  try to take the lock every interval, so the sampling moves on when that worker dies.
+  """
+
+  def __init__(self, store: QueueMetricsStore, vhosts: list = QUEUE_METRICS_VHOSTS, interval: int = QUEUE_METRICS_INTERVAL):
+    self.store = store
+    self.vhosts = vhosts
+    self.interval = interval
+    self.rabbit = rabbit_service.Rabbit()
+    self.task = None
+
+  def start(self):
+    self.task = asyncio.create_task(self.run())
+
+  async def stop(self):
+    if self.task is not None:
+      self.task.cancel()
+      try:
+        await self.task
+      except asyncio.CancelledError:
+        pass
+      self.task = None
+    if self.store.shared is not None:
+      self.store.shared.release_lock('queue_metrics')
+
+  def is_sampling_worker(self) -> bool:
+    return self.store.shared is None or self.store.shared.hold_lock('queue_metrics')
+
+  async def run(self):
+    while True:
+      if self.is_sampling_worker():
+        for vhost in self.vhosts:
+          await self.sample(vhost)
+        try:
+          await asyncio.to_thread(self.store.flush)
+        except Exception as e:
+          log.error('Writing queue metrics failed', error=str(e))
+      await asyncio.sleep(self.interval)
+
+  async def sample(self, vhost: str):
+    try:
+      queues = await asyncio.to_thread(self.rabbit.get_queue_status, None, True, vhost)
+    except Exception as e:
+      log.error('Sampling queues failed', vhost=vhost, error=str(e))
+      return
+
+    if queues is None or queues.empty:
+      return
+
+    timestamp = time.time()
+    queues = queues.fillna({'messages_count': 0, 'consumers': 0})
+    for queue_name, depth, consumers in zip(queues['queue_name'], queues['messages_count'], queues['consumers']):
+      self.store.record(vhost, queue_name, timestamp, depth, consumers)
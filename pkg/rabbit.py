@@ -1,9 +1,15 @@
 import requests
-import base64
 import json
 import pika
+from pika.adapters.utils.connection_workflow import AMQPConnectorStackTimeout
 import pandas as pd
 import pkg.constants as constants
+from pkg.digest import count_message_groups
+from pkg.message_decoder import MessageDecoder, DecodeStats
+from pkg.telemetry import span, traced
+from pkg.logger import get_logger, LOG_SAMPLE_RATE
+from pkg.request_context import DeadlineExceeded, call_timeout, mark_partial, add_note
+from pkg.resilience import circuit, http_request
 from dotenv import load_dotenv
 import os
 load_dotenv()
@@ -12,6 +18,9 @@ RABBITMQ_USER = os.getenv('RABBITMQ_USERNAME')
 RABBITMQ_PASSWORD = os.getenv('RABBITMQ_PASSWORD')
 RABBITMQ_VHOST = os.getenv('RABBITMQ_VIRTUAL_HOST')
 RABBITMQ_URL = os.getenv('RABBITMQ_URL')
+# http for a local broker or the stub of benchmarks/fakes.py
+RABBITMQ_API_SCHEME = os.getenv('RABBITMQ_API_SCHEME', 'https')
+RABBITMQ_HTTP_POOL_SIZE = int(os.getenv('RABBITMQ_HTTP_POOL_SIZE', 20))
 RABBITMQ_HML_USER = os.getenv('RABBITMQ_HML_USER')
 RABBITMQ_HML_PASSWORD = os.getenv('RABBITMQ_HML_PASSWORD')
 RABBITMQ_HML_PORT = os.getenv('RABBITMQ_HML_PORT')
@@ -21,160 +30,378 @@ RABBITMQ_PRD_PASSWORD = os.getenv('RABBITMQ_PRD_PASSWORD')
 RABBITMQ_PRD_PORT = os.getenv('RABBITMQ_PRD_PORT')
 RABBITMQ_PRD_VIRTUAL_HOST = os.getenv('RABBITMQ_PRD_VIRTUAL_HOST')
 
+RABBITMQ_EXCHANGE = 'aqila_exg'
+MESSAGES_CHUNK_SIZE = 500
+# How queues are read: 'http' (management API /get) or 'amqp' (prefetch-limited consumer)
+RABBIT_READER = os.getenv('RABBIT_READER', 'http')
+# Messages one AMQP peek holds unacked, consumers of the queue don't get them until the read ends.
+# prefetch_count is a 16 bit field, so never more than 65535
+AMQP_MAX_PREFETCH = min(int(os.getenv('RABBITMQ_AMQP_MAX_PREFETCH', MESSAGES_CHUNK_SIZE)), 65535)
+AMQP_INACTIVITY_TIMEOUT = float(os.getenv('RABBITMQ_AMQP_INACTIVITY_TIMEOUT', 2))
+SNAPSHOT_PAGE_SIZE = int(os.getenv('RABBITMQ_SNAPSHOT_PAGE_SIZE', 500))
+# Snapshot column -> management API field, dotted fields are nested
+SNAPSHOT_FIELDS = {
+  'queue_name': 'name',
+  'consumers': 'consumers',
+  'state': 'state',
+  'messages_count': 'messages',
+}
+SNAPSHOT_RATE_FIELDS = {
+  'publish_rate': 'message_stats.publish_details.rate',
+  'deliver_rate': 'message_stats.deliver_get_details.rate',
+  'consumer_utilisation': 'consumer_utilisation',
+}
+SUMMARY_GROUP_KEYS = ('gpa_code', 'tenant', 'model', 'action', 'origin')
+
+log = get_logger('rabbit')
+
+class QueueReadError(Exception):
+  pass
+
+class QueueNotFoundError(QueueReadError):
+  """The queue, or its vhost, doesn't exist"""
+
+class UnknownVhostError(ValueError):
+  """No AMQP connection is configured for the vhost"""
+
+# Shared by every Rabbit of the process so the management API connections are reused
+session = requests.Session()
+session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=RABBITMQ_HTTP_POOL_SIZE))
+session.mount('https://', requests.adapters.HTTPAdapter(pool_maxsize=RABBITMQ_HTTP_POOL_SIZE))
+
 class Rabbit:
 
   def __init__(self):
-    print(RABBITMQ_URL)
-    self.rabbitmq_api_host = f"https://{RABBITMQ_URL}/api/queues/"
+    self.rabbitmq_api_host = f"{RABBITMQ_API_SCHEME}://{RABBITMQ_URL}/api/queues/"
     self.auth = (RABBITMQ_USER, RABBITMQ_PASSWORD)
-    self.vhost = None
+    self.decoder = MessageDecoder()
   
-  def get_queue_url(self, queue_name: str) -> str:
-    queue_url = f"{self.rabbitmq_api_host}{RABBITMQ_VHOST}"
-    if self.vhost is not None:
-      queue_url = f"{self.rabbitmq_api_host}{self.vhost}"
+  def warmup(self):
+    """Open a management API connection before the first request"""
+    session.get(f"{RABBITMQ_API_SCHEME}://{RABBITMQ_URL}/api/overview", auth=self.auth, params={'columns': 'rabbitmq_version'}, timeout=call_timeout('RabbitMQ'))
+
+  def get(self, url: str, vhost: str = None, **kwargs) -> requests.Response:
+    """GET on the management API with the timeout of the request deadline, through the breaker of the vhost"""
+    return http_request('GET', url, 'RabbitMQ', session=session, breaker=breaker_name(vhost), auth=self.auth, **kwargs)
+
+  def post(self, url: str, vhost: str = None, **kwargs) -> requests.Response:
+    return http_request('POST', url, 'RabbitMQ', session=session, breaker=breaker_name(vhost), auth=self.auth, **kwargs)
+
+  def amqp_parameters(self, vhost: str) -> pika.URLParameters:
+    """Connection parameters of a vhost, the connect and the handshake bounded by the request deadline"""
+    parameters = pika.URLParameters(self.get_rabbitmq_amq_string(vhost))
+    parameters.socket_timeout = call_timeout('RabbitMQ')
+    parameters.stack_timeout = parameters.socket_timeout
+    parameters.blocked_connection_timeout = parameters.socket_timeout
+    return parameters
+
+  def get_queue_url(self, queue_name: str, vhost: str = None) -> str:
+    queue_url = f"{self.rabbitmq_api_host}{vhost or RABBITMQ_VHOST}"
     if queue_name is not None:
       queue_url = f"{queue_url}/{queue_name}"
     return queue_url
 
+  @traced('rabbit.get_queue_status')
   def get_queue_status(self, queue_name: str=None, without_messages: bool = False, vhost:str = None) -> pd.DataFrame:
-    self.vhost = vhost
-    queue_url = self.get_queue_url(queue_name)
-
-    response = requests.get(queue_url, auth=self.auth)
-    queues = []
-    if response.status_code == 200:
-      queues_data = response.json()
-      if not isinstance(queues_data, list):
-        queues_data = [queues_data]
-
-      for queue in queues_data:
-        queues.append(
-          {
-            'queue_name': queue.get('name'),
-            'consumers': queue.get('consumers'),
-            'state':  queue.get('state'),
-            'messages_count':  queue.get('messages')
-          }
-        )
-        if not without_messages and queue_name is None:
-          print(f"Getting messages from queue: {queue_name}")
-          queues = list(filter(lambda x: x.get('messages_count') > 0, queues))
-      queues_df = pd.DataFrame(queues)
-      return queues_df
-    else:
-      print(f"Error: {response.status_code} - {response.text}")
+    if queue_name is None:
+      return self.get_queues_snapshot(vhost=vhost, only_with_messages=not without_messages)
+
+    params = {'columns': ','.join(SNAPSHOT_FIELDS.values()), 'disable_stats': 'true', 'enable_queue_totals': 'true'}
+    response = self.get(self.get_queue_url(queue_name, vhost), vhost, params=params)
+    if response.status_code != 200:
+      log.error('Queue status request failed', queue_name=queue_name, status_code=response.status_code, response=response.text)
       return None
 
-  def get_queue_messages(self, queue_name: str, gpa_code: int = None, collection:str = None, limit: int = None, vhost: str = None) -> list:
-    self.vhost = vhost
-    if limit is None:
-      queue_status = self.get_queue_status(queue_name, without_messages=True, vhost=vhost)
-      limit = int(queue_status['messages_count'].values[0])
-    
-    print(f"Getting {limit} messages from {queue_name} in {self.vhost} from gpa_code {gpa_code}")
-    messages = []
+    queue = response.json()
+    return pd.DataFrame({column: [get_field(queue, field)] for column, field in SNAPSHOT_FIELDS.items()})
+
+  @traced('rabbit.get_queues_snapshot')
+  def get_queues_snapshot(self, vhost: str = None, name_filter: str = None, only_with_messages: bool = False,
+                          with_rates: bool = False, sort: str = 'messages', sort_reverse: bool = True) -> pd.DataFrame:
+    """Columnar snapshot of the queues of a vhost.
 
-    # iterate in chunks of 1000
-    for chunk in range(0, limit, 500):
-      print(f"Getting chunk {chunk} of 500 - {limit} messages from {queue_name} in {self.vhost} from gpa_code {gpa_code}")
-      params = {'count': 500, 'ackmode': 'ack_requeue_true', 'encoding': 'auto'}
-      queue_url = f"{self.get_queue_url(queue_name)}/get"
-      response = requests.post(queue_url, auth=self.auth, json=params)
+    Filtering by name (regex), sorting and paging are done by the management API and only
+    the needed columns are requested. Stats are only computed by the broker when
+    `with_rates` is set. With `only_with_messages` the queues are sorted by depth and
+    paging stops at the first empty queue.
+    """
+    fields = {**SNAPSHOT_FIELDS, **SNAPSHOT_RATE_FIELDS} if with_rates else SNAPSHOT_FIELDS
+    if only_with_messages:
+      sort, sort_reverse = 'messages', True
 
+    params = {
+      'page_size': SNAPSHOT_PAGE_SIZE,
+      'columns': ','.join(fields.values()),
+      'sort': sort,
+      'sort_reverse': str(sort_reverse).lower(),
+    }
+    if not with_rates:
+      params['disable_stats'] = 'true'
+      params['enable_queue_totals'] = 'true'
+    if name_filter:
+      params['name'] = name_filter
+      params['use_regex'] = 'true'
+
+    snapshot = {column: [] for column in fields}
+    page, page_count = 1, 1
+    while page <= page_count:
+      try:
+        response = self.get(self.get_queue_url(None, vhost), vhost, params={**params, 'page': page})
+      except DeadlineExceeded:
+        if page == 1:
+          raise
+        # The pages already read are still a useful, if partial, snapshot
+        mark_partial('RabbitMQ')
+        break
       if response.status_code != 200:
-        print(f"Error: {response.status_code} - {response.text}")
+        log.error('Queues snapshot request failed', page=page, status_code=response.status_code, response=response.text)
         return None
 
-      messages_data = response.json()
-      for message in messages_data:
-        message_body = message['payload']
-
-        try:
-          payload = json.loads(message_body)['payload']
-          message_body = base64.b64decode(payload).decode('utf-8')
-        except Exception as e:
-          print(f"Error decoding message: {e}")
-        
-        if type(message_body) == str:
-          try:
-            message_body = json.loads(message_body)
-          except Exception as e:
-            print(f"Error parsing message: {e}")
-
-
-        print('message_body', message_body)
-        messages.append(message_body)
-    
+      data = response.json()
+      page_count = data.get('page_count', 1)
+      for queue in data.get('items', []):
+        if only_with_messages and not queue.get('messages'):
+          page_count = 0
+          break
+        for column, field in fields.items():
+          snapshot[column].append(get_field(queue, field))
+      page += 1
+
+    return pd.DataFrame(snapshot)
+
+  @traced('rabbit.get_queue_messages')
+  def get_queue_messages(self, queue_name: str, gpa_code: int = None, collection:str = None, limit: int = None, vhost: str = None, decode_stats: DecodeStats = None, reader: str = None) -> list:
+    decode_stats = decode_stats if decode_stats is not None else DecodeStats()
+    messages = self.iter_queue_messages(queue_name, limit, vhost=vhost, decode_stats=decode_stats, reader=reader)
+
     if gpa_code is not None:
-      messages = list(filter(lambda x: int(x.get('config', {}).get('gpa_code')) == int(gpa_code), messages))
-    
-    print(len(messages))
+      messages = filter(lambda x: int(x.get('config', {}).get('gpa_code')) == int(gpa_code), messages)
+
     if collection is not None:
-      messages = list(filter(lambda x: x.get('config', {}).get('model') == collection, messages))
-    
+      messages = filter(lambda x: x.get('config', {}).get('model') == collection, messages)
+
+    try:
+      messages = list(messages)
+    except QueueNotFoundError:
+      raise
+    except QueueReadError as e:
+      log.error('Queue read failed', queue_name=queue_name, error=str(e))
+      return None
+
+    log.info('Read queue messages', queue_name=queue_name, count=len(messages), decode_counters=dict(decode_stats.counters))
     return messages
 
+  def iter_queue_messages(self, queue_name: str, limit: int = None, vhost: str = None, decode_stats: DecodeStats = None, reader: str = None):
+    """Yield the decoded messages of a queue without removing them from the queue.
+
+    `reader` selects how the queue is read, 'http' or 'amqp', RABBIT_READER by default.
+    Decode failures are counted in `decode_stats` and the message is yielded as received.
+    """
+    decode_stats = decode_stats if decode_stats is not None else DecodeStats()
+    reader = reader or RABBIT_READER
+    if limit is None:
+      queue_status = self.get_queue_status(queue_name, without_messages=True, vhost=vhost)
+      if queue_status is None:
+        raise QueueNotFoundError(f"Não encontrei a fila {queue_name} em {vhost or RABBITMQ_VHOST}.")
+      limit = int(queue_status['messages_count'].values[0])
+    
+    log.debug('Reading queue', queue_name=queue_name, vhost=vhost, limit=limit, reader=reader)
+
+    try:
+      if reader == 'amqp':
+        yield from self.iter_queue_messages_amqp(queue_name, limit, vhost, decode_stats)
+      else:
+        yield from self.iter_queue_messages_http(queue_name, limit, vhost, decode_stats)
+    except DeadlineExceeded as e:
+      # The messages read until the deadline are returned, the request is marked as partial
+      mark_partial(e.source)
+
+  def iter_queue_messages_http(self, queue_name: str, limit: int, vhost: str, decode_stats: DecodeStats):
+    """Peek through the management API, one chunk at a time, decoding each chunk while the next one is fetched"""
+    pending = None
+    for chunk in range(0, limit, MESSAGES_CHUNK_SIZE):
+      count = min(MESSAGES_CHUNK_SIZE, limit - chunk)
+      params = {'count': count, 'ackmode': 'ack_requeue_true', 'encoding': 'auto'}
+      queue_url = f"{self.get_queue_url(queue_name, vhost)}/get"
+      with span('rabbit.http_get_chunk', count=count):
+        response = self.post(queue_url, vhost, json=params)
+
+      if response.status_code != 200:
+        raise QueueReadError(f"{response.status_code} - {response.text}")
+
+      decoding = self.decoder.submit([message['payload'] for message in response.json()])
+      if pending is not None:
+        yield from self.decoder.collect(pending, decode_stats)
+      pending = decoding
+
+    if pending is not None:
+      yield from self.decoder.collect(pending, decode_stats)
+
+  def iter_queue_messages_amqp(self, queue_name: str, limit: int, vhost: str, decode_stats: DecodeStats):
+    """Peek through AMQP with a consumer limited by prefetch.
+
+    Messages stay unacknowledged while they are read, so each one is delivered once
+    and the queue is not reordered, and they are all returned with a single
+    basic_nack(multiple=True, requeue=True) at the end. Stream queues are read from
+    the first offset instead, which doesn't remove anything. Live consumers don't get
+    the messages held meanwhile, so at most AMQP_MAX_PREFETCH are read.
+    """
+    if limit > AMQP_MAX_PREFETCH:
+      log.warning('AMQP read capped at the prefetch limit', queue_name=queue_name, limit=limit, cap=AMQP_MAX_PREFETCH)
+      add_note(f"⚠️ Foram lidas no máximo {AMQP_MAX_PREFETCH} mensagens da fila {queue_name}, o limite de uma leitura por AMQP.")
+      limit = AMQP_MAX_PREFETCH
+    if limit <= 0:
+      return
+
+    is_stream = self.get_queue_type(queue_name, vhost) == 'stream'
+    try:
+      parameters = self.amqp_parameters(vhost)
+    except UnknownVhostError as e:
+      raise QueueReadError(str(e))
+    try:
+      with span('rabbit.amqp_connect'), circuit(breaker_name(vhost), timeout=parameters.socket_timeout):
+        connection = connect_amqp(parameters)
+    except pika.exceptions.AMQPError as e:
+      raise QueueReadError(f"AMQP connection failed: {e}")
+
+    try:
+      channel = connection.channel()
+      channel.basic_qos(prefetch_count=limit)
+      arguments = {'x-stream-offset': 'first'} if is_stream else None
+
+      bodies = []
+      read = 0
+      last_delivery_tag = None
+      try:
+        for method, _, body in channel.consume(queue_name, arguments=arguments, inactivity_timeout=AMQP_INACTIVITY_TIMEOUT):
+          if method is None:
+            break
+          bodies.append(body)
+          read += 1
+          last_delivery_tag = method.delivery_tag
+          if len(bodies) >= MESSAGES_CHUNK_SIZE:
+            yield from self.decoder.decode(bodies, decode_stats)
+            bodies = []
+            call_timeout('RabbitMQ')
+          if read >= limit:
+            break
+
+        yield from self.decoder.decode(bodies, decode_stats)
+      finally:
+        if last_delivery_tag is not None and channel.is_open:
+          if is_stream:
+            channel.basic_ack(delivery_tag=last_delivery_tag, multiple=True)
+          else:
+            channel.basic_nack(delivery_tag=last_delivery_tag, multiple=True, requeue=True)
+        if channel.is_open:
+          channel.cancel()
+          channel.close()
+    except pika.exceptions.AMQPError as e:
+      raise QueueReadError(f"AMQP read failed: {e}")
+    finally:
+      if connection.is_open:
+        connection.close()
+
+  @traced('rabbit.get_queue_type')
+  def get_queue_type(self, queue_name: str, vhost: str = None) -> str:
+    response = self.get(self.get_queue_url(queue_name, vhost), vhost, params={'columns': 'type', 'disable_stats': 'true'})
+    if response.status_code != 200:
+      return None
+    return response.json().get('type')
+
+  @traced('rabbit.resend_to_queue')
   def resend_to_queue(self, queue_name: str, limit: int, vhost: str = None) -> str: 
-    self.vhost = vhost
-    destination_queue = queue_name.split('-')[0]
+    destination_queue = self.get_destination_queue(queue_name)
     messages = self.get_queue_messages(queue_name=queue_name, limit=limit, vhost=vhost)
-    print(f"Resending {len(messages)} messages to {destination_queue}")
+    log.info('Resending messages', queue_name=queue_name, destination_queue=destination_queue, count=len(messages))
     try:
       if messages is not None:
         for message in messages:
-          self.send_message(destination_queue, message)
+          self.send_message(destination_queue, message, vhost)
         return f"Foram reprocessadas {len(messages)} mensagens da fila {queue_name} para a fila {destination_queue}"
       else:
         return f"Não foi possível reprocessar as mensagens da fila {queue_name} para a fila {destination_queue}"
     except Exception as e:
-      print(f"Error resending messages: {e}")
+      log.exception('Resending messages failed', queue_name=queue_name, destination_queue=destination_queue)
       return f"Ocorreu um erro ao reenviar as mensagens: {e}"
     
-  def send_message(self, queue_name: str, message: dict) -> bool:
-    url = self.get_rabbitmq_amq_string()
-    print(f"Connecting to {url}")
-    params = pika.URLParameters(url)
-    connection = pika.BlockingConnection(params)
+  @traced('rabbit.send_message')
+  def send_message(self, queue_name: str, message: dict, vhost: str = None) -> bool:
+    parameters = self.amqp_parameters(vhost)
+    with circuit(breaker_name(vhost), timeout=parameters.socket_timeout):
+      connection = connect_amqp(parameters)
     channel = connection.channel()
 
-    channel.exchange_declare(exchange='aqila_exg', exchange_type='topic', durable=True)
+    channel.exchange_declare(exchange=RABBITMQ_EXCHANGE, exchange_type='topic', durable=True)
     
-    routing_key = None
-    match queue_name:
-      case 'sync_to_postgres':
-        routing_key = constants.RoutingKey.AQILA_FIREBIRD_TO_API
-      case 'sync_to_mongo':
-        routing_key = constants.RoutingKey.AQILA_API_TO_MONGO
-      case _:
-        routing_key = f"{constants.RoutingKey.AQILA_API_TO_FIREBIRD}.{queue_name}"
-
-    channel.basic_publish(exchange='aqila_exg', routing_key=routing_key, body=json.dumps(message))
-    print(f"Sending {message} to {queue_name}  - routing_key {routing_key} - in {self.vhost}")
+    routing_key = self.get_routing_key(queue_name)
+    channel.basic_publish(exchange=RABBITMQ_EXCHANGE, routing_key=routing_key, body=json.dumps(message))
+    # One log per message, sampled
+    log.debug('Sent message', sample_rate=LOG_SAMPLE_RATE, queue_name=queue_name, routing_key=routing_key, vhost=vhost, message=message)
     channel.close()
     connection.close()
     return True
 
-  def summarize_queue_messages(self, queue_name: str, limit: int = None, vhost: str = None) -> pd.DataFrame:
-    messages = self.get_queue_messages(queue_name=queue_name, limit=limit, vhost=vhost)
-    try:
-      if messages is not None:
-        df = pd.DataFrame.from_dict(messages)
+  def get_destination_queue(self, queue_name: str) -> str:
+    """The queue a dead-letter queue is reprocessed to, e.g. sync_to_mongo-dlq -> sync_to_mongo"""
+    return queue_name.split('-')[0]
 
-        config_df = pd.DataFrame.from_dict(df['config'].values.tolist())
-        config_df = config_df.astype(str)
-        grouped = config_df.value_counts(['gpa_code', 'tenant', 'model', 'action',  'origin']).reset_index(name='qtd')
+  def get_routing_key(self, queue_name: str) -> str:
+    match queue_name:
+      case 'sync_to_postgres':
+        return constants.RoutingKey.AQILA_FIREBIRD_TO_API
+      case 'sync_to_mongo':
+        return constants.RoutingKey.AQILA_API_TO_MONGO
+      case _:
+        return f"{constants.RoutingKey.AQILA_API_TO_FIREBIRD}.{queue_name}"
 
-        return grouped
-      else:
+  @traced('rabbit.summarize_queue_messages')
+  def summarize_queue_messages(self, queue_name: str, limit: int = None, vhost: str = None, reader: str = None) -> pd.DataFrame:
+    try:
+      # Messages are counted while they are decoded, memory grows with the number of groups only
+      groups = count_message_groups(
+        self.iter_queue_messages(queue_name=queue_name, limit=limit, vhost=vhost, reader=reader),
+        keys=SUMMARY_GROUP_KEYS
+      )
+      if not groups:
         return None
+
+      return pd.DataFrame(groups, columns=[*SUMMARY_GROUP_KEYS, 'qtd'])
+    except QueueNotFoundError:
+      raise
       
     except Exception as e:
-      print(f"Error summarizing messages: {e}")
+      log.exception('Summarizing messages failed', queue_name=queue_name)
       return None
     
-  def get_rabbitmq_amq_string(self) -> str:
-    if self.vhost == 'aqila':
+  def get_rabbitmq_amq_string(self, vhost: str) -> str:
+    vhost = vhost or RABBITMQ_VHOST
+    if vhost == 'aqila':
       return f"amqps://{RABBITMQ_PRD_USER}:{RABBITMQ_PRD_PASSWORD}@{RABBITMQ_URL}:{RABBITMQ_PRD_PORT}/{RABBITMQ_PRD_VIRTUAL_HOST}"
-    elif self.vhost == 'aqila-hml':
+    elif vhost == 'aqila-hml':
       return f"amqps://{RABBITMQ_HML_USER}:{RABBITMQ_HML_PASSWORD}@{RABBITMQ_URL}:{RABBITMQ_HML_PORT}/{RABBITMQ_HML_VIRTUAL_HOST}"
+    raise UnknownVhostError(f"No AMQP connection configured for vhost {vhost}, only aqila and aqila-hml")
+
+def connect_amqp(parameters: pika.URLParameters) -> pika.BlockingConnection:
+  """Open an AMQP connection, a connect or handshake that timed out raises DeadlineExceeded"""
+  try:
+    return pika.BlockingConnection(parameters)
+  except AMQPConnectorStackTimeout:
+    raise DeadlineExceeded('RabbitMQ')
+  except pika.exceptions.AMQPConnectionError as e:
+    # A socket connect that failed is wrapped, with the socket error in its `exception`
+    if e.args and isinstance(getattr(e.args[0], 'exception', None), TimeoutError):
+      raise DeadlineExceeded('RabbitMQ')
+    raise
+
+def breaker_name(vhost: str) -> str:
+  """One circuit per vhost, for both the management API and AMQP"""
+  return f"RabbitMQ {vhost or RABBITMQ_VHOST}"
+
+def get_field(data: dict, field: str):
+  """Read a dotted field (e.g. message_stats.publish_details.rate) from a management API object"""
+  for key in field.split('.'):
+    if not isinstance(data, dict):
+      return None
+    data = data.get(key)
+  return data
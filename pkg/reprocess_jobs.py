@@ -0,0 +1,339 @@
+import os
+import json
+import time
+import uuid
+import socket
+import tempfile
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import orjson
+import pika
+from dotenv import load_dotenv
+import pkg.rabbit as rabbit_service
+from pkg.message_decoder import decode_payload
+from pkg.logger import get_logger, LOG_SAMPLE_RATE
+
+load_dotenv()
+
+REPROCESS_JOBS_DIR = os.getenv('REPROCESS_JOBS_DIR', os.path.join(tempfile.gettempdir(), 'alfredo_reprocess_jobs'))
+REPROCESS_MAX_JOBS = int(os.getenv('REPROCESS_MAX_JOBS', 4))
+REPROCESS_JOBS_PER_VHOST = int(os.getenv('REPROCESS_JOBS_PER_VHOST', 1))
+# Messages republished per second in each vhost
+REPROCESS_RATE_LIMIT = float(os.getenv('REPROCESS_RATE_LIMIT', 200))
+REPROCESS_CHECKPOINT_EVERY = int(os.getenv('REPROCESS_CHECKPOINT_EVERY', 100))
+# Seconds between the checkpoints a worker writes for its live jobs, and without one after which a job is interrupted
+REPROCESS_HEARTBEAT = float(os.getenv('REPROCESS_HEARTBEAT', 30))
+REPROCESS_STALE_AFTER = float(os.getenv('REPROCESS_STALE_AFTER', 120))
+
+FINISHED_STATUSES = ('done', 'failed', 'cancelled')
+
+log = get_logger('reprocess_jobs')
+
+# Tells this process from an earlier one that had the same pid, e.g. after a container restart
+PROCESS_TOKEN = uuid.uuid4().hex[:8]
+
+def process_alive(pid: int) -> bool:
+  try:
+    os.kill(pid, 0)
+  except ProcessLookupError:
+    return False
+  except PermissionError:
+    return True
+  return True
+
+class RateLimiter:
+  """Token bucket shared by the jobs of a vhost"""
+
+  def __init__(self, rate: float):
+    self.rate = rate
+    self.tokens = rate
+    self.updated_at = time.monotonic()
+    self.lock = threading.Lock()
+
+  def acquire(self):
+    while True:
+      with self.lock:
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+          self.tokens -= 1
+          return
+        wait = (1 - self.tokens) / self.rate
+      time.sleep(wait)
+
+class ReprocessJob:
+  def __init__(self, vhost: str, source_queue: str, destination_queue: str, limit: int, job_id: str = None, owner: str = None):
+    self.id = job_id or uuid.uuid4().hex[:8]
+    self.owner = owner
+    self.vhost = vhost
+    self.source_queue = source_queue
+    self.destination_queue = destination_queue
+    self.limit = limit
+    self.status = 'pending'
+    self.processed = 0
+    self.failed = 0
+    self.error = None
+    self.created_at = time.time()
+    self.updated_at = self.created_at
+    self.cancel_requested = False
+
+  def to_dict(self) -> dict:
+    return {
+      'id': self.id,
+      'owner': self.owner,
+      'vhost': self.vhost,
+      'source_queue': self.source_queue,
+      'destination_queue': self.destination_queue,
+      'limit': self.limit,
+      'status': self.status,
+      'processed': self.processed,
+      'failed': self.failed,
+      'error': self.error,
+      'created_at': self.created_at,
+      'updated_at': self.updated_at,
+    }
+
+  @classmethod
+  def from_dict(cls, data: dict) -> 'ReprocessJob':
+    job = cls(data['vhost'], data['source_queue'], data['destination_queue'], data['limit'], job_id=data['id'], owner=data.get('owner'))
+    job.status = data['status']
+    job.processed = data['processed']
+    job.failed = data['failed']
+    job.error = data.get('error')
+    job.created_at = data['created_at']
+    job.updated_at = data['updated_at']
+    return job
+
+class ReprocessJobEngine:
+  """Moves messages from a dead-letter queue back to its destination in background jobs.
+
+  Each message is taken with basic_get, republished with publisher confirms and only
+  acked in the source queue after the broker confirmed the publish, so a retry never
+  republishes a message that was already moved. Jobs run with bounded concurrency and a
+  rate limit per vhost, and their progress is checkpointed to REPROCESS_JOBS_DIR.
+  Each checkpoint names the worker (host:pid:token) that owns the job, and the owner
+  checkpoints its live jobs every REPROCESS_HEARTBEAT seconds. A job whose owner is
+  dead, or that had no checkpoint for REPROCESS_STALE_AFTER seconds, is 'interrupted'
+  and can be resumed. With several workers sharing REPROCESS_JOBS_DIR, the status of a
+  job run by another worker is read from its checkpoint.
+  """
+
+  def __init__(self, jobs_dir: str = REPROCESS_JOBS_DIR, max_jobs: int = REPROCESS_MAX_JOBS,
+               jobs_per_vhost: int = REPROCESS_JOBS_PER_VHOST, rate_limit: float = REPROCESS_RATE_LIMIT,
+               heartbeat: float = REPROCESS_HEARTBEAT, stale_after: float = REPROCESS_STALE_AFTER):
+    self.jobs_dir = jobs_dir
+    self.owner = f"{socket.gethostname()}:{os.getpid()}:{PROCESS_TOKEN}"
+    self.heartbeat = heartbeat
+    self.stale_after = stale_after
+    self.executor = ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix='reprocess')
+    self.vhost_slots = defaultdict(lambda: threading.Semaphore(jobs_per_vhost))
+    self.rate_limiters = defaultdict(lambda: RateLimiter(rate_limit))
+    self.jobs = {}
+    self.loaded = set()  # Loaded from the checkpoints, not started by this process
+    self.lock = threading.Lock()
+    self.checkpoint_lock = threading.Lock()
+    os.makedirs(self.jobs_dir, exist_ok=True)
+    self.load_checkpoints()
+    threading.Thread(target=self.beat, name='reprocess-heartbeat', daemon=True).start()
+
+  def submit(self, vhost: str, queue_name: str, limit: int = None) -> ReprocessJob:
+    """Start a job moving up to `limit` messages, all of the queue by default, None when the queue doesn't exist"""
+    rabbit = rabbit_service.Rabbit()
+    if limit is None:
+      queue_status = rabbit.get_queue_status(queue_name, without_messages=True, vhost=vhost)
+      if queue_status is None:
+        return None
+      limit = int(queue_status['messages_count'].values[0])
+
+    job = ReprocessJob(vhost, queue_name, rabbit.get_destination_queue(queue_name), limit, owner=self.owner)
+    with self.lock:
+      self.jobs[job.id] = job
+    self.checkpoint(job)
+    # Claimed from the start, no other worker can resume the state it was submitted in
+    self.claim(job)
+    self.executor.submit(self.run, job)
+    return job
+
+  def resume(self, job_id: str) -> ReprocessJob:
+    job = self.get(job_id)
+    if job is None or job.status not in ('interrupted', 'failed'):
+      return job
+    if not self.claim(job):
+      # Another worker resumed it first
+      return self.get(job_id)
+
+    # Messages that failed were returned to the source queue and will be tried again
+    job.status = 'pending'
+    job.owner = self.owner
+    job.failed = 0
+    job.error = None
+    with self.lock:
+      self.jobs[job.id] = job
+      self.loaded.discard(job.id)
+    self.checkpoint(job)
+    self.executor.submit(self.run, job)
+    return job
+
+  def claim(self, job: ReprocessJob) -> bool:
+    """Take the resume of `job`, in the state it was read in, for this process only.
+
+    The claim is a file created with O_EXCL, so of the workers sharing REPROCESS_JOBS_DIR
+    that read the same checkpoint exactly one gets it. The checkpoint is read again after
+    claiming, in case the job was resumed since this process read it.
+    """
+    path = os.path.join(self.jobs_dir, f"{job.id}.{job.updated_at:.6f}.claim")
+    try:
+      os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except FileExistsError:
+      return False
+    stored = self.read_checkpoint(job.id)
+    return stored is None or stored.updated_at <= job.updated_at
+
+  def cancel(self, job_id: str) -> ReprocessJob:
+    job = self.get(job_id)
+    if job is not None and job.status not in FINISHED_STATUSES:
+      job.cancel_requested = True
+    return job
+
+  def get(self, job_id: str) -> ReprocessJob:
+    with self.lock:
+      job = self.jobs.get(job_id)
+      if job is not None and job_id not in self.loaded:
+        return job
+
+    # Submitted by another worker, or resumed by one since this process loaded it
+    stored = self.read_checkpoint(job_id)
+    if stored is None or (job is not None and stored.updated_at <= job.updated_at):
+      stored = job
+    if stored is not None and stored.status not in FINISHED_STATUSES and self.orphaned(stored):
+      stored.status = 'interrupted'
+    return stored
+
+  def orphaned(self, job: ReprocessJob) -> bool:
+    """Whether the worker that owns `job` is gone: dead, restarted, or silent for `stale_after` seconds"""
+    if time.time() - job.updated_at > self.stale_after:
+      return True
+    owner = (job.owner or '').split(':')
+    if len(owner) != 3 or owner[0] != socket.gethostname() or not owner[1].isdigit():
+      return False
+    _, pid, token = owner
+    if int(pid) == os.getpid():
+      return token != PROCESS_TOKEN
+    return not process_alive(int(pid))
+
+  def read_checkpoint(self, job_id: str) -> ReprocessJob:
+    if not job_id.isalnum():
+      return None
+    try:
+      with open(os.path.join(self.jobs_dir, f"{job_id}.json")) as f:
+        return ReprocessJob.from_dict(json.load(f))
+    except (OSError, ValueError, KeyError):
+      return None
+
+  def run(self, job: ReprocessJob):
+    with self.vhost_slots[job.vhost]:
+      job.status = 'running'
+      self.checkpoint(job)
+      try:
+        self.move_messages(job)
+        job.status = 'cancelled' if job.cancel_requested else 'done'
+      except Exception as e:
+        log.exception('Reprocess job failed', job_id=job.id)
+        job.status = 'failed'
+        job.error = str(e)
+      self.checkpoint(job)
+    if job.status != 'failed':
+      self.remove_claims(job)
+
+  def remove_claims(self, job: ReprocessJob):
+    """Claims of a finished job, it can't be resumed anymore"""
+    for filename in os.listdir(self.jobs_dir):
+      if filename.startswith(f"{job.id}.") and filename.endswith('.claim'):
+        try:
+          os.remove(os.path.join(self.jobs_dir, filename))
+        except OSError:
+          pass
+
+  def move_messages(self, job: ReprocessJob):
+    rabbit = rabbit_service.Rabbit()
+    routing_key = rabbit.get_routing_key(job.destination_queue)
+    limiter = self.rate_limiters[job.vhost]
+
+    connection = pika.BlockingConnection(pika.URLParameters(rabbit.get_rabbitmq_amq_string(job.vhost)))
+    try:
+      channel = connection.channel()
+      channel.confirm_delivery()
+      channel.exchange_declare(exchange=rabbit_service.RABBITMQ_EXCHANGE, exchange_type='topic', durable=True)
+
+      # Failed messages stay unacked until the channel is closed, so basic_get doesn't return them again
+      while job.processed + job.failed < job.limit and not job.cancel_requested:
+        method, _, body = channel.basic_get(job.source_queue, auto_ack=False)
+        if method is None:
+          break
+
+        limiter.acquire()
+        message, _, error = decode_payload(body)
+        if error is not None:
+          job.failed += 1
+        else:
+          try:
+            channel.basic_publish(
+              exchange=rabbit_service.RABBITMQ_EXCHANGE,
+              routing_key=routing_key,
+              body=orjson.dumps(message),
+              mandatory=True
+            )
+            channel.basic_ack(delivery_tag=method.delivery_tag)
+            job.processed += 1
+          except (pika.exceptions.UnroutableError, pika.exceptions.NackError) as e:
+            log.warning('Publish not confirmed', job_id=job.id, sample_rate=LOG_SAMPLE_RATE, error=str(e))
+            job.failed += 1
+
+        # Close to the limit every message is checkpointed, a resume after a crash must not move more than `limit`
+        handled = job.processed + job.failed
+        if handled % REPROCESS_CHECKPOINT_EVERY == 0 or job.limit - handled < REPROCESS_CHECKPOINT_EVERY:
+          self.checkpoint(job)
+    finally:
+      if connection.is_open:
+        connection.close()
+
+  def checkpoint(self, job: ReprocessJob):
+    # The heartbeat checkpoints too, a snapshot taken before the final state must not replace it
+    with self.checkpoint_lock:
+      job.updated_at = time.time()
+      path = os.path.join(self.jobs_dir, f"{job.id}.json")
+      temp_path = f"{path}.tmp"
+      with open(temp_path, 'w') as f:
+        json.dump(job.to_dict(), f)
+      os.replace(temp_path, path)
+
+  def beat(self):
+    """Checkpoint the live jobs of this process, so other workers know their owner is still running them"""
+    while True:
+      time.sleep(self.heartbeat)
+      with self.lock:
+        live = [job for job_id, job in self.jobs.items() if job_id not in self.loaded and job.status not in FINISHED_STATUSES]
+      for job in live:
+        try:
+          self.checkpoint(job)
+        except OSError as e:
+          log.error('Reprocess job heartbeat failed', job_id=job.id, error=str(e))
+
+  def load_checkpoints(self):
+    for filename in os.listdir(self.jobs_dir):
+      if not filename.endswith('.json'):
+        continue
+      try:
+        with open(os.path.join(self.jobs_dir, filename)) as f:
+          job = ReprocessJob.from_dict(json.load(f))
+      except Exception as e:
+        log.error('Loading reprocess job failed', filename=filename, error=str(e))
+        continue
+
+      # Jobs still run by another worker keep their status
+      if job.status not in FINISHED_STATUSES and self.orphaned(job):
+        job.status = 'interrupted'
+      self.jobs[job.id] = job
+      self.loaded.add(job.id)
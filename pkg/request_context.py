@@ -0,0 +1,95 @@
+import os
+import time
+import contextvars
+from dotenv import load_dotenv
+from pkg.telemetry import current_span, metrics
+
+load_dotenv()
+
+# Timeouts of the outbound calls, capped by what is left of the request deadline
+OUTBOUND_TIMEOUT = float(os.getenv('OUTBOUND_TIMEOUT', 30))
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', 60))
+
+current_context = contextvars.ContextVar('current_context', default=None)
+
+class DeadlineExceeded(Exception):
+  """The request deadline passed before `source` answered"""
+
+  def __init__(self, source: str):
+    super().__init__(f"Deadline exceeded waiting for {source}")
+    self.source = source
+
+class RequestContext:
+  """What a request carries down to the tools and services: vhost, user, deadline and trace.
+
+  The Chatbot, Rabbit and the other services are shared by every request (thread pool
+  workers, asyncio tasks), so nothing request specific is stored on them, it is passed
+  along in the context instead.
+  """
+
+  def __init__(self, vhost: str, user_id: str = 'default', timeout: float = None, trace_id: str = None):
+    self.vhost = vhost
+    self.user_id = user_id
+    self.deadline = time.monotonic() + timeout if timeout else None
+    if trace_id is None:
+      parent = current_span.get()
+      trace_id = parent.trace_id if parent is not None else None
+    self.trace_id = trace_id
+    self.timed_out = []  # Sources left out of a partial result
+    self.notes = []  # Caveats about the answer, added to it by the API
+
+  def remaining(self) -> float:
+    """Seconds left until the deadline, None without a deadline"""
+    if self.deadline is None:
+      return None
+    return max(self.deadline - time.monotonic(), 0.0)
+
+  @property
+  def expired(self) -> bool:
+    return self.deadline is not None and time.monotonic() >= self.deadline
+
+  def mark_partial(self, source: str):
+    if source not in self.timed_out:
+      self.timed_out.append(source)
+
+  def add_note(self, text: str):
+    if text not in self.notes:
+      self.notes.append(text)
+
+  def __repr__(self) -> str:
+    return f"RequestContext(vhost={self.vhost!r}, user_id={self.user_id!r}, remaining={self.remaining()}, trace_id={self.trace_id!r})"
+
+def call_timeout(source: str, default: float = OUTBOUND_TIMEOUT) -> float:
+  """Timeout for a call to `source`: what is left of the deadline of the current request, at most `default`.
+
+  Raises:
+    DeadlineExceeded: When the deadline already passed, the call is not even started
+  """
+  ctx = current_context.get()
+  remaining = ctx.remaining() if ctx is not None else None
+  if remaining is None:
+    return default
+  if remaining <= 0:
+    raise DeadlineExceeded(source)
+  return min(remaining, default)
+
+def add_note(text: str):
+  """Add a caveat to the answer of the current request"""
+  ctx = current_context.get()
+  if ctx is not None:
+    ctx.add_note(text)
+
+def mark_partial(source: str):
+  """Record in the current request that the result lacks what `source` didn't answer in time"""
+  metrics.inc('alfredo_partial_results_total', source=source)
+  ctx = current_context.get()
+  if ctx is not None:
+    ctx.mark_partial(source)
+
+def llm_client(client):
+  """`client` (an OpenAI client) with the timeout left for the current request, without retries under a deadline"""
+  ctx = current_context.get()
+  if ctx is None or ctx.deadline is None:
+    return client.with_options(timeout=LLM_TIMEOUT)
+  # A retry would start over with the same timeout, past the deadline
+  return client.with_options(timeout=call_timeout('Azure OpenAI', LLM_TIMEOUT), max_retries=0)
@@ -0,0 +1,206 @@
+import os
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import requests
+from dotenv import load_dotenv
+from pkg.telemetry import metrics
+from pkg.logger import get_logger
+from pkg.request_context import DeadlineExceeded, call_timeout, OUTBOUND_TIMEOUT
+
+load_dotenv()
+
+# Consecutive failures that open a circuit, and seconds it stays open before a probe is let through
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', 5))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv('CIRCUIT_RESET_TIMEOUT', 30))
+# Seconds an idempotent read waits before a second, hedged, request is sent; 0 disables hedging
+HEDGE_DELAY = float(os.getenv('HEDGE_DELAY', 0))
+HEDGE_MAX_WORKERS = int(os.getenv('HEDGE_MAX_WORKERS', 16))
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+log = get_logger('resilience')
+
+class CircuitOpen(Exception):
+  """`dependency` failed repeatedly, calls to it fail fast until `retry_after` seconds pass"""
+
+  def __init__(self, dependency: str, retry_after: float):
+    super().__init__(f"Circuit open for {dependency}, retry in {retry_after:.0f} s")
+    self.dependency = dependency
+    self.retry_after = retry_after
+
+class CircuitBreaker:
+  """Consecutive failure breaker of one dependency.
+
+  Closed: calls go through and failures are counted, `failure_threshold` in a row open it.
+  Open: calls fail with CircuitOpen without touching the dependency for `reset_timeout` seconds.
+  Half-open: a single probe is let through, its success closes the circuit and its
+  failure opens it again, other calls keep failing fast meanwhile.
+  """
+
+  def __init__(self, name: str, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD, reset_timeout: float = CIRCUIT_RESET_TIMEOUT):
+    self.name = name
+    self.failure_threshold = failure_threshold
+    self.reset_timeout = reset_timeout
+    self.state = CLOSED
+    self.failures = 0
+    self.opened_at = None
+    self.probing = False
+    self.lock = threading.Lock()
+
+  def allow(self):
+    """Raises CircuitOpen when the call must not be made, in half-open the caller becomes the probe"""
+    with self.lock:
+      if self.state == CLOSED:
+        return
+      retry_after = self.opened_at + self.reset_timeout - time.monotonic()
+      if self.state == OPEN and retry_after <= 0:
+        self.transition(HALF_OPEN)
+      if self.state == HALF_OPEN and not self.probing:
+        self.probing = True
+        return
+    metrics.inc('alfredo_circuit_rejected_total', dependency=self.name)
+    raise CircuitOpen(self.name, max(retry_after, 0))
+
+  # While open, calls let through before it opened may still finish, they change nothing
+  def record_success(self):
+    with self.lock:
+      if self.state == OPEN:
+        return
+      self.failures = 0
+      self.probing = False
+      if self.state == HALF_OPEN:
+        self.transition(CLOSED)
+
+  def record_failure(self):
+    with self.lock:
+      if self.state == OPEN:
+        return
+      self.failures += 1
+      self.probing = False
+      if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+        self.opened_at = time.monotonic()
+        self.transition(OPEN)
+
+  def record_cut_short(self):
+    """The call ran out of the caller's time, not the dependency's: nothing is counted, only the probe is freed"""
+    with self.lock:
+      self.probing = False
+
+  def transition(self, state: str):
+    log.warning('Circuit state changed', dependency=self.name, previous=self.state, state=state, failures=self.failures)
+    metrics.inc('alfredo_circuit_transitions_total', dependency=self.name, state=state)
+    self.state = state
+
+  def snapshot(self) -> dict:
+    with self.lock:
+      return {'state': self.state, 'failures': self.failures}
+
+breakers = {}
+breakers_lock = threading.Lock()
+
+def get_breaker(name: str) -> CircuitBreaker:
+  """The breaker of a dependency, one per name for the whole process"""
+  with breakers_lock:
+    if name not in breakers:
+      breakers[name] = CircuitBreaker(name)
+    return breakers[name]
+
+def breakers_snapshot() -> dict:
+  with breakers_lock:
+    current = dict(breakers)
+  return {name: breaker.snapshot() for name, breaker in current.items()}
+
+def cut_short(timeout: float) -> bool:
+  """Whether a call had less than OUTBOUND_TIMEOUT because of the deadline of its request, its timeout is then no failure of the dependency"""
+  return timeout is not None and timeout < OUTBOUND_TIMEOUT
+
+@contextmanager
+def circuit(name: str, ignore: tuple = (), timeout: float = None):
+  """Run the block through the breaker `name`: fail fast while it is open, count the block's exceptions as failures.
+
+  Exceptions of the types in `ignore` are errors of the caller, not of the dependency,
+  and count as successes. `timeout` is the one the block was given, when it is cut short
+  by the request deadline a DeadlineExceeded of the block counts as nothing.
+  """
+  breaker = get_breaker(name)
+  breaker.allow()
+  try:
+    yield breaker
+  except ignore:
+    breaker.record_success()
+    raise
+  except DeadlineExceeded:
+    if cut_short(timeout):
+      breaker.record_cut_short()
+    else:
+      breaker.record_failure()
+    raise
+  except Exception:
+    breaker.record_failure()
+    raise
+  else:
+    breaker.record_success()
+
+def http_request(method: str, url: str, source: str, session=requests, breaker: str = None, **kwargs) -> requests.Response:
+  """HTTP request with the timeout of the request deadline, through the breaker `breaker`, the host of `url` by default.
+
+  Connection errors, timeouts and 5xx responses count as failures, except timeouts cut
+  short by the request deadline. A timeout raises DeadlineExceeded(source), other
+  responses are returned as they are.
+  """
+  timeout = call_timeout(source)
+  breaker = get_breaker(breaker or urlparse(url).netloc)
+  breaker.allow()
+  try:
+    response = session.request(method, url, timeout=timeout, **kwargs)
+  except requests.Timeout:
+    if cut_short(timeout):
+      breaker.record_cut_short()
+    else:
+      breaker.record_failure()
+    raise DeadlineExceeded(source)
+  except requests.RequestException:
+    breaker.record_failure()
+    raise
+  if response.status_code >= 500:
+    breaker.record_failure()
+  else:
+    breaker.record_success()
+  return response
+
+hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_MAX_WORKERS, thread_name_prefix='hedge')
+
+def hedged(operation: str, func, *args, delay: float = None, **kwargs):
+  """Call `func`, and call it again if it hasn't answered after `delay` seconds, returning the first success.
+
+  Only for idempotent reads: the slower call is not cancelled, its result is dropped.
+  Each call runs with a copy of the context, so it keeps the request deadline and span.
+  """
+  delay = HEDGE_DELAY if delay is None else delay
+  if delay <= 0:
+    return func(*args, **kwargs)
+
+  primary = hedge_executor.submit(contextvars.copy_context().run, func, *args, **kwargs)
+  done, _ = wait([primary], timeout=delay)
+  if done:
+    return primary.result()
+
+  metrics.inc('alfredo_hedged_requests_total', operation=operation)
+  hedge = hedge_executor.submit(contextvars.copy_context().run, func, *args, **kwargs)
+  pending = {primary, hedge}
+  error = None
+  while pending:
+    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+    for future in done:
+      if future.exception() is None:
+        if future is hedge:
+          metrics.inc('alfredo_hedged_wins_total', operation=operation)
+        return future.result()
+      error = error or future.exception()
+  raise error
@@ -0,0 +1,170 @@
+import io
+import os
+import time
+import secrets
+import tempfile
+import threading
+from collections import OrderedDict
+import orjson
+import pandas as pd
+from dotenv import load_dotenv
+from pkg.logger import get_logger
+
+load_dotenv()
+
+RESULT_STORE_MAX_ENTRIES = int(os.getenv('RESULT_STORE_MAX_ENTRIES', 200))
+RESULT_STORE_TTL = int(os.getenv('RESULT_STORE_TTL', 3600))
+# Results above this total are written to Parquet files in RESULT_STORE_DIR, least recently used first
+RESULT_STORE_MEMORY_MB = int(os.getenv('RESULT_STORE_MEMORY_MB', 256))
+RESULT_STORE_DIR = os.getenv('RESULT_STORE_DIR', os.path.join(tempfile.gettempdir(), 'alfredo_results'))
+RESULT_QUERY_MAX_ROWS = 200
+
+def to_frame(result) -> pd.DataFrame:
+  """Columnar form of a tool result, None for results that are not tabular (texts)"""
+  if isinstance(result, pd.DataFrame):
+    df = result.copy()
+  elif isinstance(result, list) and result and all(isinstance(item, dict) for item in result):
+    # config.gpa_code, config.model, ... become columns, deeper values stay in one column
+    df = pd.json_normalize(result, max_level=1)
+  elif isinstance(result, list):
+    df = pd.DataFrame({'value': result})
+  elif isinstance(result, dict):
+    df = pd.json_normalize([result], max_level=1)
+  else:
+    return None
+
+  # Nested and mixed values are kept as JSON text so every column has a Parquet type
+  for column in df.columns:
+    if df[column].dtype == object and not df[column].map(lambda value: value is None or isinstance(value, str)).all():
+      df[column] = df[column].map(lambda value: value if value is None or isinstance(value, str) else orjson.dumps(value, default=str).decode())
+  df.columns = [str(column) for column in df.columns]
+  return df.reset_index(drop=True)
+
+log = get_logger('result_store')
+
+class ResultStore:
+  """Full tool results kept server-side while the chat history only has their digest.
+
+  Results are stored as DataFrames with a TTL, so follow-up questions ("os próximos
+  50", "filtre pelo model X") are answered by `query` without fetching the data
+  again. When the results in memory go over `memory_mb` the least recently used
+  ones are spilled to Parquet files and read back on demand. With `shared` state the
+  results are also written there, so a handle works on every worker of the API.
+  """
+
+  def __init__(self, max_entries: int = RESULT_STORE_MAX_ENTRIES, ttl: int = RESULT_STORE_TTL,
+               memory_mb: int = RESULT_STORE_MEMORY_MB, spill_dir: str = RESULT_STORE_DIR, shared=None):
+    self.max_entries = max_entries
+    self.ttl = ttl
+    self.memory_limit = memory_mb * 1024 * 1024
+    self.spill_dir = spill_dir
+    self.shared = shared
+    self.entries = OrderedDict()
+    self.memory = 0
+    self.lock = threading.Lock()
+
+  def put(self, result) -> str:
+    """Store a tool result and return its handle, None when the result is not tabular"""
+    df = to_frame(result)
+    if df is None:
+      return None
+
+    handle = secrets.token_hex(4)
+    size = int(df.memory_usage(deep=True).sum())
+    with self.lock:
+      self.evict()
+      self.entries[handle] = {'frame': df, 'path': None, 'size': size, 'expires_at': time.monotonic() + self.ttl}
+      self.memory += size
+      while len(self.entries) > self.max_entries:
+        self.remove(next(iter(self.entries)))
+      self.spill()
+    if self.shared is not None:
+      self.shared.set('result', handle, df.to_json(orient='split', date_format='iso').encode(), self.ttl)
+    return handle
+
+  def get(self, handle: str) -> pd.DataFrame:
+    with self.lock:
+      self.evict()
+      entry = self.entries.get(handle)
+      if entry is not None:
+        self.entries.move_to_end(handle)
+        if entry['frame'] is not None:
+          return entry['frame']
+        path = entry['path']
+
+    if entry is None:
+      return self.get_shared(handle)
+    try:
+      return pd.read_parquet(path)
+    except FileNotFoundError:
+      # Expired while it was being read
+      return None
+
+  def get_shared(self, handle: str) -> pd.DataFrame:
+    """Result stored by another worker"""
+    value = self.shared.get('result', handle) if self.shared is not None else None
+    if value is None:
+      return None
+    return pd.read_json(io.StringIO(value.decode()), orient='split', dtype=False)
+
+  def query(self, handle: str, offset: int = 0, limit: int = 50, filter_column: str = None,
+            filter_value: str = None, group_by: str = None) -> pd.DataFrame:
+    """
+    Page, filter and group a stored result.
+
+    Args:
+      handle (str): Handle of the result
+      offset (int): First row of the page
+      limit (int): Rows in the page, at most RESULT_QUERY_MAX_ROWS
+      filter_column (str): Column compared to `filter_value`, as text and ignoring case
+      filter_value (str): Value the rows must have in `filter_column`
+      group_by (str): Column to count rows by, the groups are the rows of the result
+
+    Raises:
+      KeyError: When a column does not exist in the result
+    """
+    df = self.get(handle)
+    if df is None:
+      return None
+
+    for column in (filter_column, group_by):
+      if column is not None and column not in df.columns:
+        raise KeyError(f"Column {column} not found, the columns are: {', '.join(df.columns)}")
+
+    if filter_column is not None and filter_value is not None:
+      df = df[df[filter_column].astype(str).str.lower() == str(filter_value).lower()]
+    if group_by is not None:
+      df = df.groupby(group_by, dropna=False).size().reset_index(name='qtd').sort_values('qtd', ascending=False)
+
+    limit = min(limit or RESULT_QUERY_MAX_ROWS, RESULT_QUERY_MAX_ROWS)
+    return df.iloc[offset:offset + limit].reset_index(drop=True)
+
+  def spill(self):
+    for handle, entry in self.entries.items():
+      if self.memory <= self.memory_limit:
+        return
+      if entry['frame'] is None:
+        continue
+      os.makedirs(self.spill_dir, exist_ok=True)
+      path = os.path.join(self.spill_dir, f"{handle}.parquet")
+      try:
+        entry['frame'].to_parquet(path, index=False)
+      except (ImportError, OSError) as e:
+        # Without a Parquet engine or disk space the results just stay in memory
+        log.warning('Spilling result failed', handle=handle, path=path, error=str(e))
+        return
+      entry['frame'] = None
+      entry['path'] = path
+      self.memory -= entry['size']
+
+  def evict(self):
+    now = time.monotonic()
+    for handle in [handle for handle, entry in self.entries.items() if entry['expires_at'] <= now]:
+      self.remove(handle)
+
+  def remove(self, handle: str):
+    entry = self.entries.pop(handle)
+    if entry['frame'] is not None:
+      self.memory -= entry['size']
+    elif os.path.exists(entry['path']):
+      os.remove(entry['path'])
@@ -0,0 +1,138 @@
+import os
+import re
+import time
+import threading
+import numpy as np
+from dotenv import load_dotenv
+from pkg.logger import get_logger
+
+load_dotenv()
+
+# Azure deployment of the embedding model, the cache is disabled without it
+SEMANTIC_CACHE_EMBEDDING_DEPLOYMENT = os.getenv('SEMANTIC_CACHE_EMBEDDING_DEPLOYMENT')
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', 0.95))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv('SEMANTIC_CACHE_MAX_ENTRIES', 2000))
+SEMANTIC_CACHE_TTL = int(os.getenv('SEMANTIC_CACHE_TTL', 3600))
+# Per tool TTLs in seconds, e.g. "get_queue_status:600,search_documents:86400". 0 disables caching of the tool
+SEMANTIC_CACHE_TOOL_TTLS = {
+  'reprocess_queue': 0,
+  'resume_reprocess_job': 0,
+  'task_helper': 0,
+  # Handles point to results of one conversation
+  'query_result': 0,
+  **{
+    name.strip(): int(ttl)
+    for name, ttl in (item.split(':') for item in os.getenv('SEMANTIC_CACHE_TOOL_TTLS', '').split(',') if ':' in item)
+  }
+}
+
+NUMBER_PATTERN = re.compile(r'\d+')
+
+def normalize_query(query: str) -> str:
+  return ' '.join(query.lower().split())
+
+def string_values(arguments) -> list:
+  """Every string in the (nested) arguments of a tool call"""
+  if isinstance(arguments, str):
+    return [arguments.lower()]
+  if isinstance(arguments, dict):
+    arguments = list(arguments.values())
+  if isinstance(arguments, (list, tuple)):
+    return [value for item in arguments for value in string_values(item)]
+  return []
+
+log = get_logger('semantic_cache')
+
+class SemanticCache:
+  """Maps questions to the tool call the model chose for a near-duplicate question.
+
+  Embeddings are kept normalized in a NumPy matrix, so a lookup is a single matrix
+  product. A match needs a cosine similarity of at least `threshold` and has to pass
+  a guard: the numbers of both questions must be the same, and every argument value
+  that was taken from the cached question must also be in the new one. So "leia 10
+  mensagens da fila 8504" never reuses the call of "leia 20 mensagens da fila 8504".
+  """
+
+  def __init__(self, embed, threshold: float = SEMANTIC_CACHE_THRESHOLD, max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES,
+               ttl: int = SEMANTIC_CACHE_TTL, tool_ttls: dict = SEMANTIC_CACHE_TOOL_TTLS):
+    self.embed = embed
+    self.threshold = threshold
+    self.max_entries = max_entries
+    self.ttl = ttl
+    self.tool_ttls = tool_ttls
+    self.vectors = None
+    self.expires_at = np.zeros(max_entries)
+    self.entries = [None] * max_entries
+    self.next_index = 0
+    self.lock = threading.Lock()
+    self.stats = {'hits': 0, 'misses': 0, 'guarded': 0, 'stored': 0, 'errors': 0}
+
+  def lookup(self, query: str, namespace: str) -> tuple:
+    """
+    Returns ((function_name, arguments), vector) on a hit and (None, vector) on a miss.
+    The vector is passed back to `store` so the question is only embedded once.
+    """
+    try:
+      vector = self.embed(query)
+    except Exception as e:
+      log.error('Embedding query for the semantic cache failed', error=str(e))
+      self.stats['errors'] += 1
+      return None, None
+
+    vector = np.asarray(vector, dtype=np.float32)
+    vector /= np.linalg.norm(vector) or 1.0
+    normalized = normalize_query(query)
+
+    with self.lock:
+      if self.vectors is None:
+        self.stats['misses'] += 1
+        return None, vector
+
+      similarities = self.vectors @ vector
+      similarities[self.expires_at <= time.time()] = -1
+      # Best candidates first, the best one may be rejected by the guard
+      for index in np.argsort(similarities)[::-1][:5]:
+        if similarities[index] < self.threshold:
+          break
+        entry = self.entries[index]
+        if entry is None or entry['namespace'] != namespace:
+          continue
+        if not self.guard(entry, normalized):
+          self.stats['guarded'] += 1
+          continue
+        self.stats['hits'] += 1
+        return (entry['function_name'], dict(entry['arguments'])), vector
+
+      self.stats['misses'] += 1
+      return None, vector
+
+  def store(self, query: str, vector, namespace: str, function_name: str, arguments: dict):
+    ttl = self.tool_ttls.get(function_name, self.ttl)
+    if vector is None or ttl <= 0:
+      return
+
+    with self.lock:
+      if self.vectors is None:
+        self.vectors = np.zeros((self.max_entries, len(vector)), dtype=np.float32)
+
+      # Slots are reused in insertion order, expired or not
+      index = self.next_index
+      self.next_index = (self.next_index + 1) % self.max_entries
+      self.vectors[index] = vector
+      self.expires_at[index] = time.time() + ttl
+      self.entries[index] = {
+        'query': normalize_query(query),
+        'namespace': namespace,
+        'function_name': function_name,
+        'arguments': dict(arguments),
+      }
+      self.stats['stored'] += 1
+
+  def guard(self, entry: dict, query: str) -> bool:
+    if NUMBER_PATTERN.findall(entry['query']) != NUMBER_PATTERN.findall(query):
+      return False
+    # Values the model made up are fine, values copied from the question must match
+    return all(
+      (value in entry['query']) == (value in query)
+      for value in string_values(entry['arguments'])
+    )
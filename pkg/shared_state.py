@@ -0,0 +1,162 @@
+import os
+import time
+import fcntl
+import sqlite3
+import threading
+import orjson
+from dotenv import load_dotenv
+from pkg.logger import get_logger
+
+load_dotenv()
+
+# SQLite file shared by the workers of the API, state is kept per process without it
+SHARED_STATE_PATH = os.getenv('SHARED_STATE_PATH')
+SHARED_STATE_BUSY_TIMEOUT = float(os.getenv('SHARED_STATE_BUSY_TIMEOUT', 5))
+CHAT_HISTORY_TTL = int(os.getenv('CHAT_HISTORY_TTL', 86400))
+# Expired entries are deleted after this many writes of the process, reads already skip them
+SHARED_STATE_PURGE_EVERY = int(os.getenv('SHARED_STATE_PURGE_EVERY', 500))
+
+log = get_logger('shared_state')
+
+class SharedState:
+  """Key-value entries with a TTL in a SQLite file, shared by the worker processes of one host.
+
+  The database is in WAL mode so readers don't wait for the writer, and each thread
+  has its own connection. Values are bytes, callers choose the encoding.
+  """
+
+  def __init__(self, path: str, busy_timeout: float = SHARED_STATE_BUSY_TIMEOUT, purge_every: int = SHARED_STATE_PURGE_EVERY):
+    self.path = path
+    self.busy_timeout = busy_timeout
+    self.purge_every = purge_every
+    self.writes = 0
+    self.writes_lock = threading.Lock()
+    self.local = threading.local()
+    self.locks = {}
+    directory = os.path.dirname(path)
+    if directory:
+      os.makedirs(directory, exist_ok=True)
+    with self.connection() as db:
+      db.execute('PRAGMA journal_mode=WAL')
+      db.execute(
+        'CREATE TABLE IF NOT EXISTS entries ('
+        'namespace TEXT NOT NULL, key TEXT NOT NULL, value BLOB, expires_at REAL, '
+        'PRIMARY KEY (namespace, key))'
+      )
+
+  def connection(self) -> sqlite3.Connection:
+    db = getattr(self.local, 'db', None)
+    if db is None:
+      db = sqlite3.connect(self.path, timeout=self.busy_timeout)
+      db.execute('PRAGMA synchronous=NORMAL')
+      self.local.db = db
+    return db
+
+  def get(self, namespace: str, key: str) -> bytes:
+    row = self.connection().execute(
+      'SELECT value FROM entries WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)',
+      (namespace, key, time.time())
+    ).fetchone()
+    return row[0] if row else None
+
+  def set(self, namespace: str, key: str, value: bytes, ttl: float = None):
+    expires_at = time.time() + ttl if ttl else None
+    with self.connection() as db:
+      db.execute(
+        'INSERT OR REPLACE INTO entries (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)',
+        (namespace, key, value, expires_at)
+      )
+
+    with self.writes_lock:
+      self.writes += 1
+      due = self.purge_every > 0 and self.writes % self.purge_every == 0
+    if due:
+      purged = self.purge()
+      log.debug('Purged expired shared state entries', purged=purged)
+
+  def set_many(self, namespace: str, values: dict, ttl: float = None):
+    """Write several entries in one transaction"""
+    expires_at = time.time() + ttl if ttl else None
+    with self.connection() as db:
+      db.executemany(
+        'INSERT OR REPLACE INTO entries (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)',
+        [(namespace, key, value, expires_at) for key, value in values.items()]
+      )
+
+  def hold_lock(self, name: str) -> bool:
+    """Take the lock `name` until this process ends or releases it, False while another process holds it.
+
+    A file lock next to the database, so the OS releases it when its process dies.
+    """
+    if name in self.locks:
+      return True
+    handle = open(f"{self.path}.{name}.lock", 'w')
+    try:
+      fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+      handle.close()
+      return False
+    self.locks[name] = handle
+    return True
+
+  def release_lock(self, name: str):
+    handle = self.locks.pop(name, None)
+    if handle is not None:
+      fcntl.flock(handle, fcntl.LOCK_UN)
+      handle.close()
+
+  def delete(self, namespace: str, key: str):
+    with self.connection() as db:
+      db.execute('DELETE FROM entries WHERE namespace = ? AND key = ?', (namespace, key))
+
+  def purge(self) -> int:
+    """Delete the expired entries, returns how many"""
+    with self.connection() as db:
+      return db.execute('DELETE FROM entries WHERE expires_at <= ?', (time.time(),)).rowcount
+
+shared_state = SharedState(SHARED_STATE_PATH) if SHARED_STATE_PATH else None
+
+class ChatHistories:
+  """Chat histories by user ID, read from and written to the shared state when there is one.
+
+  Any worker can get the next message of a user, so a turn starts with `load`, which
+  reads the latest history, and ends with `save`. Without shared state the lists just
+  live in this process. Works as a read-only dict of the histories loaded here.
+  """
+
+  def __init__(self, state: SharedState = shared_state, ttl: int = CHAT_HISTORY_TTL):
+    self.state = state
+    self.ttl = ttl
+    self.histories = {}
+
+  def load(self, user_id: str) -> list:
+    if self.state is not None:
+      value = self.state.get('history', user_id)
+      self.histories[user_id] = orjson.loads(value) if value else []
+    return self.histories.setdefault(user_id, [])
+
+  def save(self, user_id: str):
+    if self.state is None or user_id not in self.histories:
+      return
+    try:
+      self.state.set('history', user_id, orjson.dumps(self.histories[user_id], default=str), self.ttl)
+    except sqlite3.Error as e:
+      log.error('Saving chat history failed', user_id=user_id, error=str(e))
+
+  def __setitem__(self, user_id: str, history: list):
+    self.histories[user_id] = history
+
+  def __getitem__(self, user_id: str) -> list:
+    return self.histories[user_id]
+
+  def __contains__(self, user_id: str) -> bool:
+    return user_id in self.histories
+
+  def __len__(self) -> int:
+    return len(self.histories)
+
+  def get(self, user_id: str, default=None):
+    return self.histories.get(user_id, default)
+
+  def items(self):
+    return self.histories.items()
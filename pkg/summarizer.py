@@ -0,0 +1,182 @@
+import os
+import time
+import hashlib
+import threading
+import contextvars
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+import tiktoken
+from dotenv import load_dotenv
+from pkg.telemetry import traced
+from pkg.logger import get_logger
+from pkg.request_context import call_timeout, llm_client, mark_partial
+
+load_dotenv()
+
+SUMMARY_CHUNK_TOKENS = int(os.getenv('SUMMARY_CHUNK_TOKENS', 3000))
+SUMMARY_MAX_WORKERS = int(os.getenv('SUMMARY_MAX_WORKERS', 4))
+SUMMARY_TIMEOUT = float(os.getenv('SUMMARY_TIMEOUT', 90))
+SUMMARY_CACHE_SIZE = int(os.getenv('SUMMARY_CACHE_SIZE', 512))
+
+MAP_PROMPT = """
+Please summarize part {index} of {total} of a {file_type} document.
+Keep every key fact, number, name and anomaly, the summary will be merged with the other parts later:
+
+{content}
+"""
+
+REDUCE_PROMPT = """
+Please analyze the following {file_type} content and provide a concise summary:
+
+{content}
+
+Focus on:
+1. Key information and main topics
+2. Important statistics or data points
+3. Overall insights
+4. Potential issues or anomalies
+
+Please format your response as a clear, structured summary.
+"""
+
+log = get_logger('summarizer')
+
+class Summarizer:
+  """Map-reduce summarization for contents bigger than a single prompt.
+
+  The content is split in token-bounded chunks, each chunk is summarized
+  concurrently (map) and the partial summaries are merged (reduce). Chunk
+  summaries are cached by content hash, so the same file is never
+  summarized twice.
+  """
+
+  def __init__(self, client, model: str, chunk_tokens: int = SUMMARY_CHUNK_TOKENS,
+               max_workers: int = SUMMARY_MAX_WORKERS, timeout: float = SUMMARY_TIMEOUT, usage=None):
+    self.client = client
+    self.usage = usage
+    self.model = model
+    self.chunk_tokens = chunk_tokens
+    self.max_workers = max_workers
+    self.timeout = timeout
+    self.tokenizer = tiktoken.get_encoding('cl100k_base')
+    self.cache = OrderedDict()
+    self.cache_lock = threading.Lock()
+
+  def count_tokens(self, text: str) -> int:
+    return len(self.tokenizer.encode(text))
+
+  def split_chunks(self, text: str) -> list:
+    """Split text in chunks of at most `chunk_tokens`, breaking on line boundaries when possible"""
+    chunks = []
+    current = []
+    current_tokens = 0
+
+    for line in text.splitlines(keepends=True):
+      tokens = self.tokenizer.encode(line)
+
+      if len(tokens) > self.chunk_tokens:
+        if current:
+          chunks.append(''.join(current))
+          current, current_tokens = [], 0
+        for start in range(0, len(tokens), self.chunk_tokens):
+          chunks.append(self.tokenizer.decode(tokens[start:start + self.chunk_tokens]))
+        continue
+
+      if current_tokens + len(tokens) > self.chunk_tokens:
+        chunks.append(''.join(current))
+        current, current_tokens = [], 0
+
+      current.append(line)
+      current_tokens += len(tokens)
+
+    if current:
+      chunks.append(''.join(current))
+
+    return chunks
+
+  def summarize(self, content: str, file_type: str, max_tokens: int = 800) -> str:
+    # SUMMARY_TIMEOUT, or less when the request has less time left
+    deadline = time.monotonic() + call_timeout('Azure OpenAI', self.timeout)
+
+    if self.count_tokens(content) <= self.chunk_tokens:
+      return self.complete(REDUCE_PROMPT.format(file_type=file_type, content=content), max_tokens)
+
+    chunks = self.split_chunks(content)
+    log.info('Summarizing content', file_type=file_type, chunks=len(chunks))
+    summaries = self.map_chunks(chunks, file_type, deadline)
+
+    return self.reduce(summaries, file_type, max_tokens, deadline)
+
+  def map_chunks(self, chunks: list, file_type: str, deadline: float) -> list:
+    summaries = [None] * len(chunks)
+    executor = ThreadPoolExecutor(max_workers=self.max_workers)
+    try:
+      futures = {
+        # Each chunk runs in a copy of the caller context so its spans belong to the same trace
+        executor.submit(contextvars.copy_context().run, self.summarize_chunk, chunk, index + 1, len(chunks), file_type): index
+        for index, chunk in enumerate(chunks)
+      }
+      done, not_done = wait(futures, timeout=max(deadline - time.monotonic(), 0))
+
+      for future in done:
+        index = futures[future]
+        try:
+          summaries[index] = future.result()
+        except Exception as e:
+          log.error('Summarizing chunk failed', chunk=index + 1, error=str(e))
+
+      for future in not_done:
+        future.cancel()
+      if not_done:
+        mark_partial('Azure OpenAI')
+    finally:
+      executor.shutdown(wait=False, cancel_futures=True)
+
+    return [
+      summary if summary is not None else f"[Parte {index + 1} de {len(chunks)} não pôde ser resumida a tempo]"
+      for index, summary in enumerate(summaries)
+    ]
+
+  def summarize_chunk(self, chunk: str, index: int, total: int, file_type: str) -> str:
+    key = hashlib.sha256(f"{self.model}:{file_type}:{chunk}".encode('utf-8')).hexdigest()
+    with self.cache_lock:
+      if key in self.cache:
+        self.cache.move_to_end(key)
+        return self.cache[key]
+
+    summary = self.complete(MAP_PROMPT.format(index=index, total=total, file_type=file_type, content=chunk), 400)
+
+    with self.cache_lock:
+      self.cache[key] = summary
+      while len(self.cache) > SUMMARY_CACHE_SIZE:
+        self.cache.popitem(last=False)
+
+    return summary
+
+  def reduce(self, summaries: list, file_type: str, max_tokens: int, deadline: float) -> str:
+    """Merge the chunk summaries, or just join them when the deadline passed, the merge would not finish in time"""
+    combined = '\n\n'.join(summaries)
+
+    # Partial summaries may still be too big for a single prompt, merge them in rounds
+    while self.count_tokens(combined) > self.chunk_tokens and len(summaries) > 1 and time.monotonic() < deadline:
+      summaries = self.map_chunks(self.split_chunks(combined), file_type, deadline)
+      combined = '\n\n'.join(summaries)
+
+    if time.monotonic() >= deadline:
+      log.warning('Summary deadline exceeded, returning the partial summaries', file_type=file_type, parts=len(summaries))
+      mark_partial('Azure OpenAI')
+      return f"[Resumo parcial: as partes não puderam ser consolidadas a tempo]\n\n{combined}"
+
+    return self.complete(REDUCE_PROMPT.format(file_type=file_type, content=combined), max_tokens)
+
+  @traced('llm.summary')
+  def complete(self, prompt: str, max_tokens: int) -> str:
+    response = llm_client(self.client).chat.completions.create(
+      model=self.model,
+      messages=[{'role': 'user', 'content': prompt}],
+      temperature=0.3,
+      max_tokens=max_tokens
+    )
+    if self.usage is not None:
+      self.usage.record('summary', response)
+    return response.choices[0].message.content
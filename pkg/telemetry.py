@@ -0,0 +1,165 @@
+import os
+import time
+import uuid
+import bisect
+import functools
+import threading
+import contextvars
+from collections import defaultdict
+from contextlib import contextmanager
+import orjson
+from dotenv import load_dotenv
+from pkg.logger import get_logger
+
+load_dotenv()
+
+# File the finished spans are appended to as JSON lines, no export without it
+TRACE_EXPORT_PATH = os.getenv('TRACE_EXPORT_PATH')
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+current_span = contextvars.ContextVar('current_span', default=None)
+
+log = get_logger('telemetry')
+
+class Span:
+  def __init__(self, name: str, parent: 'Span' = None, attributes: dict = None):
+    self.name = name
+    self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+    self.span_id = uuid.uuid4().hex[:16]
+    self.parent_id = parent.span_id if parent else None
+    self.attributes = attributes or {}
+    self.start = time.time()
+    self.duration = None
+    self.error = None
+
+  def set(self, key: str, value):
+    self.attributes[key] = value
+
+  def to_dict(self) -> dict:
+    return {
+      'name': self.name,
+      'trace_id': self.trace_id,
+      'span_id': self.span_id,
+      'parent_id': self.parent_id,
+      'start': self.start,
+      'duration': self.duration,
+      'error': self.error,
+      'attributes': self.attributes,
+    }
+
+class Histogram:
+  def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+    self.buckets = buckets
+    self.counts = [0] * (len(buckets) + 1)
+    self.sum = 0.0
+    self.count = 0
+
+  def observe(self, value: float):
+    self.counts[bisect.bisect_left(self.buckets, value)] += 1
+    self.sum += value
+    self.count += 1
+
+class MetricsRegistry:
+  """Counters and histograms by name and labels, rendered in the Prometheus text format"""
+
+  def __init__(self):
+    self.counters = defaultdict(float)
+    self.histograms = {}
+    self.lock = threading.Lock()
+
+  def inc(self, name: str, value: float = 1, **labels):
+    with self.lock:
+      self.counters[(name, tuple(sorted(labels.items())))] += value
+
+  def observe(self, name: str, value: float, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with self.lock:
+      if key not in self.histograms:
+        self.histograms[key] = Histogram()
+      self.histograms[key].observe(value)
+
+  def render(self) -> str:
+    lines = []
+    with self.lock:
+      for name in sorted({name for name, _ in self.counters}):
+        lines.append(f"# TYPE {name} counter")
+        for (counter_name, labels), value in sorted(self.counters.items()):
+          if counter_name == name:
+            lines.append(f"{name}{format_labels(labels)} {value:g}")
+
+      for name in sorted({name for name, _ in self.histograms}):
+        lines.append(f"# TYPE {name} histogram")
+        for (histogram_name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+          if histogram_name != name:
+            continue
+          cumulative = 0
+          for bucket, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{format_labels(labels + (('le', str(bucket)),))} {cumulative}")
+          lines.append(f"{name}_sum{format_labels(labels)} {histogram.sum:.6f}")
+          lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+    return '\n'.join(lines) + '\n'
+
+def format_labels(labels: tuple) -> str:
+  if not labels:
+    return ''
+  escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+  return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+class TraceExporter:
+  """Appends finished spans to a JSON lines file, one span per line"""
+
+  def __init__(self, path: str):
+    self.path = path
+    self.lock = threading.Lock()
+
+  def export(self, span: Span):
+    line = orjson.dumps(span.to_dict(), default=str) + b'\n'
+    with self.lock:
+      with open(self.path, 'ab') as f:
+        f.write(line)
+
+metrics = MetricsRegistry()
+exporter = TraceExporter(TRACE_EXPORT_PATH) if TRACE_EXPORT_PATH else None
+
+@contextmanager
+def span(name: str, **attributes):
+  """Time a stage of the request as a child of the current span.
+
+  The duration goes to the `alfredo_span_duration_seconds` histogram labeled by
+  span name, and the span itself to the trace exporter when one is configured.
+  """
+  current = Span(name, current_span.get(), attributes)
+  token = current_span.set(current)
+  try:
+    yield current
+  except BaseException as e:
+    current.error = f"{type(e).__name__}: {e}"
+    raise
+  finally:
+    current_span.reset(token)
+    current.duration = time.time() - current.start
+    metrics.observe('alfredo_span_duration_seconds', current.duration, span=name)
+    if current.error is not None:
+      metrics.inc('alfredo_span_errors_total', span=name)
+    if exporter is not None:
+      try:
+        exporter.export(current)
+      except OSError as e:
+        log.warning('Exporting span failed', span=name, error=str(e))
+
+def traced(name: str):
+  """Decorator running the whole function in a span"""
+  def decorator(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+      with span(name):
+        return func(*args, **kwargs)
+    return wrapper
+  return decorator
+
+def set_attribute(key: str, value):
+  """Set an attribute of the current span, if there is one"""
+  current = current_span.get()
+  if current is not None:
+    current.set(key, value)
@@ -1,19 +1,34 @@
 import os
 from dotenv import load_dotenv
 from trello import TrelloClient
+from pkg.telemetry import traced
+from pkg.resilience import http_request
 
 
 load_dotenv()
 
 TRELLO_API_SECRET = os.getenv('TRELLO_API_SECRET')
 TRELLO_API_KEY = os.getenv('TRELLO_API_KEY')
+
+
+class DeadlineHttpService:
+  """requests for py-trello, which sets no timeout, with the timeout of the request deadline and the breaker of the host"""
+
+  def request(self, method, url, **kwargs):
+    return http_request(method, url, 'Trello', **kwargs)
+
+  def post(self, url, **kwargs):
+    return self.request('POST', url, **kwargs)
+
 class Trello:
   def __init__(self):
     self.client = TrelloClient(
       api_key=TRELLO_API_KEY,
-      api_secret=TRELLO_API_SECRET
+      api_secret=TRELLO_API_SECRET,
+      http_service=DeadlineHttpService()
     )
 
+  @traced('trello.search')
   def search(self, query:str):
     cards = self.client.search(query, partial_match=True, models=['cards'], cards_limit=5)
     cards_json = []
@@ -0,0 +1,59 @@
+import threading
+from collections import defaultdict
+from pkg.telemetry import metrics, set_attribute
+
+USAGE_FIELDS = ('requests', 'prompt_tokens', 'cached_tokens', 'completion_tokens')
+
+def get_usage_value(data, name: str):
+  """Read a usage field from an SDK object or from a plain dict, None when missing"""
+  if data is None:
+    return None
+  if isinstance(data, dict):
+    return data.get(name)
+  value = getattr(data, name, None)
+  if value is None:
+    # Fields unknown to the installed SDK version are kept in model_extra
+    value = (getattr(data, 'model_extra', None) or {}).get(name)
+  return value
+
+class UsageTracker:
+  """Token usage of the chat completion calls, grouped by call (routing, summary, ...).
+
+  `cached_tokens` is the part of the prompt the provider served from its prompt
+  cache, so cached_tokens / prompt_tokens tells how much of the stable prefix is reused.
+  """
+
+  def __init__(self):
+    self.totals = defaultdict(lambda: dict.fromkeys(USAGE_FIELDS, 0))
+    self.lock = threading.Lock()
+
+  def record(self, call: str, response):
+    usage = get_usage_value(response, 'usage')
+    if usage is None:
+      return
+    details = get_usage_value(usage, 'prompt_tokens_details')
+    tokens = {
+      'prompt_tokens': get_usage_value(usage, 'prompt_tokens') or 0,
+      'cached_tokens': get_usage_value(details, 'cached_tokens') or 0,
+      'completion_tokens': get_usage_value(usage, 'completion_tokens') or 0,
+    }
+    with self.lock:
+      totals = self.totals[call]
+      totals['requests'] += 1
+      for field, value in tokens.items():
+        totals[field] += value
+
+    for field, value in tokens.items():
+      metrics.inc('alfredo_llm_tokens_total', value, call=call, type=field.replace('_tokens', ''))
+      set_attribute(field, value)
+
+  def snapshot(self) -> dict:
+    with self.lock:
+      calls = {call: dict(totals) for call, totals in self.totals.items()}
+
+    total = dict.fromkeys(USAGE_FIELDS, 0)
+    for totals in calls.values():
+      for field in USAGE_FIELDS:
+        total[field] += totals[field]
+    total['cache_hit_ratio'] = round(total['cached_tokens'] / total['prompt_tokens'], 4) if total['prompt_tokens'] else 0.0
+    return {'calls': calls, 'total': total}
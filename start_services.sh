@@ -13,9 +13,14 @@ streamlit run /app/streamlit_app.py --server.port=8501 --server.address=0.0.0.0
 # Wait for Streamlit to start
 sleep 5
 
-# Start the FastAPI server
-echo "Starting FastAPI server..."
-cd /app && uvicorn api.main:app --host 0.0.0.0 --port 8000
+# Start the FastAPI server, WEB_CONCURRENCY > 1 runs several workers sharing their state through SQLite,
+# one of them samples the queue metrics for all
+WEB_CONCURRENCY=${WEB_CONCURRENCY:-1}
+if [ "$WEB_CONCURRENCY" -gt 1 ]; then
+    export SHARED_STATE_PATH=${SHARED_STATE_PATH:-/tmp/alfredo_shared_state.db}
+fi
+echo "Starting FastAPI server with $WEB_CONCURRENCY worker(s)..."
+cd /app && uvicorn api.main:app --host 0.0.0.0 --port 8000 --workers "$WEB_CONCURRENCY"
 
 # Keep the container running
 wait
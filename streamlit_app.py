@@ -4,6 +4,7 @@ import pandas as pd
 import uuid
 
 import pkg.chatbot as chatbot_service
+from pkg.request_context import RequestContext
 
 # Initialize chatbot in session state if it doesn't exist
 if 'chatbot' not in st.session_state:
@@ -18,7 +19,7 @@ if 'user_id' not in st.session_state:
 def chat(query):
     if query:
         # Remove file_content parameter
-        return st.session_state.chatbot.chat(query, vhost, user_id=st.session_state.user_id)
+        return st.session_state.chatbot.chat(query, RequestContext(vhost, st.session_state.user_id))
 
 with st.sidebar:
     vhost = st.selectbox(
@@ -0,0 +1,140 @@
+import asyncio
+import threading
+import pytest
+from starlette.concurrency import run_in_threadpool
+from api.admission import AdmissionController, AdmissionRejected
+
+def test_slot_is_held_until_the_thread_finishes():
+  async def scenario():
+    admission = AdmissionController(max_concurrency=1, max_per_user=1)
+    finish = threading.Event()
+
+    async def slow():
+      return await run_in_threadpool(finish.wait)
+
+    try:
+      await asyncio.wait_for(admission.run('ana', None, slow), 0.05)
+    except asyncio.TimeoutError:
+      pass
+    assert admission.global_slots.locked()
+    assert 'ana' in admission.user_slots
+
+    finish.set()
+    for _ in range(100):
+      if not admission.global_slots.locked():
+        break
+      await asyncio.sleep(0.01)
+    assert not admission.global_slots.locked()
+    assert 'ana' not in admission.user_slots
+
+  asyncio.run(scenario())
+
+def test_coalesced_request_gets_the_leader_result():
+  async def scenario():
+    admission = AdmissionController()
+    release = asyncio.Event()
+
+    async def leader():
+      await release.wait()
+      return 'resposta', {'timed_out': ['RabbitMQ']}
+
+    async def follower():
+      raise AssertionError('coalesced requests must not run')
+
+    first = asyncio.ensure_future(admission.run('ana', 'key', leader))
+    await asyncio.sleep(0)
+    second = asyncio.ensure_future(admission.run('ana', 'key', follower))
+    release.set()
+    assert await first == await second == ('resposta', {'timed_out': ['RabbitMQ']})
+    assert admission.stats['coalesced'] == 1
+
+  asyncio.run(scenario())
+
+def test_coalesced_requests_time_out_when_the_leader_is_cancelled():
+  async def scenario():
+    admission = AdmissionController()
+    release = asyncio.Event()
+
+    async def leader():
+      await release.wait()
+      return 'resposta'
+
+    first = asyncio.ensure_future(asyncio.wait_for(admission.run('ana', 'key', leader), 0.05))
+    await asyncio.sleep(0)
+    second = asyncio.ensure_future(admission.run('ana', 'key', leader))
+
+    with pytest.raises(asyncio.TimeoutError):
+      await first
+    with pytest.raises(asyncio.TimeoutError):
+      await second
+    release.set()
+
+  asyncio.run(scenario())
+
+def test_requests_wait_behind_the_limit_and_run_in_turn():
+  async def scenario():
+    admission = AdmissionController(max_concurrency=1, max_per_user=1, max_queue=4, queue_timeout=5)
+    release = asyncio.Event()
+    order = []
+
+    async def work(name):
+      order.append(name)
+      await release.wait()
+      return name
+
+    first = asyncio.ensure_future(admission.run('ana', None, lambda: work('first')))
+    second = asyncio.ensure_future(admission.run('bia', None, lambda: work('second')))
+    await asyncio.sleep(0.01)
+    assert order == ['first']
+    assert admission.waiting == 1
+
+    release.set()
+    assert await first == 'first'
+    assert await second == 'second'
+    assert order == ['first', 'second']
+    assert admission.waiting == 0
+
+  asyncio.run(scenario())
+
+def test_full_queue_is_rejected():
+  async def scenario():
+    admission = AdmissionController(max_concurrency=1, max_per_user=1, max_queue=1, queue_timeout=5)
+    release = asyncio.Event()
+
+    async def work():
+      await release.wait()
+
+    running = asyncio.ensure_future(admission.run('ana', None, work))
+    queued = asyncio.ensure_future(admission.run('bia', None, work))
+    await asyncio.sleep(0.01)
+
+    with pytest.raises(AdmissionRejected) as rejected:
+      await admission.run('caio', None, work)
+    assert rejected.value.retry_after == 5
+    assert admission.stats['rejected'] == 1
+
+    release.set()
+    await asyncio.gather(running, queued)
+
+  asyncio.run(scenario())
+
+def test_request_waiting_too_long_is_rejected():
+  async def scenario():
+    admission = AdmissionController(max_concurrency=2, max_per_user=1, max_queue=4, queue_timeout=0.05)
+    release = asyncio.Event()
+
+    async def work():
+      await release.wait()
+
+    running = asyncio.ensure_future(admission.run('ana', None, work))
+    await asyncio.sleep(0)
+    # The global limit has room, the per-user one doesn't
+    with pytest.raises(AdmissionRejected, match='Timed out'):
+      await admission.run('ana', None, work)
+    assert admission.user_requests == {'ana': 1}
+
+    release.set()
+    await running
+    assert admission.user_slots == {}
+
+  asyncio.run(scenario())
@@ -0,0 +1,27 @@
+import httpx
+from pkg.chatbot import Chatbot, azure_client
+from pkg.usage import UsageTracker
+
+def test_embed_query_goes_to_embedding_deployment(monkeypatch):
+  monkeypatch.setenv('AZURE_OPENAI_ENDPOINT', 'https://alfredo.openai.azure.com')
+  monkeypatch.setenv('AZURE_OPENAI_API_KEY', 'test')
+  monkeypatch.setenv('AZURE_AP_VERSION', '2024-02-01')
+  monkeypatch.setattr('pkg.chatbot.SEMANTIC_CACHE_EMBEDDING_DEPLOYMENT', 'embedding')
+  urls = []
+
+  def handler(request: httpx.Request) -> httpx.Response:
+    urls.append(str(request.url))
+    return httpx.Response(200, json={
+      'object': 'list',
+      'model': 'embedding',
+      'data': [{'object': 'embedding', 'index': 0, 'embedding': [0.1, 0.2]}],
+      'usage': {'prompt_tokens': 1, 'total_tokens': 1},
+    })
+
+  chatbot = Chatbot.__new__(Chatbot)
+  chatbot.client = azure_client('gpt-4o')
+  chatbot.embedding_client = azure_client('embedding').with_options(http_client=httpx.Client(transport=httpx.MockTransport(handler)))
+  chatbot.usage = UsageTracker()
+
+  assert chatbot.embed_query('fila sync') == [0.1, 0.2]
+  assert urls == ['https://alfredo.openai.azure.com/openai/deployments/embedding/embeddings?api-version=2024-02-01']
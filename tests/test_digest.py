@@ -0,0 +1,19 @@
+import pandas as pd
+from pkg.digest import describe_dataframe
+
+def test_rows_with_the_biggest_counts_are_kept():
+  df = pd.DataFrame({'model': [f"model_{index}" for index in range(100)], 'qtd': range(100)})
+  header, lines = describe_dataframe(df)
+
+  assert header == 'DataFrame with 100 rows, columns: model, qtd'
+  assert lines[0] == 'total qtd: 4950'
+  assert lines[2] == 'model_99,99'
+  assert len(lines) == 52
+
+def test_counts_read_as_text_are_ranked_as_numbers():
+  df = pd.DataFrame({'model': ['a', 'b', 'c', 'd'], 'qtd': ['9', '10', None, 'n/a']})
+  _, lines = describe_dataframe(df)
+
+  assert lines[0] == 'total qtd: 19.0'
+  assert lines[2:4] == ['b,10', 'a,9']
+  assert len(lines) == 6
@@ -0,0 +1,31 @@
+import time
+from urllib.parse import urlparse, parse_qs
+from api.downloads import DownloadStore
+
+def link_params(url: str):
+  query = parse_qs(urlparse(url).query)
+  return int(query['expires'][0]), query['signature'][0]
+
+def test_signed_link_is_valid_until_it_expires():
+  store = DownloadStore(ttl=60, shared=None, signing_key='secret')
+  download_id = store.put(lambda: iter([b'a,b\n']), 'text/csv', 'resultado.csv')
+  url = store.url('https://alfredo.example.com', download_id)
+  expires, signature = link_params(url)
+
+  assert url.startswith(f"https://alfredo.example.com/downloads/{download_id}?")
+  assert store.verify(download_id, expires, signature)
+  assert not store.verify('other', expires, signature)
+  assert not store.verify(download_id, expires + 60, signature)
+  assert not store.verify(download_id, int(time.time()) - 1, store.sign(download_id, int(time.time()) - 1))
+
+def test_links_are_rejected_without_a_signing_key():
+  store = DownloadStore(shared=None, signing_key=None)
+  assert not store.verify('id', int(time.time()) + 60, '')
+
+def test_large_results_get_no_link_without_a_signing_key(monkeypatch):
+  import pandas as pd
+  from api.formatters import response_translator
+  monkeypatch.setattr(response_translator, 'download_store', DownloadStore(shared=None, signing_key=None))
+  message = response_translator.translate_response(pd.DataFrame({'qtd': range(500)}), download_base_url='https://alfredo.example.com')
+
+  assert '/downloads/' not in message['text']
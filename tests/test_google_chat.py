@@ -0,0 +1,36 @@
+import pytest
+from api.formatters.google_chat import split_message
+
+def test_short_message_is_one_part():
+  assert split_message('Fila sync_to_mongo com 10 mensagens', 100) == ['Fila sync_to_mongo com 10 mensagens']
+
+def test_parts_end_at_line_breaks_and_fit():
+  text = '\n'.join(f"- fila sync_{index:03d}: {index * 7} mensagens, situação ok" for index in range(200))
+  parts = split_message(text, 500)
+  assert len(parts) > 1
+  assert all(len(part.encode('utf-8')) <= 500 for part in parts)
+  assert '\n'.join(parts) == text
+
+def test_cut_code_block_is_closed_and_reopened():
+  text = 'Resultado:\n```json\n' + '\n'.join(f'{{"ação": "reprocessar", "índice": {index}}}' for index in range(100)) + '\n```\nFim'
+  parts = split_message(text, 400)
+  assert len(parts) > 2
+  for part in parts:
+    assert part.count('```') % 2 == 0
+    assert len(part.encode('utf-8')) <= 400
+  for part in parts[1:-1]:
+    assert part.startswith('```json\n')
+    assert part.endswith('\n```')
+
+@pytest.mark.parametrize('max_bytes', [1, 3, 40, 67, 68, 100])
+def test_multibyte_text_with_small_parts_makes_progress(max_bytes):
+  text = 'ção ' * 20
+  parts = split_message(text, max_bytes)
+  assert ''.join(parts) == text
+
+def test_long_line_is_cut_without_line_breaks():
+  text = 'é' * 3000
+  parts = split_message(text, 1000)
+  assert len(parts) > 1
+  assert all('\n' not in part for part in parts)
+  assert ''.join(parts) == text
@@ -0,0 +1,31 @@
+import pytest
+from pkg.intent_router import IntentRouter
+
+# The example questions of streamlit_app.py
+@pytest.mark.parametrize('question, expected', [
+  ('Quais são as coleções com erro?', ('summarize_collections_with_error', {})),
+  ('Quantas mensagens existem nas filas?', ('get_queue_status', {})),
+  ('Quais são as mensagens da fila sync_to_mongo?', ('get_queue_messages', {'queue_name': 'sync_to_mongo'})),
+  ('Quais clientes possuem fotos com erro?', ('summarize_pictures_by_status', {'status': 'error'})),
+  ('Quais clientes possuem fotos pendentes?', ('summarize_pictures_by_status', {'status': 'pending'})),
+  ('Leia 10 mensagens da fila sync_to_mongo', ('get_queue_messages', {'queue_name': 'sync_to_mongo', 'limit': 10})),
+  (
+    'Leia 10 mensagens da fila 8504 filtrando pelo cliente 42',
+    ('get_queue_messages', {'queue_name': '8504', 'limit': 10, 'gpa_code': 42})
+  ),
+  ('Resuma 100 mensagens da fila sync_to_mongo-dlq', ('summarize_queue_messages', {'queue_name': 'sync_to_mongo-dlq', 'limit': 100})),
+  ('Quantas mensagens há na fila sync_to_postgres?', ('get_queue_status', {'queue_name': 'sync_to_postgres'})),
+])
+def test_routine_questions_are_routed(question, expected):
+  assert IntentRouter().route(question) == expected
+
+@pytest.mark.parametrize('question', [
+  'Liste os commits do repositorio alfredo filtrando por label deploy e status closed',
+  'Qual comando usar para reiniciar o sync?',
+  'Sobre a tarefa 123, quais os principais detalhes?',
+  'Leia 10 mensagens da fila sync_to_mongo e compare com ontem',
+])
+def test_other_questions_go_to_the_llm(question):
+  router = IntentRouter()
+  assert router.route(question) is None
+  assert router.stats['misses'] == 1
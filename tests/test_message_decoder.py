@@ -0,0 +1,41 @@
+import base64
+import orjson
+from pkg.message_decoder import MessageDecoder, DecodeStats, decode_payload
+
+def envelope(message: dict) -> str:
+  return orjson.dumps({'payload': base64.b64encode(orjson.dumps(message)).decode()}).decode()
+
+def raws(count: int) -> list:
+  bodies = [envelope({'id': index}) if index % 2 else orjson.dumps({'id': index}).decode() for index in range(count)]
+  bodies[3] = '{broken'
+  return bodies
+
+def test_decode_payload_reads_plain_messages_and_envelopes():
+  assert decode_payload(b'{"id": 1}') == ({'id': 1}, 'plain', None)
+  assert decode_payload(envelope({'id': 2})) == ({'id': 2}, 'envelope', None)
+  assert decode_payload('{"payload": "not base64!"}') == ({'payload': 'not base64!'}, 'plain', None)
+  message, status, error = decode_payload('{broken')
+  assert (message, status) == ('{broken', 'json_error') and error
+
+def test_pool_and_inline_decode_give_the_same_result():
+  bodies = raws(40)
+  inline_stats, pool_stats = DecodeStats(), DecodeStats()
+  inline = MessageDecoder(workers=1).decode(bodies, inline_stats)
+  decoder = MessageDecoder(workers=2, batch_size=8, parallel_threshold=10)
+  try:
+    futures = decoder.submit(bodies)
+    assert len(futures) == 5
+    pooled = decoder.collect(futures, pool_stats)
+  finally:
+    decoder.shutdown()
+
+  assert pooled == inline
+  assert pooled[1] == {'id': 1} and pooled[2] == {'id': 2}
+  assert pool_stats.to_dict() == inline_stats.to_dict()
+  assert pool_stats.failed == 1
+  assert pool_stats.errors[0]['index'] == 3
+
+def test_small_reads_are_decoded_inline():
+  decoder = MessageDecoder(workers=2, parallel_threshold=10)
+  decoder.decode(raws(5), DecodeStats())
+  assert decoder.pool is None
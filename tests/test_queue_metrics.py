@@ -0,0 +1,36 @@
+from pkg.queue_metrics import QueueMetricsStore, QueueMetricsSampler
+from pkg.shared_state import SharedState
+
+def worker(path) -> QueueMetricsSampler:
+  """Store and sampler of one API worker, each with its own connection to the shared state"""
+  store = QueueMetricsStore(raw_points=3, downsample=2, downsampled_points=4, shared=SharedState(str(path)))
+  return QueueMetricsSampler(store, vhosts=['aqila'])
+
+def test_one_worker_samples_and_every_worker_reads_its_series(tmp_path):
+  first, second = worker(tmp_path / 'state.db'), worker(tmp_path / 'state.db')
+  assert first.is_sampling_worker()
+  assert not second.is_sampling_worker()
+
+  for minute in range(5):
+    first.store.record('aqila', 'sync_to_mongo', minute * 60, minute * 10, 1)
+  first.store.flush()
+
+  assert second.store.history('aqila', 'sync_to_mongo') == first.store.history('aqila', 'sync_to_mongo')
+  assert second.store.trend('aqila', 'sync_to_mongo', window=10 ** 10)['last_depth'] == 40
+
+def test_next_worker_continues_the_series(tmp_path):
+  first, second = worker(tmp_path / 'state.db'), worker(tmp_path / 'state.db')
+  assert first.is_sampling_worker()
+  first.store.record('aqila', 'sync_to_mongo', 0, 10, 1)
+  first.store.record('aqila', 'sync_to_mongo', 60, 20, 1)
+  first.store.flush()
+  first.store.shared.release_lock('queue_metrics')
+
+  assert second.is_sampling_worker()
+  second.store.record('aqila', 'sync_to_mongo', 120, 30, 1)
+  assert [point[1] for point in second.store.history('aqila', 'sync_to_mongo')] == [10, 20, 30]
+
+def test_without_shared_state_every_worker_samples():
+  sampler = QueueMetricsSampler(QueueMetricsStore(shared=None), vhosts=['aqila'])
+  assert sampler.is_sampling_worker()
+  sampler.store.flush()
@@ -0,0 +1,78 @@
+import time
+import socket
+import subprocess
+import sys
+from pkg.rabbit import Rabbit
+from pkg.reprocess_jobs import ReprocessJobEngine, ReprocessJob
+
+def engine(jobs_dir, submitted: list) -> ReprocessJobEngine:
+  engine = ReprocessJobEngine(jobs_dir=str(jobs_dir))
+  engine.executor.submit = lambda func, job: submitted.append((engine, job.id))
+  return engine
+
+def dead_owner() -> str:
+  process = subprocess.Popen([sys.executable, '-c', 'pass'])
+  process.wait()
+  return f"{socket.gethostname()}:{process.pid}:0"
+
+def test_only_one_worker_resumes_an_interrupted_job(tmp_path):
+  job = ReprocessJob('aqila', 'sync_to_mongo-dlq', 'sync_to_mongo', 100, job_id='abc123', owner=dead_owner())
+  job.status = 'running'
+  writer = ReprocessJobEngine(jobs_dir=str(tmp_path))
+  writer.checkpoint(job)
+
+  submitted = []
+  first, second = engine(tmp_path, submitted), engine(tmp_path, submitted)
+  assert first.get('abc123').status == 'interrupted'
+  assert second.get('abc123').status == 'interrupted'
+
+  first.resume('abc123')
+  second.resume('abc123')
+
+  assert submitted == [(first, 'abc123')]
+  assert second.get('abc123').status == 'pending'
+
+def test_failed_job_can_be_resumed_again(tmp_path):
+  job = ReprocessJob('aqila', 'sync_to_mongo-dlq', 'sync_to_mongo', 100, job_id='abc123')
+  job.status = 'failed'
+  ReprocessJobEngine(jobs_dir=str(tmp_path)).checkpoint(job)
+
+  submitted = []
+  worker = engine(tmp_path, submitted)
+  worker.resume('abc123')
+  job = worker.get('abc123')
+  job.status = 'failed'
+  worker.checkpoint(job)
+  worker.resume('abc123')
+
+  assert submitted == [(worker, 'abc123'), (worker, 'abc123')]
+
+def test_job_of_a_live_worker_is_not_resumed(tmp_path):
+  submitted = []
+  owner = engine(tmp_path, submitted)
+  job = owner.submit('aqila', 'sync_to_mongo-dlq', limit=100)
+
+  other = engine(tmp_path, submitted)
+  assert other.get(job.id).status == 'pending'
+  assert other.resume(job.id).status == 'pending'
+  assert submitted == [(owner, job.id)]
+
+def test_job_without_heartbeat_is_interrupted(tmp_path):
+  job = ReprocessJob('aqila', 'sync_to_mongo-dlq', 'sync_to_mongo', 100, job_id='abc123', owner='other-host:1:0')
+  job.status = 'running'
+  ReprocessJobEngine(jobs_dir=str(tmp_path)).checkpoint(job)
+
+  worker = ReprocessJobEngine(jobs_dir=str(tmp_path), stale_after=60)
+  assert worker.get('abc123').status == 'running'
+
+  worker = ReprocessJobEngine(jobs_dir=str(tmp_path), stale_after=0.01)
+  time.sleep(0.02)
+  assert worker.get('abc123').status == 'interrupted'
+
+def test_submit_of_an_unknown_queue_starts_no_job(tmp_path, monkeypatch):
+  monkeypatch.setattr(Rabbit, 'get_queue_status', lambda self, *args, **kwargs: None)
+  submitted = []
+  worker = engine(tmp_path, submitted)
+
+  assert worker.submit('aqila', 'unknown-dlq') is None
+  assert submitted == []
@@ -0,0 +1,56 @@
+import pytest
+import requests
+from pkg import resilience
+from pkg.request_context import RequestContext, DeadlineExceeded, current_context
+
+class TimingOutSession:
+  def __init__(self):
+    self.timeouts = []
+
+  def request(self, method, url, timeout=None, **kwargs):
+    self.timeouts.append(timeout)
+    raise requests.Timeout()
+
+@pytest.fixture
+def breaker_name(request):
+  name = f"test {request.node.name}"
+  yield name
+  resilience.breakers.pop(name, None)
+
+def run_with_deadline(seconds, func):
+  token = current_context.set(RequestContext('aqila', timeout=seconds))
+  try:
+    return func()
+  finally:
+    current_context.reset(token)
+
+def test_timeout_cut_short_by_deadline_is_not_a_failure(breaker_name):
+  session = TimingOutSession()
+  for _ in range(resilience.CIRCUIT_FAILURE_THRESHOLD + 1):
+    with pytest.raises(DeadlineExceeded):
+      run_with_deadline(0.5, lambda: resilience.http_request('GET', 'http://rabbit/api', 'RabbitMQ', session=session, breaker=breaker_name))
+
+  assert all(timeout <= 0.5 for timeout in session.timeouts)
+  assert resilience.get_breaker(breaker_name).snapshot() == {'state': 'closed', 'failures': 0}
+
+def test_timeout_with_full_timeout_opens_circuit(breaker_name):
+  session = TimingOutSession()
+  for _ in range(resilience.CIRCUIT_FAILURE_THRESHOLD):
+    with pytest.raises(DeadlineExceeded):
+      resilience.http_request('GET', 'http://rabbit/api', 'RabbitMQ', session=session, breaker=breaker_name)
+
+  with pytest.raises(resilience.CircuitOpen):
+    resilience.http_request('GET', 'http://rabbit/api', 'RabbitMQ', session=session, breaker=breaker_name)
+  assert len(session.timeouts) == resilience.CIRCUIT_FAILURE_THRESHOLD
+
+def test_circuit_counts_deadline_only_with_full_timeout(breaker_name):
+  for _ in range(resilience.CIRCUIT_FAILURE_THRESHOLD + 1):
+    with pytest.raises(DeadlineExceeded):
+      with resilience.circuit(breaker_name, timeout=0.5):
+        raise DeadlineExceeded('MongoDB')
+  assert resilience.get_breaker(breaker_name).state == resilience.CLOSED
+
+  with pytest.raises(DeadlineExceeded):
+    with resilience.circuit(breaker_name, timeout=resilience.OUTBOUND_TIMEOUT):
+      raise DeadlineExceeded('MongoDB')
+  assert resilience.get_breaker(breaker_name).failures == 1
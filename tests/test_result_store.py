@@ -0,0 +1,49 @@
+import pandas as pd
+import pytest
+from pkg.result_store import ResultStore
+
+def messages(count: int) -> list:
+  return [{'id': index, 'config': {'gpa_code': index % 3, 'model': 'pedido'}} for index in range(count)]
+
+def test_query_pages_filters_and_groups(tmp_path):
+  store = ResultStore(spill_dir=str(tmp_path))
+  handle = store.put(messages(120))
+
+  assert list(store.query(handle, offset=100, limit=50)['id']) == list(range(100, 120))
+  assert len(store.query(handle, filter_column='config.gpa_code', filter_value='1')) == 40
+  grouped = store.query(handle, group_by='config.gpa_code')
+  assert list(grouped['qtd']) == [40, 40, 40]
+  with pytest.raises(KeyError, match='config.model'):
+    store.query(handle, group_by='model')
+
+@pytest.fixture
+def parquet(monkeypatch):
+  """Pickle in place of the Parquet engine, the store only needs the round trip"""
+  monkeypatch.setattr(pd.DataFrame, 'to_parquet', lambda self, path, index=False: self.to_pickle(path))
+  monkeypatch.setattr(pd, 'read_parquet', pd.read_pickle)
+
+def test_least_recently_used_result_is_spilled_and_read_back(tmp_path, parquet):
+  store = ResultStore(memory_mb=0, spill_dir=str(tmp_path))
+  first = store.put(messages(50))
+  second = store.put(messages(10))
+
+  assert store.entries[first]['frame'] is None
+  assert (tmp_path / f"{first}.parquet").exists()
+  assert list(store.get(first)['id']) == list(range(50))
+  assert list(store.get(second)['id']) == list(range(10))
+
+def test_results_stay_in_memory_without_a_parquet_engine(tmp_path, monkeypatch):
+  def no_engine(self, *args, **kwargs):
+    raise ImportError('Unable to find a usable engine')
+  monkeypatch.setattr(pd.DataFrame, 'to_parquet', no_engine)
+  store = ResultStore(memory_mb=0, spill_dir=str(tmp_path))
+  handle = store.put(messages(50))
+
+  assert store.entries[handle]['frame'] is not None
+  assert list(store.get(handle)['id']) == list(range(50))
+
+def test_expired_result_is_removed(tmp_path):
+  store = ResultStore(ttl=0, spill_dir=str(tmp_path))
+  handle = store.put(messages(5))
+  assert store.get(handle) is None
+  assert store.put('texto') is None
@@ -0,0 +1,67 @@
+import time
+import numpy as np
+from pkg.semantic_cache import SemanticCache
+
+VECTORS = {
+  'quantas mensagens tem a fila sync_to_mongo': [1.0, 0.0, 0.0],
+  'quantas mensagens há na fila sync_to_mongo': [0.99, 0.1, 0.0],
+  'qual o status da fila sync_to_mongo': [0.8, 0.6, 0.0],
+  'leia 10 mensagens da fila 8504': [0.0, 0.0, 1.0],
+  'leia 20 mensagens da fila 8504': [0.0, 0.0, 1.0],
+  'liste os jobs de reprocessamento': [0.0, 1.0, 0.0],
+}
+
+def cache(**kwargs) -> SemanticCache:
+  return SemanticCache(lambda query: np.array(VECTORS[query]), tool_ttls={}, **kwargs)
+
+def remember(cache: SemanticCache, query: str, function_name: str, arguments: dict):
+  _, vector = cache.lookup(query, 'aqila')
+  cache.store(query, vector, 'aqila', function_name, arguments)
+
+def test_near_duplicate_question_reuses_the_tool_call():
+  semantic_cache = cache(threshold=0.95)
+  remember(semantic_cache, 'quantas mensagens tem a fila sync_to_mongo', 'get_queue_status', {'queue_name': 'sync_to_mongo'})
+
+  routed, _ = semantic_cache.lookup('quantas mensagens há na fila sync_to_mongo', 'aqila')
+  assert routed == ('get_queue_status', {'queue_name': 'sync_to_mongo'})
+  assert semantic_cache.stats['hits'] == 1
+
+def test_other_question_or_namespace_is_a_miss():
+  semantic_cache = cache(threshold=0.95)
+  remember(semantic_cache, 'quantas mensagens tem a fila sync_to_mongo', 'get_queue_status', {'queue_name': 'sync_to_mongo'})
+
+  assert semantic_cache.lookup('liste os jobs de reprocessamento', 'aqila')[0] is None
+  assert semantic_cache.lookup('quantas mensagens há na fila sync_to_mongo', 'aqila-hml')[0] is None
+
+def test_similarity_below_the_threshold_is_a_miss():
+  semantic_cache = cache(threshold=0.95)
+  remember(semantic_cache, 'quantas mensagens tem a fila sync_to_mongo', 'get_queue_status', {'queue_name': 'sync_to_mongo'})
+
+  # Cosine similarity 0.8
+  assert semantic_cache.lookup('qual o status da fila sync_to_mongo', 'aqila')[0] is None
+  semantic_cache.threshold = 0.75
+  assert semantic_cache.lookup('qual o status da fila sync_to_mongo', 'aqila')[0] is not None
+
+def test_different_numbers_are_guarded():
+  semantic_cache = cache()
+  remember(semantic_cache, 'leia 10 mensagens da fila 8504', 'get_queue_messages', {'queue_name': '8504', 'limit': 10})
+
+  assert semantic_cache.lookup('leia 20 mensagens da fila 8504', 'aqila')[0] is None
+  assert semantic_cache.stats['guarded'] == 1
+
+def test_oldest_entry_is_evicted_when_full():
+  semantic_cache = cache(max_entries=2)
+  remember(semantic_cache, 'quantas mensagens tem a fila sync_to_mongo', 'get_queue_status', {'queue_name': 'sync_to_mongo'})
+  remember(semantic_cache, 'leia 10 mensagens da fila 8504', 'get_queue_messages', {'queue_name': '8504', 'limit': 10})
+  remember(semantic_cache, 'liste os jobs de reprocessamento', 'list_reprocess_jobs', {})
+
+  assert semantic_cache.lookup('quantas mensagens tem a fila sync_to_mongo', 'aqila')[0] is None
+  assert semantic_cache.lookup('leia 10 mensagens da fila 8504', 'aqila')[0] is not None
+  assert semantic_cache.lookup('liste os jobs de reprocessamento', 'aqila')[0] is not None
+
+def test_expired_entry_is_a_miss():
+  semantic_cache = cache(ttl=0.01)
+  remember(semantic_cache, 'quantas mensagens tem a fila sync_to_mongo', 'get_queue_status', {'queue_name': 'sync_to_mongo'})
+  time.sleep(0.02)
+
+  assert semantic_cache.lookup('quantas mensagens tem a fila sync_to_mongo', 'aqila')[0] is None
@@ -0,0 +1,27 @@
+import time
+from pkg.shared_state import SharedState
+
+def count_entries(state: SharedState) -> int:
+  return state.connection().execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+def test_purge_deletes_only_expired_entries(tmp_path):
+  state = SharedState(str(tmp_path / 'state.db'), purge_every=0)
+  state.set('history', 'expired', b'[]', ttl=0.01)
+  state.set('history', 'alive', b'[]', ttl=60)
+  state.set('download', 'forever', b'data')
+  time.sleep(0.02)
+
+  assert state.purge() == 1
+  assert count_entries(state) == 2
+  assert state.get('history', 'alive') == b'[]'
+
+def test_set_purges_every_n_writes(tmp_path):
+  state = SharedState(str(tmp_path / 'state.db'), purge_every=3)
+  state.set('history', 'a', b'[]', ttl=0.01)
+  state.set('history', 'b', b'[]', ttl=0.01)
+  time.sleep(0.02)
+  assert count_entries(state) == 2
+
+  state.set('history', 'c', b'[]', ttl=60)
+  assert count_entries(state) == 1
+  assert state.get('history', 'c') == b'[]'
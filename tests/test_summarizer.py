@@ -0,0 +1,31 @@
+import time
+import tiktoken
+from pkg.summarizer import Summarizer
+from pkg.request_context import RequestContext, current_context
+
+class CharEncoding:
+  """One token per character, so the tests don't download the real encoding"""
+
+  def encode(self, text: str) -> list:
+    return [ord(char) for char in text]
+
+  def decode(self, tokens: list) -> str:
+    return ''.join(chr(token) for token in tokens)
+
+class FailingClient:
+  def with_options(self, **kwargs):
+    raise AssertionError('no LLM call is expected after the deadline')
+
+def test_reduce_after_the_deadline_returns_the_partial_summaries(monkeypatch):
+  monkeypatch.setattr(tiktoken, 'get_encoding', lambda name: CharEncoding())
+  summarizer = Summarizer(FailingClient(), 'gpt-4o', chunk_tokens=1000)
+  ctx = RequestContext('/', 'ana')
+  token = current_context.set(ctx)
+  try:
+    summary = summarizer.reduce(['parte 1', 'parte 2'], 'csv', 800, time.monotonic() - 1)
+  finally:
+    current_context.reset(token)
+
+  assert summary.startswith('[Resumo parcial')
+  assert summary.endswith('parte 1\n\nparte 2')
+  assert ctx.timed_out == ['Azure OpenAI']